@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+#
+# fenugrec 2025
+#
+# benchmarks for the parsing / unchunking / extraction hot paths
+#
+'''
+All inputs are synthetic and deterministic (seeded), so runs on different
+versions of the code are comparable :
+    - :syst:data? blobs, for several pod layouts / label masks
+    - chunked firmware images ('00 FE' blocks, HFSLIF header), several sizes
+    - config files with many sections, relocatable objects with many blocks
+
+Each benchmark is run in repeats of at least --min-time seconds; the best and
+median time per call are kept. Results can be saved as JSON and compared with
+a previous run; anything slower by more than --threshold is flagged.
+
+Examples:
+    python bench.py                                 run everything, print a table
+    python bench.py -k unchunk -k identify          only benchmarks matching these
+    python bench.py -o bench-$(git rev-parse --short HEAD).json
+    python bench.py --compare bench-1234abc.json    run, and compare with an older run
+    python bench.py --compare old.json --against new.json     compare two saved runs
+'''
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'romdumper_helper'))
+
+import chunking
+import file_id
+import hfslif
+import unpack_payload
+
+# batchcapture needs pyvisa; without it, only its benchmarks are skipped
+try:
+    import batchcapture
+except ImportError as e:
+    batchcapture = None
+    batchcapture_err = e
+
+
+#######################################
+#   synthetic data
+#######################################
+
+# pod layouts for :syst:data? blobs. Masks cover all pods, pod n at bits 16*(n-1),
+# i.e. what batchcapture.get_mask() returns.
+#   podpairs, address mask, data mask, datawidth
+layouts = {
+    # A0-15 on pod 1, A16-23 on pod 2, D0-15 on pod 3, 4 pod pairs : la_sim's original
+    # single-machine layout, now the same as machine 1 of 'la_sim.py --layout dual'
+    'deep-3pod': (4, 0x00ff_ffff, 0xffff << 32, 2),
+    # labels split across pods, with holes
+    'scattered': (4, 0x0fff | (0xfff0 << 16), (0x00ff << 64) | (0xff00 << 96), 2),
+    # smallest frame : 1 pod pair
+    'small-2pod': (1, 0xffff, 0xffff << 16, 2),
+    # 32-bit address and data
+    'wide-32bit': (4, 0xffff_ffff, 0xffff_ffff << 32, 4),
+}
+
+# bit positions set in 'mask', lowest first
+def mask_bits(mask):
+    return [b for b in range(mask.bit_length()) if (mask >> b) & 1]
+
+# inverse of batchcapture.unshift_rawdata : spread the bits of 'v' over 'bits'
+def deposit(v, bits):
+    out = 0
+    for i, b in enumerate(bits):
+        if (v >> i) & 1:
+            out |= 1 << b
+    return out
+
+# DATA section as returned by :syst:data?, 'rows' consecutive fetches starting at 'start'.
+# Returns (blob, addr_mask, data_mask, datawidth)
+def syst_data(layout, rows=8192, start=0x10000, seed=1):
+    podpairs, am, dm, datawidth = layouts[layout]
+    rng = random.Random(seed)
+    bpr = 2 + 4 * podpairs
+    abits = mask_bits(am)
+    dbits = mask_bits(dm)
+    noise_mask = ((1 << (8 * bpr)) - 1) & ~(am | dm)
+    body = bytearray()
+    a = start
+    for i in range(rows):
+        d = rng.getrandbits(8 * datawidth)
+        row = (rng.getrandbits(8 * bpr) & noise_mask) | deposit(a, abits) | deposit(d, dbits)
+        body += row.to_bytes(bpr)
+        a += datawidth
+    pre = bytearray(176 - 16)
+    pre[3] = podpairs
+    pre[6:8] = ((1 << (2 * podpairs)) - 1).to_bytes(2)
+    struct.pack_into('>8H', pre, 110 - 16, *([rows] * podpairs + [0] * (8 - podpairs)))
+    sec = bytes(pre) + bytes(body)
+    return (b'DATA      \x00\x20' + struct.pack('>I', len(sec)) + sec, am, dm, datawidth)
+
+def payload(size, seed=1):
+    return random.Random(seed).getrandbits(8 * size).to_bytes(size)
+
+# firmware image : chunked payload with an HFSLIF header
+def firmware_image(size, seed=1):
+    f = io.BytesIO()
+    hfslif.write_hfs(f, 'SYSTEM', payload(size, seed), ftype=-0x3cee)
+    return f.getvalue()
+
+# chunked config file with 'nsections' sections : CONFIG first, INVASM last
+def config_file(nsections, seed=1, module_id=32):
+    rng = random.Random(seed)
+    body = bytearray()
+    for i in range(nsections - 1):
+        name = 'CONFIG' if not i else f"SEC{i}"
+        n = rng.randrange(0x20, 0x400)
+        body += name.ljust(10).encode() + bytes([0, module_id]) + struct.pack('>I', n)
+        body += rng.getrandbits(8 * n).to_bytes(n)
+    ia = b'I68000    \x00'
+    body += b'INVASM    ' + bytes([0, module_id]) + struct.pack('>I', len(ia)) + ia
+    d = b'bench config'.ljust(32) + bytes(body) + bytes(16)
+    return chunking.chunk(struct.pack('>I', len(d)) + d)
+
+# relocatable object with 'nblocks' length-prefixed blocks, as reloc_object guesses them
+def reloc_file(nblocks, seed=1):
+    rng = random.Random(seed)
+    d = bytearray(b'\x82\x03\x40' + b'BENCH'.ljust(15))
+    for i in range(nblocks):
+        n = rng.randrange(4, 0x40)
+        rec = bytes([rng.randrange(1, 16)]) + rng.getrandbits(8 * (n - 1)).to_bytes(n - 1)
+        if i == nblocks // 2:
+            rec = b'\x05IAIL12345ASSEMB'
+            n = len(rec)
+        d += struct.pack('>H', n) + rec
+    return bytes(d + bytes(0x20))
+
+
+#######################################
+#   runner
+#######################################
+
+# one benchmark : fn() is timed; nbytes (input size) gives a throughput
+class bench:
+    __slots__ = ('name', 'fn', 'nbytes')
+
+    def __init__(self, name, fn, nbytes=None):
+        self.name = name
+        self.fn = fn
+        self.nbytes = nbytes
+
+# returns {'best': s, 'median': s, 'loops': n, 'bytes': n} ; times are per call
+def measure(b, min_time=0.2, repeats=5):
+    with open(os.devnull, 'w') as quiet, contextlib.redirect_stdout(quiet):
+        # calibrate : enough loops to last min_time
+        loops = 1
+        while True:
+            t0 = time.perf_counter()
+            for _ in range(loops):
+                b.fn()
+            dt = time.perf_counter() - t0
+            if dt >= min_time:
+                break
+            loops = max(loops * 2, int(loops * min_time / dt * 1.1) if dt else loops * 10)
+        times = [dt / loops]
+        for _ in range(repeats - 1):
+            t0 = time.perf_counter()
+            for _ in range(loops):
+                b.fn()
+            times.append((time.perf_counter() - t0) / loops)
+    return {'best': min(times), 'median': statistics.median(times), 'loops': loops, 'bytes': b.nbytes}
+
+def collect(tmpdir):
+    benches = []
+
+    # :syst:data? parsing
+    if batchcapture is None:
+        print(f"skipping batchcapture benchmarks ({batchcapture_err})", file=sys.stderr)
+    else:
+        for layout in layouts:
+            rd, am, dm, dw = syst_data(layout)
+            engines = ['python'] if batchcapture.np is None else ['numpy', 'python']
+            # the pure-python engine needs itertools.batched (3.12+)
+            if not hasattr(itertools, 'batched'):
+                engines.remove('python')
+            for eng in engines:
+                benches.append(bench(f"parse_raw[{layout},{eng}]",
+                                     lambda rd=rd, am=am, dm=dm, dw=dw, eng=eng:
+                                     batchcapture.parse_raw(rd, am, dm, dw, engine=eng), len(rd)))
+                benches.append(bench(f"parse_runs[{layout},{eng}]",
+                                     lambda rd=rd, am=am, dm=dm, dw=dw, eng=eng:
+                                     batchcapture.parse_runs(rd, am, dm, dw, engine=eng), len(rd)))
+        # the two unshift variants, on the same 1000 rows
+        for layout in ('deep-3pod', 'scattered'):
+            rd, am, dm, dw = syst_data(layout, rows=1000)
+            bpr, rows, acq = batchcapture.parse_preamble(rd)
+            samples = [int.from_bytes(acq[i:i + bpr]) for i in range(0, len(acq), bpr)]
+            for fn in (batchcapture.unshift_rawdata, batchcapture.unshift_rawdata2):
+                benches.append(bench(f"{fn.__name__}[{layout},1000 rows]",
+                                     lambda fn=fn, samples=samples, am=am, dm=dm:
+                                     [(fn(s, am), fn(s, dm)) for s in samples], len(acq)))
+
+    # unchunking, extraction
+    for size in (0x10000, 0x100000, 0x400000):
+        img = firmware_image(size)
+        tag = f"{size >> 10}k"
+        chunked = img[unpack_payload.HFS_HDR_LEN:]
+        benches.append(bench(f"file_id.unchunk[{tag}]",
+                             lambda d=chunked: file_id.unchunk(d), len(chunked)))
+        fname = os.path.join(tmpdir, f"fw_{tag}")
+        with open(fname, "wb") as f:
+            f.write(img)
+        out = os.path.join(tmpdir, "out.bin")
+        for stream in (False, True):
+            mode = 'stream' if stream else 'mmap'
+            benches.append(bench(f"extract_blocks[{tag},{mode}]",
+                                 lambda fname=fname, stream=stream:
+                                 unpack_payload.extract_blocks(fname, out, True, stream), len(img)))
+            benches.append(bench(f"list_blocks[{tag},{mode}]",
+                                 lambda fname=fname, stream=stream:
+                                 unpack_payload.list_blocks(fname, True, stream), len(img)))
+
+    # identification
+    for n in (10, 200):
+        cfg = config_file(n)
+        benches.append(bench(f"identify[config,{n} sections]", lambda d=cfg: file_id.identify(d), len(cfg)))
+    cfg = config_file(200)
+    hfs = io.BytesIO()
+    hfslif.write_hfs(hfs, 'CFG', cfg, ftype=-0x3ee0, chunked=True)
+    hfs = hfs.getvalue()
+    benches.append(bench("identify[hfslif config,200 sections]", lambda d=hfs: file_id.identify(d), len(hfs)))
+    for n in (100, 5000):
+        r = reloc_file(n)
+        benches.append(bench(f"identify[reloc,{n} blocks]", lambda d=r: file_id.identify(d), len(r)))
+    return benches
+
+def git_rev():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def run(patterns, min_time, repeats):
+    meta = {
+        'rev': git_rev(),
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'numpy': getattr(getattr(batchcapture, 'np', None), '__version__', None),
+    }
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for b in collect(tmpdir):
+            if patterns and not any(p in b.name for p in patterns):
+                continue
+            r = measure(b, min_time, repeats)
+            results[b.name] = r
+            print(fmt_line(b.name, r))
+    return {'meta': meta, 'results': results}
+
+def fmt_time(s):
+    for unit, f in (('s', 1), ('ms', 1e3), ('us', 1e6)):
+        if s * f >= 1:
+            return f"{s * f:7.2f}{unit:>2}"
+    return f"{s * 1e9:7.0f}ns"
+
+def fmt_line(name, r):
+    line = f"{name:<45} {fmt_time(r['best'])} (median {fmt_time(r['median'])})"
+    if r.get('bytes'):
+        line += f" {r['bytes'] / r['best'] / 1e6:9.1f} MB/s"
+    return line
+
+# print old vs new; returns the names slower than 'threshold' (e.g. 0.1 : 10%)
+def compare(old, new, threshold=0.1):
+    print(f"\nold: {old['meta'].get('rev')} ({old['meta'].get('date')}, python {old['meta'].get('python')})")
+    print(f"new: {new['meta'].get('rev')} ({new['meta'].get('date')}, python {new['meta'].get('python')})")
+    regressions = []
+    for name, r in new['results'].items():
+        o = old['results'].get(name)
+        if o is None:
+            print(f"{name:<45} {'':>9}   {fmt_time(r['best'])}   (new)")
+            continue
+        ratio = r['best'] / o['best']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = ' !! slower'
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = ' faster'
+        print(f"{name:<45} {fmt_time(o['best'])} -> {fmt_time(r['best'])} {ratio:6.2f}x{flag}")
+    for name in old['results'].keys() - new['results'].keys():
+        print(f"{name:<45} (gone)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark parsing / unchunking / extraction")
+    parser.add_argument('-k', action='append', metavar='PATTERN', help="only benchmarks whose name contains this")
+    parser.add_argument('-o', '--output', help="save results to this JSON file")
+    parser.add_argument('--compare', metavar='OLD', help="compare with results saved by an earlier run")
+    parser.add_argument('--against', metavar='NEW', help="with --compare : compare two saved runs, don't run anything")
+    parser.add_argument('--threshold', type=float, default=0.1, help="flag slowdowns above this fraction (default 0.1)")
+    parser.add_argument('--min-time', type=float, default=0.2, help="seconds per repeat")
+    parser.add_argument('-r', '--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.against:
+        if not args.compare:
+            parser.error("--against needs --compare")
+        with open(args.against) as f:
+            new = json.load(f)
+    else:
+        new = run(args.k, args.min_time, args.repeats)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(new, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        if args.k:
+            old['results'] = {n: r for n, r in old['results'].items() if any(p in n for p in args.k)}
+        if compare(old, new, args.threshold):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
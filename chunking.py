@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+#
+# fenugrec 2025
+#
+# '00 FE' chunk format, shared by file_id and unpack_payload
+#
+'''
+Firmware images, config and invasm files are split in blocks:
+
+struct chunk {
+    u16 chunk_length;   //big-endian, usually 00 FE
+    u8 chunk_data[chunk_length];
+    }
+
+Special lengths:
+    - 0xFFFF : seen in firmware images, seems to mean "last block"; everything
+      until the end of the file is payload.
+    - anything other than 0xFE : "irregular" block. In config / invasm files
+      that's the last chunk (padding follows). In firmware images they can
+      appear mid-file.
+
+Everything here works on anything that supports the buffer protocol (bytes,
+bytearray, mmap, memoryview) and never slices the source : payloads are
+memoryviews into it. One pass over the block headers, no re-copying.
+'''
+
+import collections
+import io
+import struct
+
+# offset: file offset of the 2-byte length header ; length: payload length
+block = collections.namedtuple('block', 'offset length')
+
+CHUNK_LEN = 0xfe
+LAST_BLOCK = 0xffff
+
+
+# summary of a chunked file, filled by iter_payload()
+class BlockMap:
+    __slots__ = ('nblocks', 'payload_len', 'end', 'irregular', 'lastblock', 'truncated')
+
+    def __init__(self):
+        self.nblocks = 0
+        self.payload_len = 0
+        self.end = 0            # file offset where parsing stopped
+        self.irregular = []     # blocks with length != 0xFE (including last-block)
+        self.lastblock = None   # block with the 0xFFFF marker, if any
+        self.truncated = None   # block whose length goes past the end of data
+
+    def print_info(self, filesize=None):
+        for b in self.irregular:
+            if b is self.lastblock:
+                print(f"lastblock @ fileoffs {b.offset:#x}: {b.length:#x} more bytes")
+            else:
+                print(f"irregular block @ fileoffs {b.offset:#x}: size={b.length:#x}")
+        if self.truncated is not None:
+            print(f"truncated block @ fileoffs {self.truncated.offset:#x}: "
+                  f"chunk_len wants {self.truncated.length:#x}")
+        fs = '' if filesize is None else f", filesize {filesize:#x}"
+        print(f"Payload size: {self.payload_len:#x}{fs}, last pos {self.end:#x}")
+
+
+# lazily yield payload memoryviews, one per block.
+# buf : bytes/mmap/memoryview, starting at the first length header
+# bmap : optional BlockMap, updated as blocks are parsed
+# stop_short : stop after the first block that isn't 0xFE long (config/invasm
+#   files : the rest is padding). Otherwise keep going until end of data.
+def iter_payload(buf, bmap=None, stop_short=False):
+    if bmap is None:
+        bmap = BlockMap()
+    mv = memoryview(buf).cast('B')
+    size = len(mv)
+    pos = 0
+    while pos + 2 <= size:
+        n = struct.unpack_from('>H', mv, pos)[0]
+        avail = size - pos - 2
+        if n == LAST_BLOCK:
+            n = avail
+            bmap.lastblock = block(pos, n)
+            bmap.irregular.append(bmap.lastblock)
+        elif n != CHUNK_LEN:
+            bmap.irregular.append(block(pos, n))
+        if n > avail:
+            bmap.truncated = block(pos, n)
+            n = avail
+        bmap.nblocks += 1
+        bmap.payload_len += n
+        yield mv[pos + 2:pos + 2 + n]
+        pos += 2 + n
+        bmap.end = pos
+        if bmap.truncated or bmap.lastblock or (stop_short and n != CHUNK_LEN):
+            break
+    bmap.end = pos
+
+
+# parse block headers only, return BlockMap
+def scan(buf, stop_short=False):
+    bmap = BlockMap()
+    for _ in iter_payload(buf, bmap, stop_short):
+        pass
+    return bmap
+
+
+# reassemble payload into one contiguous bytearray.
+# returns (bytearray, BlockMap)
+def unchunk(buf, stop_short=False):
+    bmap = BlockMap()
+    out = bytearray()
+    for pl in iter_payload(buf, bmap, stop_short):
+        out += pl
+    return (out, bmap)
+
+
+# write payload to a file object, coalescing blocks into large writes
+def unchunk_to(buf, outf, stop_short=False, bufsize=0x100000):
+    bmap = BlockMap()
+    pending = bytearray()
+    for pl in iter_payload(buf, bmap, stop_short):
+        pending += pl
+        if len(pending) >= bufsize:
+            outf.write(pending)
+            pending.clear()
+    if pending:
+        outf.write(pending)
+    return bmap
+
+
+# streaming version of unchunk_to(), for pipes, stdin and anything else that
+# can't be mmap'd. Reads 'bufsize' at a time, and writes all payload from one
+# read in a single write.
+# inf, outf : binary file objects ; outf can be None to only fill the BlockMap.
+# Block offsets in the BlockMap are relative to the current position of 'inf'.
+def unchunk_stream(inf, outf, stop_short=False, bufsize=0x100000, bmap=None):
+    if bmap is None:
+        bmap = BlockMap()
+    buf = bytearray()
+    base = 0        # stream offset of buf[0]
+    eof = False
+    done = False
+    while not (done or eof):
+        rd = inf.read(bufsize)
+        if rd:
+            buf += rd
+        else:
+            eof = True
+        mv = memoryview(buf)
+        pl = []
+        pos = 0
+        while pos + 2 <= len(buf):
+            n = struct.unpack_from('>H', buf, pos)[0]
+            avail = len(buf) - pos - 2
+            if n == LAST_BLOCK:
+                # everything until the end of stream is payload.
+                pl.append(mv[pos + 2:])
+                _write_views(outf, pl)
+                n = avail + _copy_rest(inf, outf, bufsize)
+                bmap.lastblock = block(base + pos, n)
+                bmap.irregular.append(bmap.lastblock)
+                pos = len(buf)
+                base += n - avail
+                bmap.nblocks += 1
+                bmap.payload_len += n
+                pl = []
+                done = True
+                break
+            if n > avail:
+                if not eof:
+                    break   # need more data
+                bmap.truncated = block(base + pos, n)
+            if n != CHUNK_LEN:
+                bmap.irregular.append(block(base + pos, n))
+            n = min(n, avail)
+            pl.append(mv[pos + 2:pos + 2 + n])
+            bmap.nblocks += 1
+            bmap.payload_len += n
+            pos += 2 + n
+            if bmap.truncated or (stop_short and n != CHUNK_LEN):
+                done = True
+                break
+        _write_views(outf, pl)
+        del pl
+        mv.release()
+        del buf[:pos]
+        base += pos
+    bmap.end = base
+    return bmap
+
+def _write_views(outf, views):
+    if outf is not None and views:
+        outf.write(b''.join(views))
+
+# copy inf to outf until EOF, return number of bytes
+def _copy_rest(inf, outf, bufsize):
+    total = 0
+    while True:
+        rd = inf.read(bufsize)
+        if not rd:
+            return total
+        if outf is not None:
+            outf.write(rd)
+        total += len(rd)
+
+
+#######################################
+#   writing
+#######################################
+
+# total size once chunked and padded to a 256-byte boundary
+def chunked_size(payload_len):
+    nchunks = -(-payload_len // CHUNK_LEN)
+    n = payload_len + 2 * nchunks
+    return -(-n // 0x100) * 0x100
+
+# inverse of unchunk : write() payload, get '00 FE <254 bytes>' chunks on outf.
+# The last chunk is short, and padded with 00 to the next 256-byte boundary.
+# Full chunks are batched into writes of about 'bufsize'.
+class chunk_writer:
+    def __init__(self, outf, bufsize=0x10000):
+        self.outf = outf
+        self.bufsize = bufsize
+        self.pending = bytearray()
+        self.written = 0
+
+    def write(self, b):
+        self.pending += b
+        if len(self.pending) >= self.bufsize:
+            self._flush_full()
+
+    def _flush_full(self):
+        n = (len(self.pending) // CHUNK_LEN) * CHUNK_LEN
+        if not n:
+            return
+        out = bytearray()
+        hdr = CHUNK_LEN.to_bytes(2)
+        mv = memoryview(self.pending)
+        for pos in range(0, n, CHUNK_LEN):
+            out += hdr
+            out += mv[pos:pos + CHUNK_LEN]
+        mv.release()
+        del self.pending[:n]
+        self.outf.write(out)
+        self.written += len(out)
+
+    # write the last chunk and padding. Returns total bytes written
+    def close(self):
+        self._flush_full()
+        out = bytearray()
+        if self.pending:
+            out += len(self.pending).to_bytes(2) + self.pending
+            self.pending.clear()
+        pad = -(self.written + len(out)) % 0x100
+        out += bytes(pad)
+        self.outf.write(out)
+        self.written += len(out)
+        return self.written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            self.close()
+
+# chunk a whole buffer, return bytes
+def chunk(data):
+    f = io.BytesIO()
+    with chunk_writer(f) as cw:
+        cw.write(data)
+    return f.getvalue()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+#
+# fenugrec 2025
+#
+# persistent index of file_id results
+#
+'''
+Keeps file_id results in an sqlite database so that rescanning a large archive
+only re-identifies files that changed.
+
+Tables:
+    files   : path -> size, mtime, content hash. If size and mtime match, the file
+              isn't even read on a rescan.
+    results : content hash -> identification result (fileinfo fields).
+              Identical files (same hash) are only identified once.
+    meta    : parser_version. If file_id.PARSER_VERSION differs, all cached
+              results are dropped and rebuilt.
+
+Examples:
+    fid_index.py -d archive.db scan /archive
+    fid_index.py -d archive.db query --kind config --ia I68000
+    fid_index.py -d archive.db ia-for-module 32
+'''
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+
+import file_id
+
+# fileinfo fields that depend only on file contents
+RESULT_FIELDS = [k for k in file_id.fileinfo.__slots__ if k not in ('path', 'size')]
+
+SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, hash TEXT);
+CREATE TABLE IF NOT EXISTS results (
+    hash TEXT PRIMARY KEY, {', '.join(RESULT_FIELDS)});
+CREATE INDEX IF NOT EXISTS files_hash ON files(hash);
+CREATE INDEX IF NOT EXISTS results_kind ON results(kind, module_id);
+CREATE INDEX IF NOT EXISTS results_ia ON results(ia);
+'''
+
+
+class fid_index:
+    def __init__(self, dbname):
+        self.db = sqlite3.connect(dbname)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+        self._check_version()
+
+    def close(self):
+        self.db.close()
+
+    # evict everything cached by another parser version
+    def _check_version(self):
+        row = self.db.execute("SELECT value FROM meta WHERE key='parser_version'").fetchone()
+        if row is not None and row[0] == file_id.PARSER_VERSION:
+            return
+        if row is not None:
+            print(f"parser version changed ({row[0]} -> {file_id.PARSER_VERSION}), "
+                  "dropping cached results", file=sys.stderr)
+        with self.db:
+            self.db.execute("DELETE FROM results")
+            self.db.execute("DELETE FROM files")
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('parser_version', ?)",
+                            (file_id.PARSER_VERSION,))
+
+    # walk 'paths', identify new or modified files. Returns (scanned, updated)
+    # prune : forget indexed files under 'paths' that no longer exist
+    def scan(self, paths, jobs=None, prune=True):
+        known = {r['path']: (r['size'], r['mtime_ns'])
+                 for r in self.db.execute("SELECT path, size, mtime_ns FROM files")}
+        todo = []
+        seen = set()
+        for p in file_id.walk(paths):
+            p = os.path.abspath(p)
+            seen.add(p)
+            st = os.stat(p)
+            if known.get(p) != (st.st_size, st.st_mtime_ns):
+                todo.append(p)
+
+        updated = 0
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as ex, self.db:
+            for path, st, h, info in ex.map(_scan_one, todo, chunksize=16):
+                self.db.execute("INSERT OR REPLACE INTO files VALUES (?,?,?,?)",
+                                (path, st[0], st[1], h))
+                if info is not None:
+                    self.db.execute(f"INSERT OR IGNORE INTO results VALUES "
+                                    f"(?{',?' * len(RESULT_FIELDS)})",
+                                    [h] + [getattr(info, k) for k in RESULT_FIELDS])
+                updated += 1
+            if prune:
+                roots = [os.path.abspath(p) for p in paths]
+                for p in known.keys() - seen:
+                    if any(p == r or p.startswith(r.rstrip(os.sep) + os.sep) for r in roots):
+                        self.db.execute("DELETE FROM files WHERE path=?", (p,))
+                self.db.execute("DELETE FROM results WHERE hash NOT IN (SELECT hash FROM files)")
+        return (len(seen), updated)
+
+    # cached result for one file, as a fileinfo, or None
+    def lookup(self, path):
+        for info in self._select("f.path=?", [os.path.abspath(path)]):
+            return info
+
+    # yields fileinfo for every indexed file matching all given fields,
+    # e.g. query(kind='config', ia='I68000')
+    def query(self, **fields):
+        for k in fields:
+            if k not in RESULT_FIELDS:
+                raise ValueError(f"unknown field '{k}'")
+        where = ' AND '.join(f"r.{k}=?" for k in fields) or '1'
+        return self._select(where, list(fields.values()))
+
+    # inverse assemblers that configs for this module refer to.
+    # returns {ia name: [paths of matching IA files]} ; an IA file matches on
+    # its HFSLIF filename or object name
+    def ia_for_module(self, module_id):
+        names = [r[0] for r in self.db.execute(
+            "SELECT DISTINCT ia FROM results WHERE kind='config' AND module_id=? "
+            "AND ia IS NOT NULL", (module_id,))]
+        out = {}
+        for n in names:
+            out[n] = [i.path for i in self._select(
+                "r.kind='reloc' AND (r.hfs_name=? OR r.objname=?)", [n, n])]
+        return out
+
+    def _select(self, where, params):
+        cur = self.db.execute(f"SELECT f.path, f.size, r.* FROM files f "
+                              f"JOIN results r ON r.hash=f.hash WHERE {where} "
+                              f"ORDER BY f.path", params)
+        for row in cur:
+            info = file_id.fileinfo(row['path'], row['size'])
+            for k in RESULT_FIELDS:
+                setattr(info, k, row[k])
+            yield info
+
+
+# worker : stat, hash and identify one file.
+# returns (path, (size, mtime_ns), hash, fileinfo)
+def _scan_one(path):
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        d = f.read()
+    h = hashlib.sha256(d).hexdigest()
+    info = file_id.identify_data(path, d)
+    return (path, (st.st_size, st.st_mtime_ns), h, info)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="cached file_id results")
+    parser.add_argument('-d', '--db', default='fid_index.db', help="index database")
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('scan', help="add / refresh files or directories")
+    p.add_argument('paths', nargs='+')
+    p.add_argument('-j', '--jobs', type=int, help="worker processes")
+    p = sub.add_parser('query', help="list indexed files matching all given fields")
+    p.add_argument('--kind')
+    p.add_argument('--filetype')
+    p.add_argument('--module', type=int, dest='module_id')
+    p.add_argument('--ia')
+    p.add_argument('--objname')
+    p = sub.add_parser('ia-for-module', help="IAs referenced by configs for a module ID")
+    p.add_argument('module_id', type=int)
+    args = parser.parse_args()
+
+    idx = fid_index(args.db)
+    if args.cmd == 'scan':
+        n, upd = idx.scan(args.paths, args.jobs)
+        print(f"{n} files, {upd} (re)identified", file=sys.stderr)
+    elif args.cmd == 'query':
+        fields = {k: getattr(args, k) for k in ('kind', 'filetype', 'module_id', 'ia', 'objname')
+                  if getattr(args, k) is not None}
+        for info in idx.query(**fields):
+            print(json.dumps(info.as_dict()))
+    elif args.cmd == 'ia-for-module':
+        for ia, paths in idx.ia_for_module(args.module_id).items():
+            print(f"{ia}: {', '.join(paths) if paths else '(no IA file found)'}")
+    idx.close()
+
+if __name__ == '__main__':
+    main()
@@ -8,16 +8,6 @@
 .R files, inverse assembler, config, etc... what a mess, not to mention LIF filesystem .
 
 TODO : make some kind of class that has a 'print info' , 'identify' method ?
-TODO : invasm 'field' selection, something like
-class ia_field(dict):
-    def __missing__(self, key):
-        return f"(unknown IA field {key:#x})"
-ia_fields = ia_field({
-    0xff: "A: no 'Invasm' field",
-    0x00: "B: no popup",
-    0x01: "C: popup, 2 choices",
-    0x02: "D: popup, 8 choices"
-    })
 
 **********
 References
@@ -27,8 +17,19 @@ hp 64000 docs
 
 '''
 
+import argparse
 import collections
+import concurrent.futures
+import contextlib
+import csv
+import io
+import json
+import os
+import re
 import struct
+import sys
+
+import chunking
 
 # Once on the LA filesystem (i.e. once it has an HFSLIF header), there is a 'file type' field that we can use
 
@@ -96,6 +97,20 @@ module_tbl = mod_dict({
     40: 'HP16540',
 })
 
+# invasm 'field' selection; that's the byte sent before the .R data in :MMEMory:DOWNload,
+# and the single byte found between the description and 82 03 in an invasm file.
+class ia_field(dict):
+    def __missing__(self, key):
+        return f"(unknown IA field {key:#x})"
+ia_fields = ia_field({
+    0xff: "A: no 'Invasm' field",
+    0x00: "B: no popup",
+    0x01: "C: popup, 2 choices",
+    0x02: "D: popup, 8 choices"
+    })
+# option letter -> field byte
+ia_field_opts = {v[0]: k for k, v in ia_fields.items()}
+
 '''
 ****************************************
 File structure
@@ -191,106 +206,357 @@ def is_s(d: bytes):
 #######################################
 
 # reconstruct file with '00 FE <254 bytes of stuff>' chunking format. Discards trailing data
+# see chunking.py for the actual parser
 def unchunk(d:bytes):
-    cleaned=b''
-    while len(d) > 0:
-        n = struct.unpack('>H',d[0:2])[0] 
-#        if n == 0x1ff or n == 0x7ff:
-            #let's assume that's how a last-chunk is signaled, always...
-#            return cleaned
-        if n > len(d):
-            print(f"problem unchunking after {len(cleaned):#x}: chunk_len wants {n:#x}")
-            return
-        cleaned += d[2:n+2]
-        d=d[n+2:]
-        if n != 0xfe:
-            break
+    cleaned, bmap = chunking.unchunk(d, stop_short=True)
+    if bmap.truncated is not None:
+        t = bmap.truncated
+        print(f"problem unchunking after {bmap.payload_len - (len(d) - t.offset - 2):#x}: chunk_len wants {t.length:#x}")
+        return
     return cleaned
 
-# data either starts with 82 03 magic, or is chunked and has a description field before the 8203
-def parse_reloc(d: bytes):
-    if is_chunked(d):
-        descr=d[0x6:0x26].decode()
-        print(f"chunked invasm, '{descr}'")
-        d=unchunk(d)[0x25:]
-    # here, d[0:2] has magic 82 03
-    objname = d[3:0x12].decode().rstrip() # made up a name for this. Seems to be uppercase'd .S filename
-    # oops, there's some variable-length fields here before the following. TODO
-    # ia_marker = d[0x45:0x45+0x10].decode() # 'IAILXXXXXASSEMB'
-    print(f"objname: {objname}")
-    return
+# bump this whenever the parse_* functions change what they report;
+# fid_index.py discards its cached results when this changes
+PARSER_VERSION = 2
+
+# identification results, filled in by identify() and the parse_* functions.
+# Only what could be found is set, everything else stays None
+class fileinfo:
+    __slots__ = ('path', 'size', 'kind', 'container', 'filetype_id', 'filetype',
+                 'hfs_name', 'module_id', 'module', 'description', 'objname', 'ia', 'error')
+
+    def __init__(self, path=None, size=None):
+        for k in self.__slots__:
+            setattr(self, k, None)
+        self.path = path
+        self.size = size
+
+    def as_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+# one length-prefixed block of a relocatable object, as reloc_object guesses them.
+# offset : start of the block body, after its length word; first_byte : its first byte
+reloc_block = collections.namedtuple('reloc_block', 'offset length first_byte')
+
+RELOC_MAGIC = b'\x82\x03'
+# marker found somewhere after the variable-length fields. XXXXX part may vary ?
+IA_MARKER = re.compile(rb'IAIL.{5}ASSEMB', re.DOTALL)
+
+# relocatable (.R) object, as produced by the HP 64000-style IAL assembler.
+# d : either starts with 82 03 magic, or is chunked and has a description field before the 8203
+#
+# NOT a decoder : the format isn't documented, and nothing here was checked against a
+# known-good object. Only the header is read; no section or symbol table is decoded.
+#   0x00 u8[2] magic 82 03
+#   0x02 u8 flags ?     (0x40 in all samples seen)
+#   0x03 char[15] objname, seems to be uppercase'd .S filename
+#   0x12 guess : { u16 len; u8 body[len]; } blocks, kept raw with their first byte.
+#        The walk stops at a zero length or at end of data; 'error' is set if a block
+#        runs past the end, i.e. when the guess is wrong.
+# Somewhere in there is the 'IAILXXXXXASSEMB' marker, located by searching.
+#
+# Unchunked input is walked in place; chunked input gets unchunked once.
+class reloc_object:
+    __slots__ = ('data', 'description', 'flags', 'objname', 'blocks', 'end',
+                 'ia_marker_offset', 'ia_marker', 'error')
+
+    def __init__(self, d):
+        self.description = None
+        if is_chunked(d):
+            self.description = bytes(d[0x6:0x26]).decode(errors='replace').rstrip()
+            d = unchunk(d)
+            if d is None:
+                raise ValueError("bad chunking")
+            d = memoryview(d)[0x25:]
+        mv = memoryview(d).cast('B')
+        if mv[0:2] != RELOC_MAGIC:
+            raise ValueError("no 82 03 magic")
+        self.data = mv
+        self.flags = mv[2]
+        self.objname = bytes(mv[3:0x12]).decode(errors='replace').rstrip()
+        self.error = None
+        self.blocks = []
+        self._walk(0x12)
+        m = IA_MARKER.search(mv)
+        self.ia_marker_offset = m.start() if m else None
+        self.ia_marker = m.group().decode(errors='replace') if m else None
+
+    def _walk(self, pos):
+        mv = self.data
+        size = len(mv)
+        while pos + 2 <= size:
+            n = struct.unpack_from('>H', mv, pos)[0]
+            if n == 0:
+                break
+            if pos + 2 + n > size:
+                self.error = f"block @ {pos:#x} wants {n:#x} bytes, only {size - pos - 2:#x} left"
+                break
+            self.blocks.append(reloc_block(pos + 2, n, mv[pos + 2]))
+            pos += 2 + n
+        self.end = pos
+
+    def __iter__(self):
+        return iter(self.blocks)
+
+    def __len__(self):
+        return len(self.blocks)
+
+    # block body, as a memoryview
+    def body(self, blk):
+        return self.data[blk.offset:blk.offset + blk.length]
+
+    # {first_byte: count}
+    def first_byte_counts(self):
+        return collections.Counter(b.first_byte for b in self.blocks)
+
+    # heuristic strings : printable runs of at least 'minlen', yields (offset, str).
+    # Some will be symbol names, but without a decoded symbol table there's no telling which
+    def heuristic_strings(self, minlen=4):
+        for m in re.finditer(rb'[\x20-\x7e]{%d,}' % minlen, self.data):
+            yield (m.start(), m.group().decode())
+
+    # list of problems, empty if everything parsed cleanly
+    def validate(self):
+        problems = []
+        if self.error:
+            problems.append(self.error)
+        if not self.blocks:
+            problems.append("no blocks")
+        if self.ia_marker is None:
+            problems.append("no IAIL..ASSEMB marker")
+        # whatever follows the last block should be padding
+        if any(self.data[self.end + 2:]):
+            problems.append(f"non-zero data after last block @ {self.end:#x}")
+        return problems
+
+
+def parse_reloc(d: bytes, info=None):
+    if info is None:
+        info = fileinfo()
+    info.kind = 'reloc'
+    obj = reloc_object(d)
+    if obj.description is not None:
+        print(f"chunked invasm, '{obj.description}'")
+        info.description = obj.description
+    print(f"objname: {obj.objname}")
+    info.objname = obj.objname
+    print(f"{len(obj)} length-prefixed blocks (guessed layout), IA marker {obj.ia_marker!r} @ {obj.ia_marker_offset}")
+    for p in obj.validate():
+        print(f"warning: {p}")
+    return info
+
+
+# one entry of the config section table. offset : start of section_data in the unchunked file
+config_section = collections.namedtuple('config_section', 'name module_id length offset')
+
+# config file, with a section table built once by walking the section headers.
+# Section bodies are not touched until asked for, and come back as memoryviews.
+# d : chunked config file (starting with '00 FE'), or already-unchunked data if chunked=False
+class config_file:
+    __slots__ = ('data', 'config_len', 'description', 'sections', '_by_name')
+
+    def __init__(self, d, chunked=True):
+        if chunked:
+            d = unchunk(d)
+            if d is None:
+                raise ValueError("bad chunking")
+        self.data = memoryview(d)
+        self.config_len = struct.unpack_from('>I', d, 0)[0]
+        self.description = bytes(d[4:0x24]).decode(errors='replace').rstrip()
+        self.sections = []
+        self._by_name = {}
+        i = 0x24
+        while (i + 17) < len(d):
+            sec_name = bytes(d[i:i+10]).decode(errors='replace').rstrip()
+            mod_id = d[i+11]
+            sec_len = struct.unpack_from('>I', d, i+12)[0]
+            if (sec_len == 0): break
+            sec = config_section(sec_name, mod_id, sec_len, i + 16)
+            self.sections.append(sec)
+            self._by_name.setdefault(sec_name, sec)
+            i += sec_len + 16 # skip our header and section
+
+    def __iter__(self):
+        return iter(self.sections)
+
+    def __len__(self):
+        return len(self.sections)
+
+    def __contains__(self, name):
+        return name in self._by_name
+
+    # module ID of the first section, None if there are no sections
+    @property
+    def module_id(self):
+        return self.sections[0].module_id if self.sections else None
+
+    # config_section entry, by name (e.g. 'INVASM') ; first one if duplicated
+    def section(self, name):
+        return self._by_name[name]
+
+    # section_data of a section (by name or config_section), as a memoryview
+    def body(self, sec):
+        if isinstance(sec, str):
+            sec = self._by_name[sec]
+        return self.data[sec.offset:sec.offset + sec.length]
+
+    # name of the associated inverse assembler, None if there's no INVASM section
+    @property
+    def ia_name(self):
+        for sec in self.sections:
+            if 'INVASM' in sec.name:
+                return bytes(self.body(sec)[:-1]).decode(errors='replace').rstrip()
+        return None
 
 
 # expects data to start with '00 FE' chunk size marker
-def parse_config(d: bytes):
-    d2 = unchunk(d)
-    config_len = struct.unpack('>I', d2[0:4])[0]
-    descr = d2[4:0x24].decode().rstrip()
-    print(f"config: '{descr}'")
-    i = 0x24
-    while (i + 17) < len(d2):
-        sec_name=d2[i:i+10].decode().rstrip()
-        mod_id=d2[i+11]
-        sec_len=struct.unpack('>I', d2[i+12:i+16])[0]
-        module=module_tbl[mod_id]
-        print(f"section '{sec_name}', model {module}, section len {sec_len:#x}")
-        if (sec_len == 0): break
-        if 'INVASM' in sec_name:
-            ia_name = d2[i+16:i+16+sec_len-1].decode().rstrip()
-            print(f"Associated IA: '{ia_name}'")
-        i += sec_len + 16 # skip our header and section
-    return
+def parse_config(d: bytes, info=None):
+    if info is None:
+        info = fileinfo()
+    info.kind = 'config'
+    cfg = config_file(d)
+    print(f"config: '{cfg.description}'")
+    info.description = cfg.description
+    info.module_id = cfg.module_id
+    if cfg.module_id is not None:
+        info.module = module_tbl[cfg.module_id]
+    for sec in cfg:
+        print(f"section '{sec.name}', model {module_tbl[sec.module_id]}, section len {sec.length:#x}")
+    info.ia = cfg.ia_name
+    if info.ia is not None:
+        print(f"Associated IA: '{info.ia}'")
+    return info
 
 
 # expects data to start with '80 00 HFSLIF' magic
-def parse_hfs(d: bytes):
+def parse_hfs(d: bytes, info=None):
+    if info is None:
+        info = fileinfo()
+    info.container = 'hfslif'
     if len(d) < 512:
         print("unlikely file, too small")
     #seems like the first 0x200 bytes are a fairly hardcoded struct
     filename=d[0x100:0x10a]
+    info.hfs_name = bytes(filename).decode(errors='replace').rstrip()
     file_id = struct.unpack('>h', d[0x10a:0x10c])[0]
     start_offset = struct.unpack('>I', d[0x10c:0x110])[0]*0x100
     if (start_offset != 0x200):
         print(f"unexpected header size {start_offset:#x}")
-        return
+        info.error = f"unexpected header size {start_offset:#x}"
+        return info
     entry_len = struct.unpack('>I', d[0x110:0x114])[0]*0x100
     expect_len = start_offset + entry_len
     if (len(d) != expect_len):
         print(f"unexpected file size {len(d):#X} vs {expect_len:#X}")
-        return
+        info.error = f"unexpected file size {len(d):#X} vs {expect_len:#X}"
+        return info
     shortname = filetype_tbl[file_id].shortname
     print(f"type {file_id}:{shortname}")
+    info.filetype_id = file_id
+    info.filetype = shortname.strip()
     # now, whatever it contains, must be also identified
-    identify(d[0x200:])
-    return
+    identify(d[0x200:], info)
+    return info
 
 
-def identify (filedata: bytes):
+# returns a fileinfo (the one passed in, if any)
+def identify (filedata: bytes, info=None):
+    if info is None:
+        info = fileinfo(size=len(filedata))
     if len(filedata) < 256:
         print("unlikely file, too small")
-        return
+        info.kind = 'unknown'
+        info.error = 'too small'
+        return info
 
     if is_reloc(filedata):
         print("Relocatable file")
-        return parse_reloc(filedata)
+        return parse_reloc(filedata, info)
     elif is_hfs(filedata):
         print("HFSLIF container;")
-        return parse_hfs(filedata)
+        return parse_hfs(filedata, info)
     elif is_config(filedata):
-        return parse_config(filedata)
+        return parse_config(filedata, info)
     elif is_s(filedata):
         print(".S assembly")
-        return
+        info.kind = 'source'
+        return info
     else:
         print("Unrecognized format !")
-    return
+        info.kind = 'unknown'
+    return info
+
+
+#######################################
+#   batch mode
+#######################################
+
+# identify one file, quietly. Runs in the worker processes
+def identify_file(path):
+    return identify_data(path, None)
+
+# same, if the file contents are already available
+def identify_data(path, d):
+    info = fileinfo(path)
+    try:
+        if d is None:
+            with open(path, "rb") as f:
+                d = f.read()
+        info.size = len(d)
+        with contextlib.redirect_stdout(io.StringIO()):
+            identify(d, info)
+    except Exception as e:
+        info.error = f"{type(e).__name__}: {e}"
+    return info
+
+# expand directories into the files they contain, recursively
+def walk(paths):
+    for p in paths:
+        if os.path.isdir(p):
+            for root, dirs, files in os.walk(p):
+                dirs.sort()
+                for fn in sorted(files):
+                    yield os.path.join(root, fn)
+        else:
+            yield p
+
+# identify all files under 'paths' using a process pool, write one record per file to 'out'.
+# fmt : 'jsonl' or 'csv'
+def batch(paths, out, fmt='jsonl', jobs=None):
+    if fmt == 'csv':
+        w = csv.DictWriter(out, fieldnames=fileinfo.__slots__)
+        w.writeheader()
+        emit = lambda info: w.writerow(info.as_dict())
+    else:
+        emit = lambda info: out.write(json.dumps(info.as_dict()) + '\n')
+    n = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as ex:
+        for info in ex.map(identify_file, walk(paths), chunksize=16):
+            emit(info)
+            n += 1
+    return n
 
-import sys
 def main():
-    print(f"Identifying: '{sys.argv[1]}'")
-    with open(sys.argv[1], "rb") as f:
-        d=f.read()
-        identify(d)
+    parser = argparse.ArgumentParser(description="identify HP LA files (.R, config, HFSLIF, ...)")
+    parser.add_argument('paths', nargs='+', help="files or directories")
+    parser.add_argument('-f', '--format', choices=['jsonl', 'csv'],
+                        help="batch mode: machine-readable output, one record per file")
+    parser.add_argument('-o', '--output', help="batch mode output file (default: stdout)")
+    parser.add_argument('-j', '--jobs', type=int, help="batch mode worker processes (default: number of CPUs)")
+    args = parser.parse_args()
+
+    if args.format is None and len(args.paths) == 1 and not os.path.isdir(args.paths[0]):
+        print(f"Identifying: '{args.paths[0]}'")
+        with open(args.paths[0], "rb") as f:
+            d=f.read()
+            identify(d)
+        return
+
+    out = open(args.output, "w", newline='') if args.output else contextlib.nullcontext(sys.stdout)
+    with out as out:
+        n = batch(args.paths, out, args.format or 'jsonl', args.jobs)
+    print(f"{n} files identified", file=sys.stderr)
 
 if __name__ == '__main__':
         main()
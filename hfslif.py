@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+#
+# fenugrec 2025
+#
+# offline HFSLIF / LIF writer
+#
+'''
+Builds, without an LA, what :MMEMory:DOWNload would have created on the instrument :
+an HFSLIF file (0x200-byte header, i.e. a one-entry LIF volume, see lif.py) holding
+the chunked invasm data. Or a LIF volume image holding many files at once.
+
+Invasm payload, before chunking :
+{
+    u32 len;                //not 100% sure what that includes; here : everything after this field
+    char[32] description;   //space-padded
+    u8 ia_field;            //see file_id.ia_fields
+    u8 rfile[];             //.R file contents, starting with 82 03
+}
+
+Examples:
+    hfslif.py I68000.R -d "68000 IA" -i B -o I68000
+    hfslif.py *.R -i A -D outdir
+    hfslif.py *.R -i A --lif disk.lif
+'''
+
+import argparse
+import os
+import struct
+import sys
+
+import chunking
+import file_id
+import lif
+
+IA_TYPE = -0x3cfe   #inverse_assem
+
+
+# build unchunked invasm payload from .R file contents
+def ia_payload(rdata, description, ifield=0xff):
+    descr = description.encode('ascii', errors='replace')[:32].ljust(32)
+    body = descr + bytes([ifield]) + bytes(rdata)
+    return struct.pack('>I', len(body)) + body
+
+# write an HFSLIF file : header, then 'payload' chunked.
+# chunked : payload is already chunked, write it as-is (padded to 256 bytes)
+def write_hfs(outf, name, payload, ftype=IA_TYPE, chunked=False):
+    if chunked:
+        size = -(-len(payload) // lif.SECTOR) * lif.SECTOR
+    else:
+        size = chunking.chunked_size(len(payload))
+    hdr, starts = lif.volume_header([(name, ftype, size)])
+    outf.write(hdr)
+    if chunked:
+        outf.write(payload)
+        outf.write(bytes(size - len(payload)))
+        return
+    with chunking.chunk_writer(outf) as cw:
+        cw.write(payload)
+
+# file type from a number (e.g. -15614, -0x3cfe) or a filetype_tbl shortname
+def parse_ftype(s):
+    try:
+        return int(s, 0)
+    except ValueError:
+        pass
+    for ft in file_id.filetype_list:
+        if ft.shortname.strip() == s:
+            return ft.id
+    raise argparse.ArgumentTypeError(f"unknown file type '{s}'")
+
+# LIF names : 10 chars, uppercase
+def lif_name(fname):
+    return os.path.splitext(os.path.basename(fname))[0].upper()[:10]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="build HFSLIF files / LIF volumes offline")
+    parser.add_argument('files', nargs='+', help=".R files (or any file, with --raw)")
+    parser.add_argument('-n', '--name', help="name on the LA, single input only (default: from filename)")
+    parser.add_argument('-d', '--description', help="description (default: LA name)")
+    parser.add_argument('-i', '--ifield', default='A', type=str.upper, choices=file_id.ia_field_opts.keys(),
+                        help='"Invasm" field option [A,B,C,D]')
+    parser.add_argument('-t', '--type', type=parse_ftype, default=IA_TYPE,
+                        help="file type, number or shortname (default: inverse_assem)")
+    parser.add_argument('--raw', action='store_true',
+                        help="don't add the invasm header, just chunk the file (unless it's already chunked)")
+    out = parser.add_mutually_exclusive_group(required=True)
+    out.add_argument('-o', '--output', help="HFSLIF output file, single input only")
+    out.add_argument('-D', '--dir', help="write one HFSLIF file per input in this directory")
+    out.add_argument('--lif', help="write a LIF volume image holding all inputs")
+    parser.add_argument('-l', '--label', default='HPLA', help="LIF volume label, with --lif")
+    args = parser.parse_args()
+
+    if (args.name or args.output) and len(args.files) > 1:
+        parser.error("-n and -o take a single input file")
+
+    entries = []
+    for fname in args.files:
+        with open(fname, "rb") as f:
+            d = f.read()
+        name = args.name or lif_name(fname)
+        chunked = False
+        if args.raw:
+            payload = d
+            chunked = file_id.is_chunked(d)
+        else:
+            if d[0:2] != b'\x82\x03':
+                print(f"{fname}: no 82 03 magic, not a .R file ?", file=sys.stderr)
+            payload = ia_payload(d, args.description or name, file_id.ia_field_opts[args.ifield])
+        entries.append((fname, name, payload, chunked))
+
+    if args.lif:
+        files = [(name, args.type, payload if chunked else chunking.chunk(payload))
+                 for fname, name, payload, chunked in entries]
+        with open(args.lif, "wb") as outf:
+            lif.write_volume(outf, files, args.label)
+        print(f"{len(files)} files -> {args.lif}")
+        return
+
+    if args.dir:
+        os.makedirs(args.dir, exist_ok=True)
+    for fname, name, payload, chunked in entries:
+        out_file = args.output or os.path.join(args.dir, name)
+        with open(out_file, "wb") as outf:
+            write_hfs(outf, name, payload, args.type, chunked)
+        print(f"{fname} -> {out_file} ({name})")
+
+if __name__ == '__main__':
+    main()
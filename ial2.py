@@ -7,69 +7,427 @@
 # stuff sent by actual telnet clients like e.g. putty.
 #
 # Instead this uses pyvisa, with the added benefit of supporting TCP,GPIB,and serial back-ends
+#
+# Batch mode (-b *.R) : upload many files over a single session, no prompts.
+# Name defaults to the filename, description to what file_id finds in the file.
+#
+# Fleet mode (-m manifest.json) : upload the same set of files to many LAs in parallel,
+# no prompts. Manifest example:
+# {
+#     "hosts": ["192.168.1.20", "192.168.1.21", "TCPIP0::192.168.1.22::5025::SOCKET"],
+#     "dir": "IA",
+#     "files": [
+#         {"file": "I68000.R", "name": "I68000", "description": "68000 IA", "ifield": "B"},
+#         {"file": "Z80.R", "dir": "IA/Z80"}
+#     ]
+# }
+# "hosts" can be omitted if -H or -r is given. "dir" (per file or global) is the directory
+# on the LA, otherwise files go to the current directory.
+#
+# Sync (-s, batch and fleet modes) : only upload files that are new or changed on the LA.
+# The LA's catalog (:MMEMory:CATalog?) is read once per directory and session, and each
+# file's name, type and description are compared. Files we uploaded before also
+# have their content fingerprint in a state file (--state, default .ial2sync.json),
+# along with what the catalog said right after the upload, so a changed file is still
+# caught, and so is a file replaced on the LA by something else. Files that were on the
+# LA before we ever synced them have no fingerprint : their catalog size is compared
+# with the size ours would have on the LA (chunked, see stored_size). That size is
+# rounded to 256 bytes, so a change that keeps it is only caught once we uploaded the
+# file ourselves.
 
 import sys
-import pyvisa
 import argparse
+import concurrent.futures
+import contextlib
+import glob
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+import pyvisa
+
+import chunking
+import file_id
+import hfslif
+
+# filetype code for inverse assemblers, as used by :MMEMory:DOWNload
+IA_TYPE = -15614
+
+
+def ifield_byte(opt):
+    opt = opt.upper()
+    if opt not in file_id.ia_field_opts:
+        raise Exception("Unknown type option specified (A,B,C or D)")
+    return bytes([file_id.ia_field_opts[opt]])
+
+def resource_name(host, port=5025):
+    if '::' in host:
+        return host     # already a full VISA resource string
+    return 'TCPIP0::' + host + '::' + str(port) + '::SOCKET'
+
+def open_la(rm, resource):
+    la=rm.open_resource(resource)
+    # because the 1660 isn't "discoverable" we need to use ::SOCKET mode, which means we need to set terminator
+    la.read_termination='\n'
+    return la
+
+# change directory on the LA mass storage
+def chdir(la, d):
+    la.write(f":MMEMory:CD '{d}',INTERNAL0")
+
+# file will be written to current dir of storage device; must send explicit 'CD' commands to change dir before
+def download(la, filename, description, type_byte, buffer):
+    la.write_binary_values(f""":MMEMory:DOWNload '{filename[0:10]}',INTERNAL0,'{description[0:32]}',{IA_TYPE},""",
+                           type_byte + buffer, datatype='s')
+
+
+#######################################
+#   sync : remote catalog and local state
+#######################################
+
+# with ALL, the catalog is a block of 70-character entries :
+#   name (10), type, size, date, description (last 32)
+# the middle fields are split on whitespace, so their exact widths don't matter
+CAT_ENTRY_LEN = 70
+
+# one file on the LA, as the catalog lists it
+class cat_entry:
+    __slots__ = ('name', 'type', 'size', 'date', 'description')
+
+    def __init__(self, name, ftype, size, date, description):
+        self.name = name
+        self.type = ftype
+        self.size = size
+        self.date = date
+        self.description = description
+
+    # what identifies this copy on the LA, to tell if it was replaced since
+    def stamp(self):
+        return [self.type, self.size, self.date]
+
+def parse_catalog(data):
+    text = data.decode('latin-1')
+    if '\n' in text:
+        entries = text.splitlines()
+    else:
+        entries = [text[i:i + CAT_ENTRY_LEN] for i in range(0, len(text), CAT_ENTRY_LEN)]
+    files = {}
+    for e in entries:
+        if not e.strip() or len(e) < 10 + 32:
+            continue
+        mid = e[10:-32].split()
+        try:
+            ftype = int(mid[0])
+        except (IndexError, ValueError):
+            ftype = None
+        size = int(mid[1]) if len(mid) > 1 and mid[1].isdigit() else None
+        name = e[:10].strip()
+        files[name] = cat_entry(name, ftype, size, ' '.join(mid[2:]), e[-32:].strip())
+    return files
+
+# catalogs of the LA's directories, read once per session; the current directory must
+# be the one asked for (see deploy_host)
+class remote_catalog:
+    __slots__ = ('la', 'dirs', 'queries')
+
+    def __init__(self, la):
+        self.la = la
+        self.dirs = {}
+        self.queries = 0
+
+    def listing(self, d):
+        if d not in self.dirs:
+            self.queries += 1
+            data = self.la.query_binary_values(':MMEMory:CATalog? ALL,INTERNAL0', datatype='s',
+                                               container=bytes)
+            self.dirs[d] = parse_catalog(data)
+        return self.dirs[d]
+
+    # after uploading into 'd'
+    def invalidate(self, d):
+        self.dirs.pop(d, None)
+
+# what we uploaded where, kept in a JSON file :
+# {resource: {"dir/name": {"fp": .., "stamp": [type, size, date]}}}
+# resource : VISA resource string (see resource_name), the same in batch and fleet mode
+class sync_state:
+    __slots__ = ('path', 'hosts', 'lock')
+
+    def __init__(self, path):
+        self.path = path
+        self.hosts = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.hosts = json.load(f)
+
+    def get(self, resource, key):
+        with self.lock:
+            return self.hosts.get(resource, {}).get(key)
+
+    def put(self, resource, key, rec):
+        with self.lock:
+            self.hosts.setdefault(resource, {})[key] = rec
+
+    def save(self):
+        with self.lock:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.hosts, f, indent=1)
+            os.replace(tmp, self.path)
+
+# 'dir/name' key of an item
+def item_key(it):
+    return f"{it.dir or ''}/{it.name}"
+
+# size of 'it' in the LA's catalog once uploaded : the invasm payload (hfslif.ia_payload)
+# in '00 FE' chunks, padded to 256 bytes, as :MMEMory:DOWNload stores it
+def stored_size(it):
+    return chunking.chunked_size(len(hfslif.ia_payload(it.data, it.description, it.type_byte[0])))
+
+# why 'it' must be uploaded, None if the LA has it already.
+# remote : cat_entry or None; rec : state record from the last upload, or None
+def needs_upload(it, remote, rec):
+    if remote is None:
+        return "new"
+    if remote.type != IA_TYPE:
+        return f"type {remote.type} on the LA"
+    if remote.description != it.description.strip():
+        return "description"
+    if rec is not None:
+        if rec['fp'] != it.fp:
+            return "changed"
+        if rec['stamp'] != remote.stamp():
+            return "replaced on the LA"
+        return None
+    # never uploaded from here : no fingerprint, the size has to do
+    if remote.size != stored_size(it):
+        return "size"
+    return None
+
+
+#######################################
+#   fleet mode
+#######################################
+
+# description found in the file itself by file_id, else its object name
+def file_description(data):
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            info = file_id.identify(data)
+        except Exception:
+            return None
+    return info.description or info.objname
+
+# one file to upload, contents already read.
+# ent : manifest entry, e.g. {"file": "x.R", "name": .., "description": .., "ifield": .., "dir": ..}
+# defaults : values used when not in the entry
+class upload_item:
+    __slots__ = ('file', 'name', 'description', 'type_byte', 'dir', 'data', 'fp')
+
+    def __init__(self, ent, defaults={}):
+        ent = {**defaults, **ent}
+        self.file = ent['file']
+        with open(self.file, 'rb') as f:
+            self.data = f.read()
+        self.name = ent.get('name', os.path.splitext(os.path.basename(self.file))[0].upper())[0:10]
+        descr = ent.get('description') or file_description(self.data) or self.name
+        self.description = descr[0:32]
+        self.type_byte = ifield_byte(ent.get('ifield', 'A'))
+        self.dir = ent.get('dir')
+        # content fingerprint, for sync
+        self.fp = hashlib.sha1(self.type_byte + self.data).hexdigest()
+
+# connect to one LA and upload all items. Runs in a worker thread; returns a result dict
+# sync : sync_state, to only upload what the LA doesn't have yet
+def deploy_host(host, items, port=5025, timeout=None, sync=None):
+    res = {'host': host, 'ok': False, 'idn': None, 'files': 0, 'bytes': 0, 'skipped': 0,
+           'time': None, 'error': None}
+    t0 = time.monotonic()
+    la = None
+    resource = resource_name(host, port)
+    try:
+        # separate ResourceManager per thread, pyvisa sessions aren't meant to be shared
+        rm = pyvisa.ResourceManager('@py')
+        la = open_la(rm, resource)
+        if timeout:
+            la.timeout = timeout
+        res['idn'] = la.query('*idn?').strip()
+        cat = remote_catalog(la) if sync is not None else None
+        cwd = None
+        sent = []
+        for it in items:
+            if it.dir is not None and it.dir != cwd:
+                record_uploads(cat, sync, resource, cwd, sent)
+                chdir(la, it.dir)
+                cwd = it.dir
+            if cat is not None:
+                why = needs_upload(it, cat.listing(cwd).get(it.name), sync.get(resource, item_key(it)))
+                if why is None:
+                    res['skipped'] += 1
+                    continue
+                print(f"{host}: {item_key(it)} : {why}")
+            download(la, it.name, it.description, it.type_byte, it.data)
+            sent.append(it)
+            res['files'] += 1
+            res['bytes'] += len(it.data)
+        # make sure the LA has digested everything before we hang up
+        la.query('*opc?')
+        record_uploads(cat, sync, resource, cwd, sent)
+        res['ok'] = True
+    except Exception as e:
+        res['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        if la is not None:
+            la.close()
+    res['time'] = time.monotonic() - t0
+    return res
+
+# after uploading 'sent' into the current directory 'd' : read the catalog again and
+# remember what it says about them, with their fingerprints. Empties 'sent'
+def record_uploads(cat, sync, resource, d, sent):
+    if cat is None or not sent:
+        sent.clear()
+        return
+    cat.invalidate(d)
+    listing = cat.listing(d)
+    for it in sent:
+        remote = listing.get(it.name)
+        if remote is not None:
+            sync.put(resource, item_key(it), {'fp': it.fp, 'stamp': remote.stamp()})
+    sent.clear()
+
+# grouped by directory, so that each directory is only CD'd into once
+def sort_items(items):
+    return sorted(items, key=lambda it: it.dir or '')
+
+def load_manifest(manifest):
+    with open(manifest) as f:
+        m = json.load(f)
+    defaults = {k: m[k] for k in ('dir', 'ifield') if k in m}
+    items = sort_items(upload_item(ent, defaults) for ent in m['files'])
+    return (m.get('hosts'), items)
+
+def fleet(hosts, items, port=5025, jobs=None, timeout=None, sync=None):
+    print(f"deploying {len(items)} files to {len(hosts)} hosts")
+    results = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs or len(hosts)) as ex:
+        futs = [ex.submit(deploy_host, h, items, port, timeout, sync) for h in hosts]
+        for fut in concurrent.futures.as_completed(futs):
+            r = fut.result()
+            status = "OK  " if r['ok'] else "FAIL"
+            print(f"{status} {r['host']}: {r['files']}/{len(items)} files, "
+                  + (f"{r['skipped']} unchanged, " if sync is not None else '')
+                  + f"{r['bytes']} bytes in {r['time']:.1f}s; {r['idn'] or r['error']}")
+            results.append(r)
+    if sync is not None:
+        sync.save()
+    return results
+
+
+#######################################
+#   interactive, single file
+#######################################
+
+def interactive(resource, rfile, ifield):
+    # read the data file
+    buffer = rfile.read()
+
+    # may need to change this line if not using pyvisa + 'pyvisa-py' (i.e. NI / other backend)
+    rm = pyvisa.ResourceManager('@py')
+    print(f"Opening VISA resource '{resource}'")
+    la=open_la(rm, resource)
+    print("Connected to: " + la.query('*idn?'))
+
+    params = {}
+
+    # file will be written to root of storage device; must send explicit 'CD' commands to change dir before
+    params['filename'] = input("Filename on target LA (truncated to 10 chars):").rstrip()[0:10]
+    params['description'] = input("Description (truncated to 32 chars):").rstrip()[0:32]
+
+    if not ifield:
+        ifield = input(""""Invasm" Field Options:
+         A = No "Invasm" Field
+         B = "Invasm" Field with no pop-up
+         C = "Invasm" Field with pop-up. 2 choices in pop-up.
+         D = "Invasm" Field with pop-up. 8 choices in pop-up.
+        Select the appropriate letter (A, B, C or D)""").rstrip()[0].upper()
+    params['option'] = ifield
+
+    # get the params.
+    type_byte = ifield_byte(params['option'])
+
+    download(la, params['filename'], params['description'], type_byte, buffer)
+    la.close()
+
+
+# single host, many files, one session
+def batch(resource, items, timeout=None, sync=None):
+    print(f"{'syncing' if sync is not None else 'uploading'} {len(items)} files to {resource}")
+    for it in items:
+        print(f"  {it.file} -> {(it.dir + '/') if it.dir else ''}{it.name} '{it.description}'")
+    r = deploy_host(resource, items, timeout=timeout, sync=sync)
+    if sync is not None:
+        sync.save()
+    if r['ok']:
+        print(f"connected to {r['idn']}; {r['files']} files, {r['bytes']} bytes in {r['time']:.1f}s"
+              + (f", {r['skipped']} unchanged" if sync is not None else ''))
+    else:
+        print(f"FAILED after {r['files']}/{len(items)} files: {r['error']}")
+    return r
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Python IALDOWN for HP Logic Analysers")
+    parser.add_argument('-r', '--res', help='optional, full VISA resource string like TCPIP::x.y.z.w::5025::SOCKET')
+    parser.add_argument('-H', '--host', help='LA hostname')
+    parser.add_argument('-p', '--port', type=int, default=5025, help='defaults to 5025')
+    parser.add_argument('-i', '--ifield', default='a', help='"Invasm" field option [A,B,C,D]')
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('-f', '--file', type=argparse.FileType('rb'), help='relocatable file to send')
+    mode.add_argument('-b', '--batch', nargs='+', metavar='FILE', help='batch mode: send these files (globs ok) over one session')
+    mode.add_argument('-m', '--manifest', help='fleet mode: JSON manifest of hosts and files')
+    parser.add_argument('-d', '--dir', help='batch mode: directory on the LA')
+    parser.add_argument('-j', '--jobs', type=int, help='fleet mode: max simultaneous hosts (default: all)')
+    parser.add_argument('-t', '--timeout', type=int, help='VISA timeout in ms')
+    parser.add_argument('--report', help='fleet mode: write per-host results to this JSON file')
+    parser.add_argument('-s', '--sync', action='store_true', help='batch/fleet mode: only upload new or changed files')
+    parser.add_argument('--state', default='.ial2sync.json', help='sync: file to keep upload fingerprints in')
+    args = parser.parse_args(sys.argv[1:])
+    sync = sync_state(args.state) if args.sync else None
+
+    resource=args.res
+    if not resource and args.host:
+        resource = resource_name(args.host, args.port)
+
+    if args.batch:
+        if not resource:
+            parser.error("batch mode needs -H or -r")
+        files = [f for pat in args.batch for f in (sorted(glob.glob(pat)) or [pat])]
+        defaults = {'ifield': args.ifield, 'dir': args.dir}
+        items = [upload_item({'file': f}, defaults) for f in files]
+        r = batch(resource, items, args.timeout, sync)
+        sys.exit(0 if r['ok'] else 1)
+
+    if args.manifest:
+        hosts, items = load_manifest(args.manifest)
+        if not hosts:
+            if not resource:
+                parser.error("manifest has no hosts, need -H or -r")
+            r = batch(resource, items, args.timeout, sync)
+            sys.exit(0 if r['ok'] else 1)
+        results = fleet(hosts, items, args.port, args.jobs, args.timeout, sync)
+        if args.report:
+            with open(args.report, 'w') as f:
+                json.dump(results, f, indent=1)
+        sys.exit(0 if all(r['ok'] for r in results) else 1)
+
+    if not resource:
+        parser.error("need -H or -r")
+    interactive(resource, args.file, args.ifield)
 
-parser = argparse.ArgumentParser(description="Python IALDOWN for HP Logic Analysers")
-parser.add_argument('-r', '--res', help='optional, full VISA resource string like TCPIP::x.y.z.w::5025::SOCKET')
-parser.add_argument('-H', '--host', help='LA hostname')
-parser.add_argument('-p', '--port', type=int, default=5025, help='defaults to 5025')
-parser.add_argument('-i', '--ifield', default='a', help='"Invasm" field option [A,B,C,D]')
-parser.add_argument('-f', '--file', required=True, type=argparse.FileType('rb'), help='relocatable file to send')
-args = parser.parse_args(sys.argv[1:])
-
-resource=args.res
-hostname=args.host
-port=args.port
-rfile=args.file
-ifield=args.ifield
-
-# read the data file
-buffer = rfile.read()
-
-
-# may need to change this line if not using pyvisa + 'pyvisa-py' (i.e. NI / other backend)
-rm = pyvisa.ResourceManager('@py')
-if not resource:
-    resource = 'TCPIP0::' + hostname + '::' + str(port) + '::SOCKET'
-print(f"Opening VISA resource '{resource}'")
-la=rm.open_resource(resource)
-
-
-# because the 1660 isn't "discoverable" we need to use ::SOCKET mode, which means we need to set terminator
-la.read_termination='\n'
-print("Connected to: " + la.query('*idn?'))
-
-params = {}
-
-# file will be written to root of storage device; must send explicit 'CD' commands to change dir before
-params['filename'] = input("Filename on target LA (truncated to 10 chars):").rstrip()[0:10]
-params['description'] = input("Description (truncated to 32 chars):").rstrip()[0:32]
-
-if not ifield:
-    ifield = input(""""Invasm" Field Options:
-     A = No "Invasm" Field
-     B = "Invasm" Field with no pop-up
-     C = "Invasm" Field with pop-up. 2 choices in pop-up.
-     D = "Invasm" Field with pop-up. 8 choices in pop-up.
-    Select the appropriate letter (A, B, C or D)""").rstrip()[0].upper()
-params['option'] = ifield
-
-
-# get the params. 
-if params['option'] == 'A':
-    type_byte = b'\xFF'
-elif params['option'] == 'B':
-    type_byte = b'\x00'
-elif params['option'] == 'C':
-    type_byte = b'\x01'
-elif params['option'] == 'D':
-    type_byte = b'\x02'
-else:
-    raise Exception("Unknown type option specified (A,B,C or D)")
-
-la.write_binary_values(f""":MMEMory:DOWNload '{filename}',INTERNAL0,'{description}',-15614,""",
-                       type_byte + buffer, datatype='s')
-la.close()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+#
+# fenugrec 2025
+#
+# LIF volume reader : floppy / hard disk images
+#
+'''
+LIF (Logical Interchange Format) volumes, as used by the HP LAs on disk.
+Sectors are 256 bytes, everything is big-endian.
+
+Volume header, sector 0:
+    0x00 u16 lif_id         0x8000
+    0x02 char[6] label      e.g. 'HFSLIF'
+    0x08 u32 dir_start      in sectors
+    0x0C u16                0x1000
+    0x0E u16                0
+    0x10 u32 dir_len        in sectors
+    0x14 u16 version
+    0x18 u32 tracks/surface, u32 surfaces, u32 sectors/track
+    0x24 u8[6] date         BCD YYMMDDhhmmss
+
+Directory entry, 32 bytes each, 8 per sector:
+    0x00 char[10] name
+    0x0A i16 type           0 : purged entry ; -1 : end of directory.
+                            otherwise see file_id.filetype_tbl
+    0x0C u32 start          in sectors
+    0x10 u32 length         in sectors
+    0x14 u8[6] date         BCD
+    0x1A u16 volume         last-volume flag + volume number
+    0x1C u8[4] implementation
+
+Note that an 'HFSLIF' file as handled by file_id.parse_hfs() is itself a
+one-entry LIF volume : header at 0, directory at 0x100, data at 0x200.
+
+The whole image is mmap'd once; entry data is handed out as memoryviews into
+it, so identifying or extracting entries never copies the image.
+'''
+
+import argparse
+import collections
+import contextlib
+import io
+import mmap
+import os
+import struct
+import time
+
+import chunking
+import file_id
+
+SECTOR = 0x100
+LIF_ID = 0x8000
+DIRENT_LEN = 0x20
+DIR_END = -1
+DIR_PURGED = 0
+
+lif_entry = collections.namedtuple('lif_entry', 'name ftype start length date volume index')
+
+
+def bcd_date(b):
+    try:
+        yy, mo, dd, hh, mi, ss = (int(f"{x:02x}") for x in b)
+    except ValueError:
+        return None
+    if not any((yy, mo, dd)):
+        return None
+    yy += 2000 if yy < 70 else 1900
+    return f"{yy:04}-{mo:02}-{dd:02} {hh:02}:{mi:02}:{ss:02}"
+
+
+class lif_volume:
+    # fname : image filename ; or 'data', anything supporting the buffer protocol
+    def __init__(self, fname=None, data=None):
+        self._f = None
+        self._mm = None
+        if data is None:
+            self._f = open(fname, "rb")
+            self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+            data = self._mm
+        self.mv = memoryview(data).cast('B')
+        mv = self.mv
+        if len(mv) < SECTOR or struct.unpack_from('>H', mv, 0)[0] != LIF_ID:
+            self.close()
+            raise ValueError("not a LIF volume")
+        self.label = bytes(mv[2:8]).decode(errors='replace').rstrip()
+        self.dir_start, = struct.unpack_from('>I', mv, 0x08)
+        self.dir_len, = struct.unpack_from('>I', mv, 0x10)
+        self.version, = struct.unpack_from('>H', mv, 0x14)
+        self.date = bcd_date(mv[0x24:0x2a])
+        self.entries = []
+        self.by_name = {}
+        self._read_dir()
+
+    def _read_dir(self):
+        mv = self.mv
+        pos = self.dir_start * SECTOR
+        end = min(pos + self.dir_len * SECTOR, len(mv))
+        index = 0
+        while pos + DIRENT_LEN <= end:
+            ftype, start, length = struct.unpack_from('>hII', mv, pos + 0x0A)
+            if ftype == DIR_END:
+                break
+            if ftype != DIR_PURGED:
+                name = bytes(mv[pos:pos + 10]).decode(errors='replace').rstrip()
+                volume, = struct.unpack_from('>H', mv, pos + 0x1A)
+                e = lif_entry(name, ftype, start, length,
+                              bcd_date(mv[pos + 0x14:pos + 0x1a]), volume, index)
+                self.entries.append(e)
+                self.by_name[name] = e
+            pos += DIRENT_LEN
+            index += 1
+
+    def close(self):
+        # views must be released before the mmap can be closed
+        if hasattr(self, 'mv'):
+            self.mv.release()
+        if self._mm is not None:
+            self._mm.close()
+        if self._f is not None:
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __getitem__(self, name):
+        return self.by_name[name]
+
+    # entry contents as a memoryview (no copy); truncated if the image is short.
+    # Views must be released (del / .release()) before close()
+    def data(self, e):
+        if isinstance(e, str):
+            e = self.by_name[e]
+        s = e.start * SECTOR
+        return self.mv[s:s + e.length * SECTOR]
+
+    # run file_id on an entry, quietly. Returns a fileinfo
+    def identify(self, e):
+        if isinstance(e, str):
+            e = self.by_name[e]
+        d = self.data(e)
+        info = file_id.fileinfo(e.name, len(d))
+        info.container = 'lif'
+        info.hfs_name = e.name
+        info.filetype_id = e.ftype
+        info.filetype = file_id.filetype_tbl[e.ftype].shortname.strip()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                file_id.identify(d, info)
+        except Exception as ex:
+            info.error = f"{type(ex).__name__}: {ex}"
+        return info
+
+    # write an entry to a file object. unchunk : write '00 FE' payload only
+    def extract(self, e, outf, unchunk=False):
+        d = self.data(e)
+        if unchunk:
+            return chunking.unchunk_to(d, outf)
+        outf.write(d)
+
+
+#######################################
+#   writing
+#######################################
+
+def bcd_now():
+    t = time.localtime()
+    return bytes(int(f"{v % 100}", 16) for v in
+                 (t.tm_year, t.tm_mon, t.tm_mday, t.tm_hour, t.tm_min, t.tm_sec))
+
+# volume header + directory for 'files', a list of (name, ftype, length in bytes).
+# Data of file i must then follow at sector 'starts[i]'. Returns (header bytes, starts)
+def volume_header(files, label='HFSLIF', dir_sectors=None, date=None):
+    if date is None:
+        date = bcd_now()
+    if dir_sectors is None:
+        # room for the end marker too
+        dir_sectors = -(-(len(files) + 1) * DIRENT_LEN // SECTOR)
+    dir_start = 1
+    hdr = bytearray((dir_start + dir_sectors) * SECTOR)
+    struct.pack_into('>H6sIHHIH', hdr, 0, LIF_ID, label.ljust(6).encode()[:6],
+                     dir_start, 0x1000, 0, dir_sectors, 1)
+    hdr[0x24:0x2a] = date
+    starts = []
+    sec = dir_start + dir_sectors
+    pos = dir_start * SECTOR
+    for name, ftype, length in files:
+        nsec = -(-length // SECTOR)
+        struct.pack_into('>10shII6sH', hdr, pos, name.ljust(10).encode()[:10],
+                         ftype, sec, nsec, date, 0x8001)
+        starts.append(sec)
+        sec += nsec
+        pos += DIRENT_LEN
+    # mark the rest of the directory as unused
+    while pos < len(hdr):
+        struct.pack_into('>h', hdr, pos + 0x0A, DIR_END)
+        pos += DIRENT_LEN
+    return (hdr, starts)
+
+# write a LIF volume with 'files' : list of (name, ftype, data) ; data is any bytes-like.
+# Entries are padded to whole sectors.
+def write_volume(outf, files, label='HFSLIF', dir_sectors=None, date=None):
+    hdr, starts = volume_header([(n, t, len(d)) for n, t, d in files], label, dir_sectors, date)
+    outf.write(hdr)
+    # entries are laid out back to back, in order
+    for name, ftype, d in files:
+        outf.write(d)
+        outf.write(bytes(-len(d) % SECTOR))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="list / identify / extract files from a LIF disk image")
+    parser.add_argument('image', help="LIF volume image")
+    parser.add_argument('-x', nargs='+', metavar='NAME', help="extract these entries")
+    parser.add_argument('-X', action='store_true', help="extract all entries")
+    parser.add_argument('-d', default='.', help="output directory for -x/-X")
+    parser.add_argument('-u', '--unchunk', action='store_true', help="extract '00 FE' payload instead of raw entry")
+    args = parser.parse_args()
+
+    with lif_volume(args.image) as vol:
+        if not (args.x or args.X):
+            print(f"volume '{vol.label}', version {vol.version}, {len(vol.entries)} entries, {vol.date}")
+            for e in vol:
+                info = vol.identify(e)
+                what = info.kind or ''
+                if info.description:
+                    what += f" '{info.description}'"
+                if info.ia:
+                    what += f" IA '{info.ia}'"
+                if info.error:
+                    what += f" ({info.error})"
+                print(f"{e.name:<10} {file_id.filetype_tbl[e.ftype].shortname:>13} "
+                      f"{e.length * SECTOR:>8} {e.date or '':19}  {what}")
+            return
+
+        os.makedirs(args.d, exist_ok=True)
+        for e in (vol.entries if args.X else [vol[n] for n in args.x]):
+            out_file = os.path.join(args.d, e.name)
+            print(f"{e.name} -> {out_file}")
+            with open(out_file, "wb") as outf:
+                vol.extract(e, outf, args.unchunk)
+
+if __name__ == '__main__':
+    main()
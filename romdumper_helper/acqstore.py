@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+#
+# (c) fenugrec 2025
+#
+# acquisition storage for batchcapture : chunks and output formats
+#
+'''
+A 'chunk' is a contiguous run of ROM data starting at some address.
+Historically these were ad-hoc [start, bytes] lists; Chunk keeps that
+interface (chunk[0], chunk[1], and 'start, data = chunk') so existing
+console code keeps working.
+
+The payload is a preallocated bytearray that doubles when full, so appending
+samples one at a time stays linear instead of re-copying the whole buffer on
+every sample.
+
+Acquisition keeps the chunks of a dump session in columnar form (start address
+and length columns, plus the chunk payloads), and has streaming writers for
+	- raw concatenated data (what write_chunks() always did)
+	- flat binary image, sparse : each chunk is written at its offset with seek()
+	- Intel HEX
+	- Motorola S-record
+
+DumpSession makes a dump resumable : every chunk goes straight into a preallocated,
+mmap'd image file at its address offset, then its range is appended to a journal
+next to it (<image>.journal). Rerunning with the same image picks up the journal
+and only the ranges not covered yet need to be captured.
+
+Journal format, text :
+	batchcapture journal base=<hex> size=<hex> datawidth=<n>
+	<start hex> <end hex>		one line per chunk written, end exclusive
+'''
+
+import bisect
+import mmap
+import os
+from array import array
+
+
+class Chunk:
+    __slots__ = ('start', 'datawidth', '_buf', '_len')
+
+    # capacity : initial payload allocation in bytes, e.g. rows * datawidth
+    def __init__(self, start, datawidth=2, capacity=0x100, data=None):
+        self.start = start
+        self.datawidth = datawidth
+        if data is not None:
+            self._buf = bytearray(data)
+            self._len = len(self._buf)
+        else:
+            self._buf = bytearray(capacity)
+            self._len = 0
+
+    def _reserve(self, n):
+        need = self._len + n
+        if need > len(self._buf):
+            grow = max(need, 2 * len(self._buf), 0x100)
+            self._buf.extend(bytes(grow - len(self._buf)))
+
+    # append one sample word, big-endian
+    def append(self, word):
+        self._reserve(self.datawidth)
+        end = self._len + self.datawidth
+        self._buf[self._len:end] = word.to_bytes(self.datawidth)
+        self._len = end
+
+    # append raw bytes
+    def extend(self, b):
+        n = len(b)
+        self._reserve(n)
+        self._buf[self._len:self._len + n] = b
+        self._len += n
+
+    # payload, without copying
+    @property
+    def data(self):
+        return memoryview(self._buf)[:self._len]
+
+    # first address past the chunk
+    @property
+    def end(self):
+        return self.start + self._len
+
+    def __len__(self):
+        return self._len
+
+    # legacy [start, data] interface. data is a bytes copy there, as it was : callers
+    # may keep it, or the chunk may grow (extend) under a view. Use .data to avoid the copy
+    def __getitem__(self, i):
+        return (self.start, bytes(self.data))[i]
+
+    def __iter__(self):
+        return iter((self.start, bytes(self.data)))
+
+    def __eq__(self, other):
+        return (self[0] == other[0]) and (self[1] == bytes(other[1]))
+
+    def __repr__(self):
+        return f"Chunk({self.start:#x}-{self.end - 1:#x}, {self._len:#x} bytes)"
+
+
+# columnar store of chunks
+class Acquisition:
+    __slots__ = ('datawidth', 'starts', 'lengths', 'chunks')
+
+    def __init__(self, chunks=(), datawidth=2):
+        self.datawidth = datawidth
+        self.starts = array('Q')
+        self.lengths = array('Q')
+        self.chunks = []
+        for c in chunks:
+            self.add(c)
+
+    # accepts a Chunk or a legacy [start, bytes] list
+    def add(self, chunk):
+        if not isinstance(chunk, Chunk):
+            chunk = Chunk(chunk[0], self.datawidth, data=chunk[1])
+        self.starts.append(chunk.start)
+        self.lengths.append(len(chunk))
+        self.chunks.append(chunk)
+        return chunk
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def __getitem__(self, i):
+        return self.chunks[i]
+
+    # (lowest address, first address past the end)
+    def span(self):
+        if not self.chunks:
+            return (0, 0)
+        return (min(self.starts),
+                max(s + n for s, n in zip(self.starts, self.lengths)))
+
+    # sum of chunk sizes, overlaps counted twice
+    def payload_size(self):
+        return sum(self.lengths)
+
+    # chunks concatenated in capture order, like write_chunks() always did
+    def write_raw(self, f):
+        for c in self.chunks:
+            f.write(c.data)
+
+    # flat image, chunk at address A is written at file offset (A - base).
+    # gaps are left as holes (read back as 0) unless 'fill' is given, in which
+    # case the whole image is prefilled with that byte value.
+    # f must be seekable.
+    def write_bin(self, f, base=None, fill=None):
+        lo, hi = self.span()
+        if base is None:
+            base = lo
+        if fill is not None:
+            blk = bytes([fill]) * 0x10000
+            f.seek(0)
+            remain = hi - base
+            while remain > 0:
+                n = min(remain, len(blk))
+                f.write(blk[:n])
+                remain -= n
+        for c in self.chunks:
+            if c.start < base:
+                raise ValueError(f"chunk @ {c.start:#x} below image base {base:#x}")
+            f.seek(c.start - base)
+            f.write(c.data)
+        f.truncate(hi - base)
+
+    # Intel HEX, with type 04 (extended linear address) records as needed.
+    # f is a text-mode file
+    def write_ihex(self, f, reclen=0x20):
+        upper = None
+        for c in sorted(self.chunks, key=lambda c: c.start):
+            lines = []
+            mv = c.data
+            a = c.start
+            pos = 0
+            while pos < len(mv):
+                if (a >> 16) != upper:
+                    upper = a >> 16
+                    if upper > 0xffff:
+                        raise ValueError(f"address {a:#x} too large for Intel HEX")
+                    lines.append(_ihex_rec(0, 4, upper.to_bytes(2)))
+                # don't let a record cross a 64k boundary
+                n = min(reclen, len(mv) - pos, 0x10000 - (a & 0xffff))
+                lines.append(_ihex_rec(a & 0xffff, 0, mv[pos:pos + n]))
+                a += n
+                pos += n
+            f.write(''.join(lines))
+        f.write(_ihex_rec(0, 1, b''))
+
+    # Motorola S-record. Address size (S1/S2/S3) is picked from the highest
+    # address unless addrlen (2,3,4) is given
+    def write_srec(self, f, reclen=0x20, header=b'batchcapture', addrlen=None):
+        if addrlen is None:
+            hi = self.span()[1]
+            addrlen = 2 if hi <= 0x10000 else 3 if hi <= 0x1000000 else 4
+        dtype = addrlen - 1     # S1/S2/S3
+        f.write(_srec_rec(0, 0, 2, header))
+        count = 0
+        for c in sorted(self.chunks, key=lambda c: c.start):
+            lines = []
+            mv = c.data
+            a = c.start
+            pos = 0
+            while pos < len(mv):
+                n = min(reclen, len(mv) - pos)
+                lines.append(_srec_rec(dtype, a, addrlen, mv[pos:pos + n]))
+                a += n
+                pos += n
+            count += len(lines)
+            f.write(''.join(lines))
+        if count <= 0xffff:
+            f.write(_srec_rec(5, count, 2, b''))
+        elif count <= 0xffffff:
+            f.write(_srec_rec(6, count, 3, b''))
+        f.write(_srec_rec(10 - dtype, 0, addrlen, b''))  # S9/S8/S7
+
+
+# set of covered address ranges, kept as sorted, merged [start, end) intervals
+class Coverage:
+    __slots__ = ('starts', 'ends')
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+
+    def add(self, start, end):
+        if end <= start:
+            return
+        # first interval that ends at or after 'start', last one that starts at or before 'end'
+        i = bisect.bisect_left(self.ends, start)
+        j = bisect.bisect_right(self.starts, end)
+        if i < j:
+            start = min(start, self.starts[i])
+            end = max(end, self.ends[j - 1])
+        self.starts[i:j] = [start]
+        self.ends[i:j] = [end]
+
+    def __iter__(self):
+        return zip(self.starts, self.ends)
+
+    def copy(self):
+        c = Coverage()
+        c.starts = list(self.starts)
+        c.ends = list(self.ends)
+        return c
+
+    def __len__(self):
+        return len(self.starts)
+
+    def covered(self, lo=None, hi=None):
+        if lo is None:
+            return sum(e - s for s, e in self)
+        return sum(max(0, min(e, hi) - max(s, lo)) for s, e in self)
+
+    # uncovered [start, end) ranges within [lo, hi)
+    def gaps(self, lo, hi):
+        a = lo
+        i = bisect.bisect_right(self.ends, lo)
+        while a < hi:
+            if i >= len(self.starts) or self.starts[i] >= hi:
+                yield (a, hi)
+                return
+            if self.starts[i] > a:
+                yield (a, self.starts[i])
+            a = max(a, self.ends[i])
+            i += 1
+
+    # lowest uncovered address in [lo, hi), or None
+    def first_gap(self, lo, hi):
+        for g in self.gaps(lo, hi):
+            return g[0]
+        return None
+
+
+# an existing journal was written for another range or datawidth
+class JournalMismatch(ValueError):
+    pass
+
+
+# persistent dump : mmap'd image of [base, base + size) plus journal
+class DumpSession:
+    __slots__ = ('path', 'base', 'size', 'datawidth', 'coverage', '_f', '_mm', '_journal')
+
+    def __init__(self, path, base, size, datawidth=2):
+        self.path = path
+        self.base = base
+        self.size = size
+        self.datawidth = datawidth
+        self.coverage = Coverage()
+        jpath = path + '.journal'
+        if os.path.exists(jpath):
+            self._read_journal(jpath)
+        elif os.path.exists(path):
+            # an image without journal : can't tell what's valid in it
+            print(f"{path} exists but has no journal, starting over")
+        self._f = open(path, "r+b" if os.path.exists(path) else "w+b")
+        if os.fstat(self._f.fileno()).st_size != size:
+            self._f.truncate(size)     # sparse, until written
+        self._mm = mmap.mmap(self._f.fileno(), size)
+        self._journal = open(jpath, "a")
+        if not self._journal.tell():
+            self._journal.write(f"batchcapture journal base={base:x} size={size:x} datawidth={datawidth}\n")
+            self._journal.flush()
+
+    def _read_journal(self, jpath):
+        with open(jpath) as f:
+            hdr = f.readline().split()
+            fields = dict(kv.split('=') for kv in hdr[2:])
+            if (int(fields['base'], 16), int(fields['size'], 16)) != (self.base, self.size):
+                raise JournalMismatch(f"{jpath} is for base={fields['base']} size={fields['size']}, "
+                                      f"not base={self.base:x} size={self.size:x}")
+            if int(fields.get('datawidth', self.datawidth)) != self.datawidth:
+                raise JournalMismatch(f"{jpath} is for datawidth={fields['datawidth']}, not {self.datawidth}")
+            for line in f:
+                # last line may be incomplete if we died while writing it
+                try:
+                    s, e = (int(x, 16) for x in line.split())
+                except ValueError:
+                    continue
+                self.coverage.add(s, e)
+        print(f"resuming : {self.coverage.covered():#x}/{self.size:#x} bytes already dumped "
+              f"in {len(self.coverage)} ranges")
+
+    # write chunk into the image, then journal it. Parts outside the image are dropped.
+    # Returns the number of bytes stored
+    def add(self, chunk):
+        if chunk is None or not len(chunk):
+            return 0
+        lo = max(chunk.start, self.base)
+        hi = min(chunk.start + len(chunk), self.base + self.size)
+        if hi <= lo:
+            return 0
+        o = lo - self.base
+        self._mm[o:hi - self.base] = chunk.data[lo - chunk.start:hi - chunk.start]
+        # data must be on disk before the journal says so
+        pg = o - o % mmap.ALLOCATIONGRANULARITY
+        self._mm.flush(pg, hi - self.base - pg)
+        self._journal.write(f"{lo:x} {hi:x}\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self.coverage.add(lo, hi)
+        return hi - lo
+
+    # lowest address not dumped yet, at or after 'addr'; None when complete
+    def next_addr(self, addr=None):
+        return self.coverage.first_gap(self.base if addr is None else addr, self.base + self.size)
+
+    @property
+    def complete(self):
+        return self.next_addr() is None
+
+    def close(self):
+        self._mm.close()
+        self._f.close()
+        self._journal.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _ihex_rec(addr, rtype, data):
+    rec = bytes((len(data), addr >> 8, addr & 0xff, rtype)) + bytes(data)
+    cks = (-sum(rec)) & 0xff
+    return f":{rec.hex().upper()}{cks:02X}\n"
+
+def _srec_rec(stype, addr, addrlen, data):
+    rec = bytes((addrlen + len(data) + 1,)) + addr.to_bytes(addrlen) + bytes(data)
+    cks = ~sum(rec) & 0xff
+    return f"S{stype}{rec.hex().upper()}{cks:02X}\n"
@@ -4,6 +4,7 @@
 #
 # script to aid in dumping ROMs in-situ, while target is running.
 # Requires pyvisa and pyvisa-py (or other backend)
+# numpy is optional, but makes parse_raw() much faster
 #
 '''
 This was developed for the HP 1660C but should work on many similar LAs.
@@ -16,6 +17,9 @@ The strategy is to load the correct config on the hp1660 manually, then use this
 	- repeat
 
 In half-channel mode, the 1660C can do 8k records per trace, i.e. 16kB of ROM data.
+By default the LA is used as it was set up. With optimize=True, dumploop() picks the
+mode, and whether machine 2 can capture a second window per target reset, by itself,
+and changes the setup accordingly; see lacapacity.py.
 
 Should work over GPIB and RS232 transports as well, hopefully
 
@@ -68,14 +72,28 @@ set sequence level 1 to count 65535 times before proceeding ? -> doesnt work as
 '''
 
 import argparse
+import concurrent.futures
 import pyvisa
 import struct
 import itertools
 import time
 
+from acqstore import Chunk, Acquisition, Coverage, DumpSession
+from lasession import la_session, batched
+from dumpmetrics import timed
+from lacapacity import optimize_capacity, read_labels
+
+# optional; parse_raw() falls back to the pure-python decoder without it
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 # modify this func if automated reset is possible
-def target_reset():
+# instr : the LA that was just armed, to tell targets apart when dumping with several
+#   LAs (see paralleldump.py)
+def target_reset(instr=None):
     print("reset target now.")
     return
 
@@ -104,43 +122,448 @@ def set_darkmode (instr):
 def reset_colors (instr):
     instr.write(":setc def")
 
-# run capture loop, return list of chunks
-# may return more data than desired (does not truncate a full capture)
-def dumploop (instr, start_addr, cnt, datawidth=2, timeout=5000):
-    ca = start_addr
-    end_addr = start_addr + cnt - 1
-    chunks = []
-    instr.write(f":sel 1")
-    am,dm = get_mask(instr)
-    while cnt > 0:
-        instr.write(f":mach1:str:term b,'ADDR','#H{ca:x}'")
+# set term B to 'addr' and start a capture.
+# addr : trigger address, or a list of them for machines 1, 2, ...
+# waiter : capture_waiter, told when the capture was started
+# metrics : capture_metrics, gets the 'arm' and 'reset' phases
+def arm(instr, addr, waiter=None, metrics=None):
+    addrs = [addr] if isinstance(addr, int) else addr
+    # one program message on an la_session
+    with timed(metrics, 'arm'), batched(instr):
+        for n, a in enumerate(addrs, 1):
+            instr.write(f":mach{n}:str:term b,'ADDR','#H{a:x}'")
         instr.write('*cls')
         instr.write(':start')
-        target_reset()
-        print(f"CAPTURE ({start_addr:#X}-{end_addr:#X}): "
-              f"waiting for trigger on addr={ca:#X}")
-        req_abort = 0
-        while 1:
+    if waiter is not None:
+        waiter.armed()
+    with timed(metrics, 'reset'):
+        target_reset(instr)
+
+
+# wait_capture() / capture_waiter.wait() return values
+WAIT_DONE = 0
+WAIT_ABORT = 1      # Ctrl-C
+WAIT_TIMEOUT = 2
+WAIT_CANCEL = 3     # 'cancel' was set, e.g. by another thread
+
+# waits for a capture to complete (MESR1 bit 0).
+# strategy:
+#   'srq' : MESR1 bit 0 is routed to the status byte (:mese1 / *sre) and we block on the
+#       service request line; only on transports that have one (GPIB). No polling at all.
+#   'poll' : adaptive polling of mesr1?. The first query is sent a bit before the capture is
+#       expected to be done (learned from previous captures), then every 'min_poll' seconds,
+#       backing off up to 'max_poll'.
+#   'auto' : 'srq' if the transport supports it, else 'poll'
+# timeout : ms from arming, None to wait forever
+# machines : number of state machines armed (1, 2, ...) ; done when all of them are
+# cancel : threading.Event; when set, the wait ends with WAIT_CANCEL
+class capture_waiter:
+    __slots__ = ('instr', 'timeout', 'strategy', 'min_poll', 'max_poll', 't_arm', 'expected',
+                 'polls', 'machines', 'pending', 'cancel')
+
+    def __init__(self, instr, timeout=None, strategy='auto', min_poll=0.01, max_poll=0.2,
+                 machines=1, cancel=None):
+        self.instr = instr
+        self.timeout = timeout
+        self.cancel = cancel
+        self.machines = machines
+        self.pending = set(range(1, machines + 1))
+        self.min_poll = min_poll
+        self.max_poll = max_poll
+        self.t_arm = None
+        self.expected = None    # seconds from arming to trigger, running average
+        self.polls = 0
+        if strategy == 'auto':
+            strategy = 'srq' if has_srq(instr) else 'poll'
+        if strategy == 'srq' and not has_srq(instr):
+            print("no service request line on this transport, falling back to polling")
+            strategy = 'poll'
+        if strategy == 'srq' and not self.enable_srq():
+            strategy = 'poll'
+        self.strategy = strategy
+        print(f"capture wait: {strategy}"
+              + (f" (poll {min_poll * 1000:.0f}-{max_poll * 1000:.0f}ms)" if strategy == 'poll' else '')
+              + (f", timeout {timeout}ms" if timeout else ", no timeout"))
+
+    # MESR<n> bit 0 -> status byte bit 0 (MSB) -> SRQ
+    def enable_srq(self):
+        try:
+            for n in range(1, self.machines + 1):
+                self.instr.write(f':mese{n} 1')
+            self.instr.write('*sre 1')
+            self.instr.query('*stb?')
+        except Exception as e:
+            print(f"could not enable SRQ ({e}), falling back to polling")
+            return False
+        return True
+
+    def armed(self):
+        self.t_arm = time.monotonic()
+        self.pending = set(range(1, self.machines + 1))
+
+    # returns WAIT_DONE, WAIT_ABORT, WAIT_TIMEOUT or WAIT_CANCEL
+    def wait(self):
+        if self.t_arm is None:
+            self.armed()
+        self.polls = 0
+        try:
+            if self.strategy == 'srq':
+                rv = self.wait_srq()
+            else:
+                rv = self.wait_poll()
+        except KeyboardInterrupt:
+            return WAIT_ABORT
+        dt = time.monotonic() - self.t_arm
+        self.t_arm = None
+        if rv == WAIT_TIMEOUT:
+            print(f"timeout : no trigger after {dt:.2f}s")
+            return rv
+        if rv == WAIT_CANCEL:
+            print(f"cancelled after {dt:.2f}s")
+            return rv
+        self.expected = dt if self.expected is None else (self.expected + dt) / 2
+        print(f"triggered after {dt:.3f}s ({self.strategy}, {self.polls} queries)")
+        return rv
+
+    def cancelled(self):
+        return self.cancel is not None and self.cancel.is_set()
+
+    # seconds left before timeout, or None
+    def remaining(self):
+        if not self.timeout:
+            return None
+        return self.t_arm + self.timeout / 1000 - time.monotonic()
+
+    # MESR<n> is cleared when read : remember which machines are done already
+    def done(self):
+        for n in sorted(self.pending):
+            self.polls += 1
+            # bit 0 should be set when done
+            if int(self.instr.query(f'mesr{n}?')) & 1:
+                self.pending.discard(n)
+        return not self.pending
+
+    def wait_poll(self):
+        # skip most of the time the previous captures took
+        if self.expected:
+            early = self.t_arm + self.expected * 0.9 - time.monotonic()
+            if early > 0:
+                time.sleep(early)
+        interval = self.min_poll
+        while not self.done():
+            if self.cancelled():
+                return WAIT_CANCEL
+            left = self.remaining()
+            if left is not None and left <= 0:
+                return WAIT_TIMEOUT
+            time.sleep(interval if left is None else min(interval, left))
+            interval = min(interval * 1.5, self.max_poll)
+        return WAIT_DONE
+
+    def wait_srq(self):
+        while True:
+            if self.cancelled():
+                return WAIT_CANCEL
+            left = self.remaining()
+            if left is not None and left <= 0:
+                return WAIT_TIMEOUT
+            # short slices, so that Ctrl-C gets a chance
+            slice_ms = 500 if left is None else max(1, min(500, int(left * 1000)))
             try:
-                esr = int(instr.query('mesr1?'))
-                # bit 0 should be set when done
-                if esr & 1: break
-                # instr.write(':stop')
-                time.sleep(0.2)
-            except KeyboardInterrupt:
-                req_abort = 1
-                break
-        rd=get_rawdata(instr)
-        chunk=parse_raw(rd,am,dm, datawidth)
-        chunks.append(chunk)
-        if req_abort:
-            print("cancelling operation, data may be incomplete")
-            return chunks
-        cl = len(chunk[1])
-        ca += cl
-        cnt -= cl
+                self.instr.wait_for_srq(slice_ms)
+            except pyvisa.errors.VisaIOError:
+                continue
+            # reading the status byte clears the SRQ; MESR1 tells if it's really ours
+            self.instr.read_stb()
+            if self.done():
+                return WAIT_DONE
+
+# transports with a hardware service request line
+def has_srq(instr):
+    return getattr(instr, 'interface_type', None) == pyvisa.constants.InterfaceType.gpib
+
+# wait for the capture to complete. Returns WAIT_DONE, WAIT_ABORT (Ctrl-C) or WAIT_TIMEOUT
+# timeout : ms, None to wait forever
+def wait_capture(instr, timeout=None, strategy='auto'):
+    return capture_waiter(instr, timeout, strategy).wait()
+
+# decides where to trigger next : the lowest address of [lo, hi) that no capture
+# has covered yet. Every run of every capture counts, including the ones after a
+# discontinuity, so ranges that happened to be read already are never captured again.
+# coverage : acqstore.Coverage to start from, e.g. DumpSession.coverage
+class capture_plan:
+    __slots__ = ('lo', 'hi', 'coverage', 'last', 'stalls')
+
+    # give up after this many captures in a row that add nothing at the trigger address
+    MAX_STALLS = 3
+
+    def __init__(self, lo, hi, coverage=None):
+        self.lo = lo
+        self.hi = hi
+        self.coverage = Coverage() if coverage is None else coverage
+        self.last = None
+        self.stalls = 0
+
+    # record the runs of one capture, clipped to [lo, hi); returns how many new bytes they brought.
+    # pieces : list that gets the new parts of the runs, as Chunks (see merge_chunks)
+    def add(self, runs, pieces=None):
+        before = self.coverage.covered(self.lo, self.hi)
+        for c in runs:
+            lo, hi = max(c.start, self.lo), min(c.end, self.hi)
+            if pieces is not None and lo < hi:
+                for a, b in self.coverage.gaps(lo, hi):
+                    pieces.append(Chunk(a, c.datawidth, data=c.data[a - c.start:b - c.start]))
+            self.coverage.add(lo, hi)
+        return self.coverage.covered(self.lo, self.hi) - before
+
+    # next trigger address, None when done (or stuck)
+    def next(self):
+        a = self.coverage.first_gap(self.lo, self.hi)
+        if a is not None and a == self.last:
+            self.stalls += 1
+            if self.stalls >= self.MAX_STALLS:
+                print(f"no data for {a:#x} after {self.stalls} captures, giving up")
+                return None
+        else:
+            self.stalls = 0
+        self.last = a
+        return a
+
+    # trigger addresses for 'k' machines capturing at once : 'addr', then the next gaps,
+    # assuming every window brings a full, contiguous 'n' bytes. Machines left without
+    # a gap get 'addr' too
+    def windows(self, addr, k, n):
+        out = [addr]
+        a = addr
+        while len(out) < k:
+            if a is not None:
+                a = self.coverage.first_gap(a + n, self.hi)
+            out.append(addr if a is None else a)
+        return out
+
+    # what next() should return if the capture at 'addr' brings a full,
+    # contiguous 'n' bytes
+    def predict(self, addr, n):
+        a = self.coverage.first_gap(self.lo, self.hi)
+        if a is not None and addr <= a < addr + n:
+            a = self.coverage.first_gap(addr + n, self.hi)
+        return a
+
+    def missing(self):
+        return (self.hi - self.lo) - self.coverage.covered(self.lo, self.hi)
+
+
+# run capture loop, return Acquisition (list of chunks)
+# Every contiguous run of each capture is kept (see parse_runs), and the next trigger
+# is the lowest address not covered yet (see capture_plan).
+# The chunks returned are what this loop dumped of [start_addr, start_addr + cnt),
+# sorted and without overlaps (see merge_chunks), i.e. ready for write_chunks().
+# timeout : ms to wait for each trigger, None (default) : forever, e.g. when target_reset()
+#   waits for a manual reset. wait_strategy : see capture_waiter
+# session : DumpSession; chunks are saved to it as they come in, ranges it already
+#   has are skipped, i.e. an interrupted dump can be resumed. See resume_dump().
+#   Anything with .coverage and .add(chunk) will do, e.g. paralleldump.unit_sink
+# metrics : dumpmetrics.capture_metrics, to time every phase of every capture; its
+#   clock starts with the loop, and its summary is printed at the end
+# stream : decode captures while they're transferred (stream_decoder, needs an la_session).
+#   'transfer' then includes the parsing.
+# optimize : False (default) : machine 1 is used as it is set up.
+#   True : set up the LA for the most ROM per capture first (lacapacity.optimize_capacity),
+#   e.g. half-channel mode, or machines 1 and 2 each capturing their own window; this
+#   changes the acquisition mode. On an la_session, that is only planned again after the
+#   LA config changed.
+#   Can also be the capture_config it returned earlier, if the LA is still set up that way.
+# coverage : acqstore.Coverage of ranges to skip (e.g. dumped already by other LAs);
+#   updated as captures come in. Not with 'session', which has its own
+# cancel : threading.Event, see capture_waiter. When set, the capture in progress is
+#   stopped and what was dumped so far is returned
+def dumploop (instr, start_addr, cnt, datawidth=2, timeout=None, wait_strategy='auto',
+              session=None, metrics=None, stream=False, optimize=False, coverage=None,
+              cancel=None):
+    if metrics is not None:
+        metrics.begin()
+    end_addr = start_addr + cnt - 1
+    pieces = []
+    plan = capture_plan(start_addr, start_addr + cnt,
+                        session.coverage if session is not None else coverage)
+    ca = plan.next()
+    if ca is None:
+        print("nothing left to dump")
+        return Acquisition(datawidth=datawidth)
+    instr.write(f":sel 1")
+    machines, window = capture_setup(instr, datawidth, optimize)
+    masks = [get_mask(instr, n) for n in machines]
+    waiter = capture_waiter(instr, timeout, wait_strategy, machines=len(machines), cancel=cancel)
+    try:
+        while ca is not None:
+            if metrics is not None:
+                metrics.start(ca)
+            addrs = plan.windows(ca, len(machines), window)
+            arm(instr, addrs, waiter, metrics)
+            print(f"CAPTURE ({start_addr:#X}-{end_addr:#X}): "
+                  f"waiting for trigger on addr={', '.join(f'{a:#X}' for a in addrs)}, "
+                  f"{plan.missing():#x} bytes to go")
+            with timed(metrics, 'wait'):
+                req_abort = waiter.wait()
+            if req_abort in (WAIT_TIMEOUT, WAIT_CANCEL):
+                instr.write(':stop')
+                print("giving up, data may be incomplete")
+                return merge_chunks(pieces, datawidth)
+            if stream:
+                with timed(metrics, 'transfer'):
+                    runs, dec = get_runs_streaming(instr, masks, datawidth)
+                nbytes, nrows = dec.nbytes, dec.rows
+            else:
+                with timed(metrics, 'transfer'):
+                    rd=_rawdata_view(instr)
+                with timed(metrics, 'parse'):
+                    runs = [c for am, dm in masks for c in parse_runs(rd, am, dm, datawidth)]
+                nbytes, nrows = len(rd), capture_rows(rd)
+            # only the new parts go to the session : its coverage is the plan's
+            n = len(pieces)
+            new = plan.add(runs, pieces)
+            with timed(metrics, 'write'):
+                if session is not None:
+                    for chunk in pieces[n:]:
+                        session.add(chunk)
+            if metrics is not None:
+                metrics.count(bytes=nbytes, rows=nrows, runs=len(runs), new=new)
+                metrics.end()
+            if req_abort:
+                print("cancelling operation, data may be incomplete")
+                return merge_chunks(pieces, datawidth)
+            ca = plan.next()
+    finally:
+        if metrics is not None:
+            metrics.summary()
+    return merge_chunks(pieces, datawidth)
+
+# dumploop() into image file 'fname', resuming from its journal if there is one.
+# fname holds [start_addr, start_addr + cnt) ; see acqstore.DumpSession
+def resume_dump (instr, fname, start_addr, cnt, datawidth=2, **kw):
+    with DumpSession(fname, start_addr, cnt, datawidth) as session:
+        chunks = dumploop(instr, start_addr, cnt, datawidth, session=session, **kw)
+        left = session.size - session.coverage.covered()
+        print(f"{fname}: {'complete' if not left else f'{left:#x} bytes missing, run again to resume'}")
     return chunks
 
+# machines to arm and ROM bytes per machine and capture (0 : unknown), for the dump
+# loops' 'optimize' argument (see dumploop). max_machines : how many the loop can arm
+def capture_setup(instr, datawidth, optimize, max_machines=2):
+    if not optimize:
+        return ((1,), 0)
+    if optimize is True:
+        cfg = optimize_capacity(instr, datawidth, max_machines)
+    else:
+        cfg = optimize
+        if len(cfg.machines) > max_machines:
+            raise ValueError(f"capture_config for machines {cfg.machines}, this loop arms at most {max_machines}")
+    return (cfg.machines, cfg.rows * datawidth)
+
+# pipelined version of dumploop : as soon as a capture is downloaded, the next one is
+# armed at the predicted address (i.e. assuming this capture is a full, contiguous chunk),
+# while a worker thread parses the data, and optionally writes it to 'outfile'
+# at offset (address - start_addr).
+# If the parsed runs don't leave the predicted address as the next gap, the pending
+# capture is stopped and re-armed at the right address.
+# metrics : as for dumploop; 'parse' and 'write' are timed in the worker thread
+# optimize : as for dumploop, but machine 1 only
+def dumploop_pipelined (instr, start_addr, cnt, datawidth=2, timeout=None, outfile=None,
+                        wait_strategy='auto', metrics=None, optimize=False):
+    if metrics is not None:
+        metrics.begin()
+    end = start_addr + cnt
+    pieces = []
+    instr.write(f":sel 1")
+    capture_setup(instr, datawidth, optimize, max_machines=1)
+    am,dm = get_mask(instr)
+    outf = open(outfile, "wb") if outfile else None
+    plan = capture_plan(start_addr, end)
+
+    def work(rd, rec):
+        with timed(metrics, 'parse', rec):
+            runs = parse_runs(rd, am, dm, datawidth)
+        with timed(metrics, 'write', rec):
+            if outf is not None:
+                for c in runs:
+                    lo, hi = max(c.start, start_addr), min(c.end, end)
+                    if lo < hi:
+                        outf.seek(lo - start_addr)
+                        outf.write(c.data[lo - c.start:hi - c.start])
+        return runs
+
+    waiter = capture_waiter(instr, timeout, wait_strategy)
+    ca = plan.next()    # address of the capture in progress
+    rec = metrics.start(ca) if metrics is not None else None
+    arm(instr, ca, waiter, metrics)
+    mispredicts = 0
+    ncaptures = 0
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as ex:
+            while ca is not None:
+                print(f"CAPTURE ({start_addr:#X}-{end - 1:#X}): "
+                      f"waiting for trigger on addr={ca:#X}, {plan.missing():#x} bytes to go")
+                with timed(metrics, 'wait', rec):
+                    req_abort = waiter.wait()
+                if req_abort == WAIT_TIMEOUT:
+                    instr.write(':stop')
+                    print("giving up, data may be incomplete")
+                    break
+                with timed(metrics, 'transfer', rec):
+                    rd = _rawdata_view(instr)
+                ncaptures += 1
+                fut = ex.submit(work, rd, rec)
+                if req_abort:
+                    plan.add(fut.result(), pieces)
+                    print("cancelling operation, data may be incomplete")
+                    break
+                pre = parse_preamble(rd)
+                predicted = plan.predict(ca, pre[1] * datawidth if pre else 0)
+                nrec = None
+                if predicted is not None:
+                    if metrics is not None:
+                        nrec = metrics.start(predicted)
+                    arm(instr, predicted, waiter, metrics)
+                # the LA is busy with the next capture while we wait for the parser
+                runs = fut.result()
+                new = plan.add(runs, pieces)
+                if metrics is not None:
+                    metrics.count(rec, bytes=len(rd), rows=pre[1] if pre else 0, runs=len(runs), new=new)
+                    metrics.end(rec)
+                actual = plan.next()
+                if actual != predicted:
+                    mispredicts += 1
+                    if predicted is not None:
+                        instr.write(':stop')
+                    if actual is not None:
+                        print(f"re-arming at {actual:#X}")
+                        if metrics is not None:
+                            if nrec is None:
+                                nrec = metrics.start(actual)
+                            nrec['addr'] = actual
+                            metrics.count(nrec, rearms=1)
+                        arm(instr, actual, waiter, metrics)
+                ca = actual
+                rec = nrec
+    finally:
+        if outf is not None:
+            outf.close()
+        if metrics is not None:
+            metrics.summary()
+    print(f"{ncaptures} captures, {mispredicts} mispredicted")
+    return merge_chunks(pieces, datawidth)
+
+# sort chunks that don't overlap, e.g. from capture_plan.add(), and join the ones that
+# follow each other. Returns an Acquisition
+def merge_chunks(pieces, datawidth=2):
+    out = []
+    for c in sorted(pieces, key=lambda c: c.start):
+        if out and c.start == out[-1].end:
+            out[-1].extend(c.data)
+        else:
+            out.append(Chunk(c.start, datawidth, data=c.data))
+    return Acquisition(out, datawidth=datawidth)
+
 # pretty-print a chunklist
 def chunk_info (chl):
     for c in chl:
@@ -148,10 +571,31 @@ def chunk_info (chl):
         end=start + len(c[1]) - 1
         print(f"{start:x}-{end:x}")
 
-def write_chunks (fname, chunks):
+# write chunks (list or Acquisition) to a file.
+# fmt:
+#   'raw' (default) : chunk data concatenated in order, no addresses, as always; with the
+#       dump loops' chunks (sorted, no overlaps) that's an image if there are no gaps
+#   'bin' : flat image starting at 'base' (default : the lowest address), gaps filled
+#       with 'fill' (or left sparse)
+#   'ihex' : Intel HEX
+#   'srec' : Motorola S-record
+def write_chunks (fname, chunks, fmt='raw', fill=0xff, base=None):
+    if not isinstance(chunks, Acquisition):
+        chunks = Acquisition(chunks)
+    if fmt in ('ihex', 'srec'):
+        with open(fname, "w", newline='\r\n') as f:
+            if fmt == 'ihex':
+                chunks.write_ihex(f)
+            else:
+                chunks.write_srec(f)
+        return
     with open(fname, "wb") as f:
-        for chunk in chunks:
-            f.write(chunk[1])
+        if fmt == 'bin':
+            chunks.write_bin(f, base=base, fill=fill)
+        elif fmt == 'raw':
+            chunks.write_raw(f)
+        else:
+            raise ValueError(f"unknown output format '{fmt}'")
 
 
 # get (address,data) bitmap masks
@@ -159,20 +603,16 @@ def write_chunks (fname, chunks):
 # In half-channel (full depth) mode, I don't think there's a way to
 # identify which pod in a pair is being used. That is, the 'sfor:label?' query will 
 # return a bit mask of whatever pods were enabled, but the GUI lets you change that
-# (e.g. A8 instead of A7) hence this workaround.
-def get_mask(instr):
-    origmode=instr.query(':mach1:sfor:mode?')
-    instr.write(':mach1:sfor:mode FULL')
-    am_str=instr.query(':mach1:sfor:label? "ADDR"').split(',')[3:]
-    dm_str=instr.query(':mach1:sfor:label? "DATA"').split(',')[3:]
-    am = list(map(int,am_str))
-    dm = list(map(int,dm_str))
-    instr.write(':mach1:sfor:mode ' + origmode)
-# returns something like '"ADDR  ",POSITIVE,0,0,3840,65535'
-# where the numeric fields are <clock_bits>,<bitmask>,<bitmask>...
-# and each bitmask applies to a pod ; matches left-to-right ordering of Format display
-# label string 'ADDR' is case-sensitive !
-    podlist=instr.query_ascii_values(':mach1:ass?', 'd')
+# (e.g. A8 instead of A7) hence this workaround (see lacapacity.read_labels).
+# mach : state machine, 1 or 2
+# On an la_session, the result is cached until the LA config changes.
+def get_mask(instr, mach=1):
+    if isinstance(instr, la_session):
+        return instr.memo(('mask', mach), lambda: read_mask(instr, mach))
+    return read_mask(instr, mach)
+
+def read_mask(instr, mach=1):
+    podlist, am, dm = read_labels(instr, mach)
     #e.g. [8,7,4,3,2,1]. Use these to shift the bitmasks to final 'A8A7A6....A1' pattern
     amask = sum(map(lambda msk, pl: msk << (16 * (pl - 1)), am, podlist))
     dmask = sum(map(lambda msk, pl: msk << (16 * (pl - 1)), dm, podlist))
@@ -205,13 +645,14 @@ def unshift_rawdata2(src, mask):
 
 
 
-# parse raw data according to dev config, return single contiguous chunk.
-# maybe some work needed to make it less device-dependant
+# number of rows in a capture, from the DATA section preamble
+def capture_rows(rd):
+    pre = parse_preamble(rd)
+    return pre[1] if pre else 0
+
+# parse the DATA section preamble, return (bpr, max_rows, acqdata)
 # rd: raw data received from :SYST:DATA? query, starting at its "DATA      " header
-# _mask: (num_pods * 2)-bytes long mask of bits to extract data, e.g.
-#           A8 A7 ..... A1
-# data_mask=FF 00 00 00 00  : 16 bits of A8 will end up in DATA
-def parse_raw(rd, addr_mask, data_mask, datawidth=2):
+def parse_preamble(rd):
     sec_hdr = rd[0:10]
     if sec_hdr != b'DATA      ':
         print("bad section header")
@@ -224,11 +665,34 @@ def parse_raw(rd, addr_mask, data_mask, datawidth=2):
     validrows = rd[100:126]
     max_rows = max(struct.unpack('>10xHHHHHHHH', validrows))   #magic to extract 8x uint16
     acqdata = rd[176:176+(max_rows * bpr)]
-    print(f"parsing {bpr}B/row, {max_rows} rows")
+    return (bpr, max_rows, acqdata)
+
 
+# parse raw data according to dev config, return single contiguous chunk.
+# maybe some work needed to make it less device-dependant
+# rd: raw data received from :SYST:DATA? query, starting at its "DATA      " header
+# _mask: (num_pods * 2)-bytes long mask of bits to extract data, e.g.
+#           A8 A7 ..... A1
+# data_mask=FF 00 00 00 00  : 16 bits of A8 will end up in DATA
+# engine: 'numpy', 'python', or None to use numpy when available.
+def parse_raw(rd, addr_mask, data_mask, datawidth=2, engine=None):
+    pre = parse_preamble(rd)
+    if pre is None:
+        return
+    bpr, max_rows, acqdata = pre
+    if engine is None:
+        engine = 'numpy' if np is not None else 'python'
+    print(f"parsing {bpr}B/row, {max_rows} rows ({engine})")
+    if engine == 'numpy':
+        return parse_rows_np(acqdata, bpr, addr_mask, data_mask, datawidth)
+    return parse_rows_py(acqdata, bpr, addr_mask, data_mask, datawidth)
+
+
+# reference decoder : one row at a time, as a big int
+def parse_rows_py(acqdata, bpr, addr_mask, data_mask, datawidth=2):
     #print(f"am: {addr_mask:X}, dm:{data_mask:X}")
     chunk_start = None
-    chunkdata = b''
+    chunk = None
     last_addr = None
     for rawsample in itertools.batched(acqdata, bpr, strict=1):
         sample=int.from_bytes(rawsample)
@@ -237,41 +701,295 @@ def parse_raw(rd, addr_mask, data_mask, datawidth=2):
         if chunk_start is None:
             #first loop only
             chunk_start = addr
+            chunk = Chunk(addr, datawidth, capacity=(len(acqdata) // bpr) * datawidth)
             last_addr = addr - datawidth
         if not (addr & 0xfff):
             print(f"@ {addr:X}: {data:X}... ") #chunksize={len(chunkdata):X}")
             #print(f"@ {addr:X}: {data:X} ({sample:X})")
         if addr == (last_addr + datawidth):
-            chunkdata = chunkdata + data.to_bytes(datawidth)
+            chunk.append(data)
         else:
             print(f"discontinuity from {last_addr:#x} to {addr:#x}")
             # cannot ignore this without user intervention; save data and abort
-            chunklist=[chunk_start, chunkdata]
-            return chunklist
+            return chunk
         last_addr = addr
-    print(f"last addr: {last_addr:#x}, chunksize={len(chunkdata):X}")
-    chunklist=[chunk_start, chunkdata]
-    return chunklist
-
-
-# fetch raw data after a capture
+    print(f"last addr: {last_addr:#x}, chunksize={len(chunk):X}")
+    return chunk
+
+
+# extract the bits selected by 'mask' from every row of 'bits' at once.
+# bits: (rows x bpr*8) array from np.unpackbits, MSB first, i.e. column 0
+# is bit (bpr*8 - 1) of the big int that unshift_rawdata() would see.
+# Returns a uint64 column, right-aligned like unshift_rawdata()
+def unshift_rows_np(bits, mask):
+    nbits = bits.shape[1]
+    pos = [b for b in range(nbits) if (mask >> b) & 1]
+    if len(pos) > 64:
+        raise ValueError(f"label too wide ({len(pos)} bits)")
+    cols = np.array([nbits - 1 - b for b in pos], dtype=np.intp)
+    weights = np.left_shift(np.uint64(1), np.arange(len(pos), dtype=np.uint64))
+    return bits[:, cols].astype(np.uint64) @ weights
+
+
+# vectorized equivalent of parse_rows_py : decode all rows in one pass,
+# then find the first discontinuity with a diff.
+def parse_rows_np(acqdata, bpr, addr_mask, data_mask, datawidth=2):
+    addrs, datas = decode_rows_np(acqdata, bpr, addr_mask, data_mask)
+    if not addrs.size:
+        return Chunk(None, datawidth, data=b'')
+
+    chunk_start = int(addrs[0])
+    breaks = np.flatnonzero(np.diff(addrs.astype(np.int64)) != datawidth)
+    nrows = int(breaks[0]) + 1 if breaks.size else len(addrs)
+
+    for i in np.flatnonzero((addrs[:nrows] & 0xfff) == 0):
+        print(f"@ {int(addrs[i]):X}: {int(datas[i]):X}... ")
+    chunkdata = words_to_bytes(datas[:nrows], datawidth)
+    last_addr = int(addrs[nrows - 1])
+    if breaks.size:
+        print(f"discontinuity from {last_addr:#x} to {int(addrs[nrows]):#x}")
+    else:
+        print(f"last addr: {last_addr:#x}, chunksize={len(chunkdata):X}")
+    return Chunk(chunk_start, datawidth, data=chunkdata)
+
+
+# (addresses, data) columns of all rows
+def decode_rows_np(acqdata, bpr, addr_mask, data_mask):
+    rows = np.frombuffer(acqdata, dtype=np.uint8)
+    if rows.size % bpr:
+        raise ValueError(f"acqdata length {rows.size} not a multiple of {bpr}")
+    if not rows.size:
+        return (np.zeros(0, np.uint64), np.zeros(0, np.uint64))
+    bits = np.unpackbits(rows.reshape(-1, bpr), axis=1)
+    return (unshift_rows_np(bits, addr_mask), unshift_rows_np(bits, data_mask))
+
+def words_to_bytes(datas, datawidth):
+    if datawidth in (1, 2, 4, 8):
+        return datas.astype(f'>u{datawidth}').tobytes()
+    return b''.join(int(d).to_bytes(datawidth) for d in datas)
+
+
+# like parse_raw, but instead of stopping at the first discontinuity, return every
+# contiguous run of the capture as a list of Chunks, in capture order.
+# Runs shorter than 'min_rows' are dropped : a few stray fetches are more likely
+# to be a glitch in the trigger setup than real data.
+def parse_runs(rd, addr_mask, data_mask, datawidth=2, min_rows=8, engine=None):
+    pre = parse_preamble(rd)
+    if pre is None:
+        return []
+    bpr, max_rows, acqdata = pre
+    if engine is None:
+        engine = 'numpy' if np is not None else 'python'
+    if engine == 'numpy':
+        runs = runs_np(acqdata, bpr, addr_mask, data_mask, datawidth)
+    else:
+        runs = runs_py(acqdata, bpr, addr_mask, data_mask, datawidth)
+    kept = [c for c in runs if len(c) >= min_rows * datawidth]
+    print(f"{max_rows} rows ({engine}), {len(runs)} runs : "
+          + ', '.join(f"{c.start:#x}-{c.end - 1:#x}" for c in kept)
+          + (f" ({len(runs) - len(kept)} short runs dropped)" if len(kept) != len(runs) else ''))
+    return kept
+
+def runs_py(acqdata, bpr, addr_mask, data_mask, datawidth=2):
+    runs = []
+    chunk = None
+    last_addr = None
+    for rawsample in itertools.batched(acqdata, bpr, strict=1):
+        sample=int.from_bytes(rawsample)
+        addr=unshift_rawdata(sample, addr_mask)
+        data=unshift_rawdata(sample, data_mask)
+        if chunk is None or addr != (last_addr + datawidth):
+            chunk = Chunk(addr, datawidth)
+            runs.append(chunk)
+        chunk.append(data)
+        last_addr = addr
+    return runs
+
+def runs_np(acqdata, bpr, addr_mask, data_mask, datawidth=2):
+    addrs, datas = decode_rows_np(acqdata, bpr, addr_mask, data_mask)
+    if not addrs.size:
+        return []
+    # row index where each run starts
+    bounds = [0] + list(np.flatnonzero(np.diff(addrs.astype(np.int64)) != datawidth) + 1) + [len(addrs)]
+    return [Chunk(int(addrs[a]), datawidth, data=words_to_bytes(datas[a:b], datawidth))
+            for a, b in zip(bounds, bounds[1:])]
+
+
+# incremental version of parse_runs, for use while :syst:data? is still arriving :
+# feed() it the block piece by piece (e.g. la_session.stream_block(q, dec.feed)).
+# The preamble is parsed as soon as its 176 bytes are in, then rows are decoded as
+# they come; only a partial row is kept between pieces, never the whole trace.
+# First data and the first discontinuity are reported as soon as they're seen.
+# finish() returns the runs, like parse_runs().
+class stream_decoder:
+    __slots__ = ('addr_mask', 'data_mask', 'datawidth', 'min_rows', 'engine', 'hdr', 'bpr',
+                 'max_rows', 'rows', 'partial', 'runs', 'last_addr', 'nbytes', 't0',
+                 't_first', 't_break')
+
+    PREAMBLE_LEN = 176
+
+    def __init__(self, addr_mask, data_mask, datawidth=2, min_rows=8, engine=None):
+        self.addr_mask = addr_mask
+        self.data_mask = data_mask
+        self.datawidth = datawidth
+        self.min_rows = min_rows
+        if engine is None:
+            engine = 'numpy' if np is not None else 'python'
+        self.engine = engine
+        self.hdr = bytearray()
+        self.bpr = None
+        self.max_rows = None
+        self.rows = 0           # rows decoded so far
+        self.partial = bytearray()
+        self.runs = []
+        self.last_addr = None
+        self.nbytes = 0
+        self.t0 = None          # when the first byte came in
+        self.t_first = None     # when the first row was decoded
+        self.t_break = None     # when the first discontinuity was seen
+
+    def feed(self, d):
+        if self.t0 is None:
+            self.t0 = time.monotonic()
+        self.nbytes += len(d)
+        d = memoryview(d).cast('B')
+        if self.bpr is None:
+            need = self.PREAMBLE_LEN - len(self.hdr)
+            self.hdr += d[:need]
+            d = d[need:]
+            if len(self.hdr) < self.PREAMBLE_LEN:
+                return
+            pre = parse_preamble(self.hdr)
+            if pre is None:
+                raise ValueError("bad DATA section")
+            self.bpr, self.max_rows, _ = pre
+            print(f"preamble: {self.bpr}B/row, {self.max_rows} rows ({self.engine})")
+        left = (self.max_rows - self.rows) * self.bpr - len(self.partial)
+        if left <= 0 or not len(d):
+            return      # past the rows : other sections, ignored
+        d = d[:left]
+        if self.partial:
+            self.partial += d
+            buf = self.partial
+        else:
+            buf = d
+        n = len(buf) // self.bpr * self.bpr
+        if n:
+            self._decode(buf[:n])
+        self.partial = bytearray(buf[n:])
+
+    # decode whole rows, extend the current run or start new ones
+    def _decode(self, rows):
+        dw = self.datawidth
+        if self.engine == 'numpy':
+            addrs, datas = decode_rows_np(rows, self.bpr, self.addr_mask, self.data_mask)
+            bounds = list(np.flatnonzero(np.diff(addrs.astype(np.int64)) != dw) + 1)
+            pieces = [(int(addrs[a]), words_to_bytes(datas[a:b], dw))
+                      for a, b in zip([0] + bounds, bounds + [len(addrs)])]
+            nrows = len(addrs)
+            last = int(addrs[-1])
+        else:
+            pieces = []
+            for i in range(0, len(rows), self.bpr):
+                sample = int.from_bytes(rows[i:i + self.bpr])
+                addr = unshift_rawdata(sample, self.addr_mask)
+                data = unshift_rawdata(sample, self.data_mask).to_bytes(dw)
+                if pieces and addr == pieces[-1][0] + len(pieces[-1][1]):
+                    pieces[-1][1].extend(data)
+                else:
+                    pieces.append((addr, bytearray(data)))
+            nrows = len(rows) // self.bpr
+            last = pieces[-1][0] + len(pieces[-1][1]) - dw
+        for addr, data in pieces:
+            if self.runs and addr == self.last_addr + dw:
+                self.runs[-1].extend(data)
+            else:
+                if self.runs and self.t_break is None:
+                    self.t_break = time.monotonic()
+                    print(f"discontinuity from {self.last_addr:#x} to {addr:#x} at row {self.rows}, "
+                          f"{self.nbytes} bytes into the transfer")
+                self.runs.append(Chunk(addr, dw, capacity=len(data), data=data))
+            self.last_addr = addr + len(data) - dw
+        if self.t_first is None:
+            self.t_first = time.monotonic()
+            print(f"first data @ {self.runs[0].start:#x}, "
+                  f"{(self.t_first - self.t0) * 1000:.1f}ms after the first byte")
+        self.rows += nrows
+        self.last_addr = last
+
+    def finish(self):
+        if self.bpr is None:
+            print("no DATA preamble received")
+            return []
+        if self.rows < self.max_rows:
+            print(f"short capture : {self.rows}/{self.max_rows} rows")
+        kept = [c for c in self.runs if len(c) >= self.min_rows * self.datawidth]
+        print(f"{self.rows} rows ({self.engine}, streamed), {len(self.runs)} runs : "
+              + ', '.join(f"{c.start:#x}-{c.end - 1:#x}" for c in kept)
+              + (f" ({len(self.runs) - len(kept)} short runs dropped)" if len(kept) != len(self.runs) else ''))
+        return kept
+
+
+# run both decoders on the same capture and report whether they agree.
+def compare_engines(rd, addr_mask, data_mask, datawidth=2):
+    ref = parse_raw(rd, addr_mask, data_mask, datawidth, engine='python')
+    vec = parse_raw(rd, addr_mask, data_mask, datawidth, engine='numpy')
+    if ref != vec:
+        print(f"engine mismatch: python {ref!r}, numpy {vec!r}")
+        return False
+    ref = parse_runs(rd, addr_mask, data_mask, datawidth, engine='python')
+    vec = parse_runs(rd, addr_mask, data_mask, datawidth, engine='numpy')
+    if ref != vec:
+        print(f"engine mismatch (runs): python {ref!r}, numpy {vec!r}")
+        return False
+    return True
+
+
+# fetch and decode a capture with stream_decoder, while it's being transferred.
+# masks : list of (addr_mask, data_mask), one per machine; every piece goes to each decoder.
+# Needs an la_session. Returns (runs of all machines, first decoder)
+def get_runs_streaming(instr, masks, datawidth=2):
+    decs = [stream_decoder(am, dm, datawidth) for am, dm in masks]
+
+    def feed(d):
+        for dec in decs:
+            dec.feed(d)
+    instr.stream_block(':syst:data?', feed)
+    return ([c for dec in decs for c in dec.finish()], decs[0])
+
+# fetch raw data after a capture, as bytes
 def get_rawdata(instr):
+    return bytes(_rawdata_view(instr))
+
+# same for the dump loops, without the copy : on an la_session this is a memoryview
+# into a reused buffer, only valid until the next call
+def _rawdata_view(instr):
+    if isinstance(instr, la_session):
+        return instr.query_block(':syst:data?')
     rawdata = instr.query_binary_values(':syst:data?', datatype='s', container=bytes)
     return rawdata
 
 
-parser = argparse.ArgumentParser(description="HP 1660 LA-powered ROM dumper helper")
-parser.add_argument('-H', '--host', required=True, help='LA hostname')
-parser.add_argument('-p', '--port', type=int, default=5025, help='telnet port')
-args = parser.parse_args()
+# open a ::SOCKET connection to the LA. Returns an la_session (batching, cached state)
+# which works like the plain pyvisa resource
+def connect(hostname, port=5025):
+    rm = pyvisa.ResourceManager('@py')
+    instr=rm.open_resource('TCPIP0::' + hostname + '::' + str(port) + '::SOCKET')
+    # because the 1660 isn't "discoverable" we need to use ::SOCKET mode, which means we need to set terminator
+    instr.read_termination='\n'
+    instr = la_session(instr)
+    print("connected to: " + instr.query('*idn?'))
+    return instr
 
-hostname=args.host
-port=args.port
 
+# when imported (e.g. by la_sim.py), nothing below runs
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="HP 1660 LA-powered ROM dumper helper")
+    parser.add_argument('-H', '--host', required=True, help='LA hostname')
+    parser.add_argument('-p', '--port', type=int, default=5025, help='telnet port')
+    args = parser.parse_args()
 
-rm = pyvisa.ResourceManager('@py')
-la=rm.open_resource('TCPIP0::' + hostname + '::' + str(port) + '::SOCKET')
-# because the 1660 isn't "discoverable" we need to use ::SOCKET mode, which means we need to set terminator
-la.read_termination='\n'
-print("connected to: " + la.query('*idn?'))
+    hostname=args.host
+    port=args.port
 
+    la = connect(hostname, port)
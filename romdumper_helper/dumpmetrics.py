@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+#
+# (c) fenugrec 2025
+#
+# per-capture timing for batchcapture dump loops
+#
+'''
+capture_metrics times each phase of every capture, and writes one JSON object per
+capture (JSON Lines) as soon as the capture is done :
+
+	{"capture": 3, "addr": 49152, "t": 12.71,
+	 "phases": {"arm": 0.0012, "reset": 0.0001, "wait": 0.3154, "transfer": 0.0791,
+	            "parse": 0.0042, "write": 0.0009},
+	 "bytes": 147632, "rows": 8192, "runs": 1, "new": 16384, "total": 0.4021}
+
+phases :
+	arm			term B + *cls + :start (one message on an la_session)
+	reset		target_reset()
+	wait		trigger wait (capture_waiter)
+	transfer	:syst:data? (and parse_runs() when streaming, see dumploop(stream=True))
+	parse		parse_runs()
+	write		saving chunks (DumpSession, output file)
+bytes : size of the :syst:data? block; rows : rows in the capture;
+new : ROM bytes this capture added to the dump (i.e. not already covered).
+
+At the end, summary() prints percentiles per phase and the useful throughput in ROM
+bytes per minute, and appends it as a last {"summary": ...} line.
+'''
+
+import contextlib
+import json
+import threading
+import time
+
+PHASES = ('arm', 'reset', 'wait', 'transfer', 'parse', 'write')
+
+
+# p-th percentile (0-100) of a sorted list, nearest rank
+def percentile(v, p):
+    if not v:
+        return None
+    return v[min(len(v) - 1, max(0, round(p / 100 * (len(v) - 1))))]
+
+
+class capture_metrics:
+    __slots__ = ('out', '_own', 'records', 'cur', 'n', 't0', 'lock')
+
+    # out : filename or text file object for the JSON Lines; None to only keep them in memory
+    def __init__(self, out=None):
+        self._own = isinstance(out, str)
+        self.out = open(out, 'w') if self._own else out
+        self.records = []
+        self.cur = None
+        self.n = 0              # records started
+        self.t0 = time.monotonic()
+        self.lock = threading.Lock()
+
+    # a dump loop starts : the wall clock, and record times ('t'), count from here.
+    # summary() only covers the captures from then on
+    def begin(self):
+        self.t0 = time.monotonic()
+        self.records = []
+        self.cur = None
+
+    # begin a new capture record, which becomes the current one; returns it
+    def start(self, addr):
+        self.cur = {'capture': self.n, 'addr': addr,
+                    't': round(time.monotonic() - self.t0, 4), 'phases': {},
+                    'bytes': 0, 'rows': 0, 'runs': 0, 'new': 0}
+        self.n += 1
+        return self.cur
+
+    # time a phase of record 'rec' (default : the current one). Times add up if a
+    # phase runs more than once (e.g. re-arming)
+    @contextlib.contextmanager
+    def phase(self, name, rec=None):
+        if rec is None:
+            rec = self.cur
+        t = time.monotonic()
+        try:
+            yield
+        finally:
+            dt = time.monotonic() - t
+            if rec is not None:
+                with self.lock:
+                    rec['phases'][name] = rec['phases'].get(name, 0.0) + dt
+
+    # add to counters of record 'rec' (default : the current one)
+    def count(self, rec=None, **kw):
+        if rec is None:
+            rec = self.cur
+        if rec is None:
+            return
+        with self.lock:
+            for k, v in kw.items():
+                rec[k] = rec.get(k, 0) + v
+
+    # finish record 'rec' (default : the current one) and write it out
+    def end(self, rec=None):
+        if rec is None:
+            rec = self.cur
+        if rec is None or 'total' in rec:
+            return
+        if rec is self.cur:
+            self.cur = None
+        with self.lock:
+            rec['total'] = round(time.monotonic() - self.t0 - rec['t'], 4)
+            rec['phases'] = {k: round(v, 6) for k, v in rec['phases'].items()}
+            self.records.append(rec)
+            if self.out is not None:
+                self.out.write(json.dumps(rec) + '\n')
+                self.out.flush()
+
+    # per-phase stats and throughput, over all finished records
+    def summary(self, show=True):
+        self.end()
+        wall = time.monotonic() - self.t0
+        recs = self.records
+        phases = {}
+        names = [p for p in PHASES if any(p in r['phases'] for r in recs)]
+        names += sorted({p for r in recs for p in r['phases']} - set(names))
+        for p in names:
+            v = sorted(r['phases'].get(p, 0.0) for r in recs)
+            phases[p] = {'total': round(sum(v), 4), 'share': round(sum(v) / wall, 4) if wall else None,
+                         'p50': percentile(v, 50), 'p90': percentile(v, 90), 'max': v[-1]}
+        new = sum(r['new'] for r in recs)
+        xfer = sum(r['bytes'] for r in recs)
+        xfer_time = sum(r['phases'].get('transfer', 0.0) for r in recs)
+        s = {'captures': len(recs), 'wall': round(wall, 3), 'new_bytes': new,
+             'bytes_transferred': xfer, 'rows': sum(r['rows'] for r in recs),
+             'rom_bytes_per_min': round(new / wall * 60) if wall else None,
+             'link_bytes_per_s': round(xfer / xfer_time) if xfer_time else None,
+             'phases': phases}
+        if self.out is not None:
+            self.out.write(json.dumps({'summary': s}) + '\n')
+            self.out.flush()
+        if show:
+            print(f"{len(recs)} captures in {wall:.1f}s : {new:#x} new ROM bytes, "
+                  f"{s['rom_bytes_per_min'] or 0} B/min; {xfer} bytes transferred"
+                  + (f" at {s['link_bytes_per_s'] / 1000:.0f} kB/s" if s['link_bytes_per_s'] else ''))
+            print(f"{'phase':<9} {'total':>8} {'share':>6} {'p50':>9} {'p90':>9} {'max':>9}")
+            for p, st in phases.items():
+                print(f"{p:<9} {st['total']:7.2f}s {st['share'] * 100:5.1f}% "
+                      f"{st['p50'] * 1000:7.1f}ms {st['p90'] * 1000:7.1f}ms {st['max'] * 1000:7.1f}ms")
+        return s
+
+    def close(self):
+        if self._own:
+            self.out.close()
+
+
+# m.phase(name) if there is an m
+def timed(m, name, rec=None):
+    if m is None:
+        return contextlib.nullcontext()
+    return m.phase(name, rec)
@@ -0,0 +1,733 @@
+#!/usr/bin/env python
+#
+# (c) fenugrec 2025
+#
+# simulated HP 1660-series LA, for testing and benchmarking without hardware
+#
+'''
+A TCP server speaking the subset of the 1660 pseudo-telnet SCPI that batchcapture.py
+and ial2.py use, with a synthetic target "ROM" being read in a loop :
+	*idn? *cls *opc? :sel :syst:err? :syst:dsp
+	:mach<n>:sfor:mode[?] :mach<n>:sfor:label? :mach<n>:ass? :mach<n>:type?
+	:mach<n>:str:term b,'ADDR','#H<addr>'
+	:start :stop mesr<n>? :mese<n>[?] *sre[?] *ese[?] *stb?
+	:syst:data?		DATA section with preamble, valid-rows table and rows
+	:setc[?]
+	:mmem:cd :mmem:download (files are kept in memory) :mmem:catalog?
+
+Messages can hold several ';'-separated commands, with relative headers.
+
+Capture model : after :start, the capture completes 'latency' seconds later. The listing
+starts with the fetch at the term B address and continues with consecutive ROM words;
+at the end of the ROM, the target wraps around to the start (i.e. an address discontinuity).
+With 'glitch' > 0, that fraction of captures also gets a discontinuity at a random row.
+With 'stall' > 0, that fraction of captures never triggers (e.g. a target that hangs).
+
+Pod layouts (4 pod pairs, 18 bytes / row), other pods are noise :
+	deep (default) : machine 1 only, one pod per pair, so half-channel mode is usable
+		ADDR : 24 bits, pod 1 (A0-A15) and pod 3 bits 0-7 (A16-A23)
+		DATA : 16 bits, pod 5
+	dual : machines 1 and 2, both on the same bus. Two pods of a pair are used, so
+	  full-channel mode only
+		machine 1 : ADDR pod 1 + pod 2 bits 0-7, DATA pod 3
+		machine 2 : ADDR pod 5 + pod 6 bits 0-7, DATA pod 7
+Depth is 'depth' rows in half-channel (DEEP) mode, half that in FULL mode. In DEEP mode,
+only one pod of each pair is acquired (the lower one, unless only the upper one has
+labels); the other pod's label bits are lost, as on the real thing.
+
+Examples:
+	python la_sim.py -p 5025 --latency 0.3 --bandwidth 200000
+	python la_sim.py --check 0 0x10000	: run batchcapture.dumploop() against it, verify dump
+	python la_sim.py --layout dual --optimize --check 0 0x40000 : one window per machine
+	python la_sim.py -n 3 --check 0 0x80000 : paralleldump.dump_parallel() with 3 LAs
+	python la_sim.py --check-sync		: ial2.py sync mode against it
+'''
+
+import argparse
+import random
+import socketserver
+import struct
+import threading
+import time
+
+import acqstore
+import dumpmetrics
+
+IDN = "HEWLETT PACKARD,1660C,0,REV 02.02 (simulated)"
+
+# long -> short SCPI header nodes
+LONG_NODES = {
+    'machine1': 'mach1', 'machine2': 'mach2', 'strigger': 'str', 'sformat': 'sfor',
+    'assign': 'ass', 'system': 'syst', 'select': 'sel', 'mmemory': 'mmem',
+    'download': 'down', 'catalog': 'cat', 'setcolor': 'setc', 'label': 'lab',
+    'term': 'term', 'mode': 'mode', 'data': 'data', 'start': 'start', 'stop': 'stop',
+    'error': 'err', 'dsp': 'dsp',
+}
+
+def short_header(h):
+    h = h.lower()
+    q = '?' if h.endswith('?') else ''
+    return ':'.join(LONG_NODES.get(n, n) for n in h.rstrip('?').split(':')) + q
+
+# split on 'sep' outside of quotes
+def split_quoted(s, sep):
+    out = []
+    cur = ''
+    q = None
+    for c in s:
+        if q:
+            if c == q:
+                q = None
+        elif c in '"\'':
+            q = c
+        elif c == sep:
+            out.append(cur)
+            cur = ''
+            continue
+        cur += c
+    out.append(cur)
+    return out
+
+def unquote(s):
+    s = s.strip()
+    if len(s) >= 2 and s[0] in '"\'' and s[-1] == s[0]:
+        return s[1:-1]
+    return s
+
+
+# per-pod label masks are contiguous low bits (0xffff, 0xff, ...)
+LAYOUTS = {
+    # machine : (type, pods as :mach<n>:ass? reports them, {label: mask per pod, same order})
+    'deep': {
+        1: ('STATE', [6, 5, 4, 3, 2, 1], {'ADDR': [0, 0, 0, 0x00ff, 0, 0xffff],
+                                          'DATA': [0, 0xffff, 0, 0, 0, 0]}),
+        2: ('OFF', [], {}),
+    },
+    'dual': {
+        1: ('STATE', [4, 3, 2, 1], {'ADDR': [0, 0, 0x00ff, 0xffff],
+                                    'DATA': [0, 0xffff, 0, 0]}),
+        2: ('STATE', [8, 7, 6, 5], {'ADDR': [0, 0, 0x00ff, 0xffff],
+                                    'DATA': [0, 0xffff, 0, 0]}),
+    },
+}
+
+# size of a downloaded file on the LA : u32 length, 32-char description, then the
+# downloaded data (ia field byte + .R file), in '00 FE' chunks padded to 256 bytes
+# (see hfslif.ia_payload, chunking.chunked_size)
+def stored_size(data):
+    n = 4 + 32 + len(data)
+    n += 2 * -(-n // 0xfe)
+    return -(-n // 0x100) * 0x100
+
+class sim_machine:
+    __slots__ = ('type', 'podlist', 'labels', 'mode', 'term', 't_done', 'mesr', 'mese')
+
+    def __init__(self, mtype, podlist, labels):
+        self.type = mtype
+        self.podlist = podlist
+        self.labels = labels
+        # the setup a user would have loaded
+        self.mode = 'DEEP' if self.half_ok() else 'FULL'
+        self.term = {}
+        self.t_done = None
+        self.mesr = 0
+        self.mese = 0
+
+    def active(self):
+        return self.type != 'OFF' and bool(self.podlist)
+
+    # {pod: mask} of label 'name'
+    def pod_masks(self, name):
+        return {p: m for p, m in zip(self.podlist, self.labels.get(name, ())) if m}
+
+    # pods acquired in the current mode
+    def acquired(self):
+        if self.mode != 'DEEP':
+            return set(self.podlist)
+        used = {p for masks in self.labels.values() for p, m in zip(self.podlist, masks) if m}
+        out = set()
+        for p in self.podlist:
+            lo = p - (p - 1) % 2
+            if p == lo or (lo not in used and p in used):
+                out.add(p)
+        return out
+
+    def half_ok(self):
+        used = [p for masks in self.labels.values() for p, m in zip(self.podlist, masks) if m]
+        return len({(p - 1) // 2 for p in used}) == len(set(used))
+
+    # label reply, as the Format menu would show it in the current mode
+    def label(self, name):
+        acq = self.acquired()
+        return [m if p in acq else 0 for p, m in zip(self.podlist, self.labels[name])]
+
+
+class sim_la:
+    # rom : bytes, mapped at 'base'. depth : rows per capture in half-channel mode.
+    # layout : key of LAYOUTS
+    def __init__(self, rom, base=0, depth=8192, latency=0.2, bandwidth=None, glitch=0.0, seed=1,
+                 verbose=False, layout='deep', stall=0.0):
+        self.rom = bytes(rom)
+        self.base = base
+        self.depth = depth
+        self.latency = latency
+        self.bandwidth = bandwidth      # bytes/s, None : unlimited
+        self.glitch = glitch
+        self.stall = stall
+        self.rng = random.Random(seed)
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.podpairs = 4
+        self.machines = {n: sim_machine(*m) for n, m in LAYOUTS[layout].items()}
+        self.sre = 0
+        self.ese = 0
+        self.colors = {n: [n, 0, 0, 50] for n in range(1, 8)}
+        self.files = {}         # (dir, name) -> (description, type, data, date)
+        self.cwd = ''
+        self.errors = []
+        self.ncaptures = 0
+        self.ncommands = 0
+        self.nmessages = 0
+
+    def log(self, msg):
+        if self.verbose:
+            print(f"[sim] {msg}")
+
+    #######################################
+    #   capture
+
+    def start(self):
+        stalled = self.stall and self.rng.random() < self.stall
+        for m in self.machines.values():
+            m.t_done = None
+            if m.active() and not stalled:
+                m.t_done = time.monotonic() + self.latency
+                m.mesr = 0
+        self.ncaptures += 1
+
+    def poll(self):
+        for m in self.machines.values():
+            if m.t_done is not None and time.monotonic() >= m.t_done:
+                m.mesr |= 1
+                m.t_done = None
+
+    def rom_word(self, addr):
+        o = addr - self.base
+        return int.from_bytes(self.rom[o:o + 2])
+
+    # addresses of the captured rows
+    def row_addrs(self, trig, depth):
+        end = self.base + len(self.rom)
+        a = trig
+        glitch_at = None
+        if self.glitch and self.rng.random() < self.glitch:
+            glitch_at = self.rng.randrange(1, depth)
+        for i in range(depth):
+            if i == glitch_at:
+                a = self.base + self.rng.randrange(0, len(self.rom) // 2) * 2
+            if a >= end or a < self.base:
+                a = self.base
+            yield a
+            a += 2
+
+    # rows depth of machine 'm' in its current mode
+    def machine_depth(self, m):
+        return self.depth if m.mode == 'DEEP' else self.depth // 2
+
+    # (row bits, valid rows per pod pair) of the active machines
+    def machine_rows(self):
+        npods = 2 * self.podpairs
+        out = []
+        valid = [0] * 8
+        for m in self.machines.values():
+            if not m.active():
+                continue
+            depth = self.machine_depth(m)
+            acq = m.acquired()
+            # (label, shift in the label value, mask, bit position in the row) per pod,
+            # labels spread from the lowest pod up
+            fields = []
+            for name in ('ADDR', 'DATA'):
+                shift = 0
+                for p, mask in sorted(m.pod_masks(name).items()):
+                    if p in acq:
+                        fields.append((name, shift, mask, 16 * (p - 1)))
+                    shift += mask.bit_length()
+            for p in m.podlist:
+                valid[(p - 1) // 2] = depth
+            vals = []
+            for a in self.row_addrs(m.term.get('b', self.base), depth):
+                v = {'ADDR': a, 'DATA': self.rom_word(a)}
+                row = 0
+                for name, shift, mask, pos in fields:
+                    row |= ((v[name] >> shift) & mask) << pos
+                vals.append(row)
+            keep = sum(0xffff << (16 * (p - 1)) for p in acq)
+            out.append((vals, keep))
+        return (out, valid)
+
+    def data_section(self):
+        npods = 2 * self.podpairs
+        bpr = 2 + self.podpairs * 4
+        rows = bytearray()
+        noise = self.rng.getrandbits
+        # every machine writes its own pods, everything else is noise
+        machines, valid = self.machine_rows()
+        free = ((1 << (16 * npods)) - 1) & ~sum(keep for _, keep in machines)
+        for i in range(max(valid)):
+            row = noise(16 * npods) & free
+            for vals, keep in machines:
+                if i < len(vals):
+                    row |= vals[i]
+                else:
+                    row |= noise(16 * npods) & keep
+            rows += row.to_bytes(bpr)
+        pre = bytearray(176 - 16)
+        pre[3] = self.podpairs
+        for n, o in ((1, 6), (2, 8)):
+            podmask = sum(1 << (p - 1) for p in self.machines[n].podlist)
+            pre[o:o + 2] = podmask.to_bytes(2)
+        struct.pack_into('>8H', pre, 110 - 16, *valid)
+        body = bytes(pre) + bytes(rows)
+        return b'DATA      ' + b'\x00' + b'\x20' + struct.pack('>I', len(body)) + body
+
+    #######################################
+    #   command dispatch. Returns response (str or bytes block) or None
+
+    def execute(self, header, args, block=None):
+        h = short_header(header)
+        self.log(f"{h} {args}")
+        self.ncommands += 1
+        if h == '*idn?':
+            return IDN
+        if h in ('*cls', '*rst'):
+            for m in self.machines.values():
+                m.mesr = 0
+            self.errors = []
+            return
+        if h == '*opc?':
+            return '1'
+        if h in ('*sre', '*ese'):
+            setattr(self, h.strip('*'), int(args[0]))
+            return
+        if h in ('*sre?', '*ese?'):
+            return str(getattr(self, h.strip('*?')))
+        if h[:4] in ('mese', 'mesr', 'mach') and h[4:5] in ('1', '2'):
+            return self.execute_machine(self.machines[int(h[4])], h[:4] + h[5:], args)
+        if h == '*stb?':
+            # bit 0 : machine summary (MESR<n> & MESE<n>, any machine), bit 6 : MSS
+            self.poll()
+            stb = 1 if any(m.mesr & m.mese for m in self.machines.values()) else 0
+            if stb & self.sre:
+                stb |= 0x40
+            return str(stb)
+        if h == 'sel':
+            return
+        if h == 'syst:err?':
+            return self.errors.pop(0) if self.errors else '0,"No error"'
+        if h == 'syst:dsp':
+            return
+        if h == 'start':
+            self.start()
+            return
+        if h == 'stop':
+            for m in self.machines.values():
+                m.t_done = None
+            return
+        if h == 'syst:data?':
+            return self.data_section()
+        if h == 'setc':
+            if args[0].strip().lower().startswith('def'):
+                self.colors = {n: [n, 0, 0, 50] for n in range(1, 8)}
+            else:
+                v = [int(x) for x in args]
+                self.colors[v[0]] = v
+            return
+        if h == 'setc?':
+            return ','.join(str(x) for x in self.colors[int(args[0])])
+        if h == 'mmem:cd':
+            self.cwd = unquote(args[0])
+            return
+        if h == 'mmem:down':
+            name, descr, ftype = unquote(args[0]), unquote(args[2]), int(args[3])
+            self.files[(self.cwd, name)] = (descr, ftype, block, time.strftime('%d %b %y').upper())
+            self.log(f"stored {self.cwd}/{name} '{descr}' type {ftype}, {len(block)} bytes")
+            return
+        if h == 'mmem:cat?':
+            return self.catalog()
+        self.errors.append(f'-113,"Undefined header {header}"')
+        self.log(f"unknown command {header}")
+        return
+
+    # current directory, as 70-character entries : name, type, size, date, description
+    def catalog(self):
+        out = ''
+        for (d, name), (descr, ftype, data, date) in sorted(self.files.items()):
+            if d == self.cwd:
+                out += f"{name:<10} {ftype:>7} {stored_size(data):>8} {date:<9} {descr:<32}"
+        return out.encode('latin-1')
+
+    # :mach<n>:..., mesr<n>?, mese<n>[?] ; 'h' without the machine number
+    def execute_machine(self, m, h, args):
+        if h == 'mese':
+            m.mese = int(args[0])
+            return
+        if h == 'mese?':
+            return str(m.mese)
+        if h == 'mesr?':
+            self.poll()
+            v = m.mesr
+            m.mesr = 0          # read clears
+            return str(v)
+        if h == 'mach:type?':
+            return m.type
+        if h == 'mach:sfor:mode?':
+            return m.mode
+        if h == 'mach:sfor:mode':
+            m.mode = args[0].strip().upper()
+            return
+        if h == 'mach:sfor:lab?':
+            name = unquote(args[0])
+            if name not in m.labels:
+                self.errors.append('-224,"Illegal parameter value"')
+                return ''
+            return f'"{name:<6}",POSITIVE,0,' + ','.join(str(v) for v in m.label(name))
+        if h == 'mach:ass?':
+            return ','.join(str(p) for p in m.podlist)
+        if h == 'mach:str:term':
+            term = args[0].strip().lower()
+            val = unquote(args[2])
+            if val.upper().startswith('#H'):
+                m.term[term] = int(val[2:], 16)
+            return
+        self.errors.append(f'-113,"Undefined header {h}"')
+        self.log(f"unknown command {h}")
+
+
+class sim_handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        la = self.server.la
+        self.buf = bytearray()
+        self.path = ''
+        while True:
+            msg = self.read_message()
+            if msg is None:
+                return
+            text, blocks = msg
+            la.nmessages += 1
+            for unit in split_quoted(text, ';'):
+                unit = unit.strip()
+                if not unit:
+                    continue
+                hdr, _, argstr = unit.partition(' ')
+                if hdr.startswith('*'):
+                    full = hdr
+                elif hdr.startswith(':'):
+                    full = hdr[1:]
+                else:
+                    full = self.path + hdr  # relative to previous command
+                if not hdr.startswith('*'):
+                    self.path = full.rpartition(':')[0]
+                    self.path = self.path + ':' if self.path else ''
+                args = split_quoted(argstr, ',') if argstr else []
+                block = blocks.pop(0) if ('#' in argstr and blocks) else None
+                with la.lock:
+                    resp = la.execute(full, args, block)
+                if resp is not None:
+                    self.send(resp)
+
+    # read one program message, i.e. until a '\n' that isn't inside a quoted string
+    # or a definite-length block. Returns (text, [blocks]) ; blocks replaced by '#' in text
+    def read_message(self):
+        i = 0
+        q = None
+        text = bytearray()
+        blocks = []
+        while True:
+            while i >= len(self.buf):
+                d = self.request.recv(0x10000)
+                if not d:
+                    return None
+                self.throttle(len(d))
+                self.buf += d
+            c = self.buf[i]
+            if q:
+                if c == q:
+                    q = None
+                text.append(c)
+                i += 1
+            elif c in b'"\'':
+                q = c
+                text.append(c)
+                i += 1
+            elif c == ord('#') and i + 1 < len(self.buf) and chr(self.buf[i + 1]).isdigit() \
+                    and self.buf[i + 1] != ord('0'):
+                nd = self.buf[i + 1] - ord('0')
+                while len(self.buf) < i + 2 + nd:
+                    self.recv_more()
+                n = int(self.buf[i + 2:i + 2 + nd])
+                while len(self.buf) < i + 2 + nd + n:
+                    self.recv_more()
+                blocks.append(bytes(self.buf[i + 2 + nd:i + 2 + nd + n]))
+                text += b'#'
+                i += 2 + nd + n
+            elif c == ord('\n'):
+                del self.buf[:i + 1]
+                return (text.decode(errors='replace').strip(), blocks)
+            else:
+                text.append(c)
+                i += 1
+
+    def recv_more(self):
+        d = self.request.recv(0x10000)
+        if not d:
+            raise ConnectionError("closed in the middle of a block")
+        self.throttle(len(d))
+        self.buf += d
+
+    def throttle(self, n):
+        bw = self.server.la.bandwidth
+        if bw:
+            time.sleep(n / bw)
+
+    def send(self, resp):
+        if isinstance(resp, str):
+            data = resp.encode() + b'\n'
+        else:
+            data = b'#8%08d' % len(resp) + resp + b'\n'
+        bw = self.server.la.bandwidth
+        if not bw:
+            self.request.sendall(data)
+            return
+        step = max(1, int(bw / 50))     # ~20ms slices
+        for p in range(0, len(data), step):
+            self.request.sendall(data[p:p + step])
+            time.sleep(len(data[p:p + step]) / bw)
+
+
+class sim_server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, la, host='127.0.0.1', port=5025):
+        self.la = la
+        super().__init__((host, port), sim_handler)
+
+
+# deterministic pseudo-random ROM, with some structure so it doesn't look like pure noise
+def synthetic_rom(size, seed=1):
+    rng = random.Random(seed)
+    rom = bytearray(rng.getrandbits(8 * size).to_bytes(size))
+    # a few runs of FF like erased / unused areas
+    for _ in range(size // 0x4000):
+        o = rng.randrange(0, size)
+        n = min(rng.randrange(0x10, 0x400), size - o)
+        rom[o:o + n] = b'\xff' * n
+    return bytes(rom)
+
+# start a simulator on a background thread; returns the server (server.server_address for port)
+def start_sim(la, host='127.0.0.1', port=0):
+    srv = sim_server(la, host, port)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv
+
+
+# dump [start, start+cnt) from a simulator with batchcapture.dumploop(), compare with the ROM
+# pipelined : use dumploop_pipelined() instead
+# image : use batchcapture.resume_dump() into that file, and check the file
+def check_dump(la, start, cnt, pipelined=False, image=None, **kw):
+    import batchcapture
+    import io
+    srv = start_sim(la)
+    host, port = srv.server_address
+    instr = batchcapture.connect(host, port)
+    t0 = time.monotonic()
+    if image:
+        batchcapture.resume_dump(instr, image, start, cnt, **kw)
+    else:
+        loop = batchcapture.dumploop_pipelined if pipelined else batchcapture.dumploop
+        chunks = loop(instr, start, cnt, **kw)
+    dt = time.monotonic() - t0
+    if image:
+        with open(image, 'rb') as f:
+            got = f.read()
+    else:
+        f = io.BytesIO()
+        # runs from outside the range (e.g. after wrapping around) can't go in the image
+        batchcapture.Acquisition(c for c in chunks if c.start >= start).write_bin(f, base=start)
+        got = f.getvalue()[:cnt]
+    o = start - la.base
+    expect = la.rom[o:o + cnt]
+    instr.close()
+    srv.shutdown()
+    ok = got == expect
+    print(f"dumped {len(got):#x}/{cnt:#x} bytes in {dt:.2f}s, {la.ncaptures} captures, "
+          f"{la.nmessages} messages / {la.ncommands} commands : {'OK' if ok else 'MISMATCH'}")
+    if not ok:
+        for i, (a, b) in enumerate(zip(got, expect)):
+            if a != b:
+                print(f"first difference @ {start + i:#x}")
+                break
+    return ok
+
+
+# ial2.py sync against a simulator : files the LA has already are skipped, files with the
+# same name and description but other contents are uploaded, whether or not we uploaded
+# them before. Batch and fleet mode share the state. Returns True if all went as expected
+def check_sync(la):
+    import os
+    import sys
+    import tempfile
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+    import ial2
+    srv = start_sim(la)
+    host, port = srv.server_address
+    resource = ial2.resource_name(host, port)
+    old = b'\x82\x03' + bytes(range(256)) * 4
+    new = b'\x82\x03' + bytes(range(256)) * 8
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp:
+        def items(**files):
+            out = []
+            for name, data in files.items():
+                path = os.path.join(tmp, name + '.R')
+                with open(path, 'wb') as f:
+                    f.write(data)
+                out.append(ial2.upload_item({'file': path, 'description': 'SYNC TEST', 'dir': 'IA'}))
+            return out
+
+        def step(what, r, files, skipped):
+            nonlocal ok
+            good = r['ok'] and (r['files'], r['skipped']) == (files, skipped)
+            ok &= good
+            print(f"sync : {what} : {r['files']} uploaded, {r['skipped']} skipped "
+                  f"(expected {files}, {skipped}) {'OK' if good else 'FAIL'}")
+
+        state = os.path.join(tmp, 'state.json')
+        # on the LA before we ever synced : A and B, from somewhere else
+        ial2.batch(resource, items(A=old, B=old))
+        step("no record, B changed", ial2.batch(resource, items(A=old, B=new), sync=ial2.sync_state(state)), 1, 1)
+        changed = new[:-1] + b'\0'
+        step("B changed, same size", ial2.batch(resource, items(A=old, B=changed), sync=ial2.sync_state(state)), 1, 1)
+        step("fleet, nothing changed", ial2.fleet([host], items(A=old, B=changed), port,
+                                                  sync=ial2.sync_state(state))[0], 0, 2)
+    srv.shutdown()
+    got = la.files[('IA', 'B')][2]
+    if got[1:] != changed:
+        print("sync : B on the LA isn't the last version FAIL")
+        ok = False
+    return ok
+
+
+# same with paralleldump.dump_parallel() over all LAs in 'las' (they share the ROM)
+def check_parallel(las, start, cnt, image=None, **kw):
+    import batchcapture
+    import io
+    import paralleldump
+    srvs = [start_sim(la) for la in las]
+    instrs = [batchcapture.connect(*srv.server_address) for srv in srvs]
+    t0 = time.monotonic()
+    chunks = paralleldump.dump_parallel(instrs, start, cnt, image=image, **kw)
+    dt = time.monotonic() - t0
+    if image:
+        with open(image, 'rb') as f:
+            got = f.read()
+    else:
+        f = io.BytesIO()
+        batchcapture.Acquisition(c for c in chunks if c.start >= start).write_bin(f, base=start)
+        got = f.getvalue()[:cnt]
+    o = start - las[0].base
+    expect = las[0].rom[o:o + cnt]
+    for instr in instrs:
+        instr.close()
+    for srv in srvs:
+        srv.shutdown()
+    ok = got == expect
+    print(f"dumped {len(got):#x}/{cnt:#x} bytes in {dt:.2f}s, "
+          f"captures per LA : {', '.join(str(la.ncaptures) for la in las)} : {'OK' if ok else 'MISMATCH'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="simulated HP 1660 LA")
+    parser.add_argument('-p', '--port', type=int, default=5025, help="first TCP port")
+    parser.add_argument('-n', '--count', type=int, default=1, help="number of simulated LAs, on consecutive ports")
+    parser.add_argument('--bind', default='127.0.0.1')
+    parser.add_argument('--rom', help="ROM image file (default: synthetic)")
+    parser.add_argument('--romsize', type=lambda x: int(x, 0), default=0x80000, help="synthetic ROM size")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save-rom', help="write the ROM image to this file, for comparing dumps")
+    parser.add_argument('--base', type=lambda x: int(x, 0), default=0, help="ROM base address")
+    parser.add_argument('--depth', type=int, default=8192, help="rows per capture, half-channel mode")
+    parser.add_argument('--layout', default='deep', choices=sorted(LAYOUTS), help="pod layout, see above")
+    parser.add_argument('--latency', type=float, default=0.2, help="seconds from :start to trigger")
+    parser.add_argument('--bandwidth', type=float, help="link speed, bytes/s (default: unlimited)")
+    parser.add_argument('--glitch', type=float, default=0.0, help="fraction of captures with a discontinuity")
+    parser.add_argument('--stall', type=float, default=0.0, help="fraction of captures that never trigger")
+    parser.add_argument('--check', nargs=2, metavar=('START', 'CNT'), type=lambda x: int(x, 0),
+                        help="dump this range with batchcapture.dumploop and verify it; "
+                             "with -n > 1, with paralleldump.dump_parallel on all LAs")
+    parser.add_argument('--check-sync', action='store_true', help="upload files with ial2.py sync, verify what was sent")
+    parser.add_argument('--pipelined', action='store_true', help="--check with dumploop_pipelined")
+    parser.add_argument('--optimize', action='store_true',
+                        help="--check : let dumploop pick the LA mode and machines (lacapacity.py)")
+    parser.add_argument('--image', help="--check with batchcapture.resume_dump into this file")
+    parser.add_argument('--stream', action='store_true', help="--check : decode captures while they arrive")
+    parser.add_argument('--metrics', help="--check : write per-capture timings (JSON Lines) to this file")
+    parser.add_argument('--wait', default='auto', choices=('auto', 'srq', 'poll'),
+                        help="--check : capture_waiter strategy")
+    parser.add_argument('--timeout', type=int, default=5000, help="--check : ms to wait for each trigger")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args()
+
+    if args.rom:
+        with open(args.rom, 'rb') as f:
+            rom = f.read()
+    else:
+        rom = synthetic_rom(args.romsize, args.seed)
+    if args.save_rom:
+        with open(args.save_rom, 'wb') as f:
+            f.write(rom)
+
+    def mk():
+        return sim_la(rom, args.base, args.depth, args.latency, args.bandwidth, args.glitch,
+                      args.seed, args.verbose, args.layout, args.stall)
+
+    if args.pipelined and args.stream:
+        parser.error("--stream doesn't apply to --pipelined, which decodes while the next capture runs")
+    if args.check_sync:
+        raise SystemExit(0 if check_sync(mk()) else 1)
+    try:
+        if args.check and args.count > 1:
+            ok = check_parallel([mk() for _ in range(args.count)], *args.check, image=args.image,
+                                wait_strategy=args.wait, timeout=args.timeout, optimize=args.optimize,
+                                **({'stream': True} if args.stream else {}))
+            raise SystemExit(0 if ok else 1)
+        if args.check:
+            metrics = dumpmetrics.capture_metrics(args.metrics) if args.metrics else None
+            try:
+                ok = check_dump(mk(), *args.check, pipelined=args.pipelined,
+                                image=args.image, wait_strategy=args.wait, timeout=args.timeout,
+                                optimize=args.optimize,
+                                **({'stream': True} if args.stream else {}), metrics=metrics)
+            finally:
+                if metrics is not None:
+                    metrics.close()
+            raise SystemExit(0 if ok else 1)
+    except acqstore.JournalMismatch as e:
+        raise SystemExit(f"{e} : the journal belongs to another dump, delete it or pass the same range")
+
+    servers = []
+    for i in range(args.count):
+        srv = start_sim(mk(), args.bind, args.port + i)
+        servers.append(srv)
+        print(f"simulated LA on {args.bind}:{args.port + i}, ROM {len(rom):#x} bytes @ {args.base:#x}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    for srv in servers:
+        srv.shutdown()
+
+if __name__ == '__main__':
+    main()
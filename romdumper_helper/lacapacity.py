@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+#
+# (c) fenugrec 2025
+#
+# choose the LA setup that gets the most ROM per capture, for batchcapture
+#
+'''
+Every capture costs a target reset, so the fewer captures per ROM the better. What one
+capture can bring depends on how the LA is set up :
+
+	- acquisition mode : in half-channel mode (DEEP), only one pod of each pod pair is
+	  acquired, and memory depth doubles (8k rows instead of 4k on the 1660C). Only
+	  possible if the ADDR and DATA labels use at most one pod of each pair.
+
+	- machines : if machine 2 is also a state analyzer with ADDR and DATA labels (i.e.
+	  the same bus is probed on its pods too), each machine gets its own term B, so one
+	  target reset captures two address windows.
+
+plan_capacity() reads the model (*idn?), the pod assignment and labels of both machines,
+and lists the usable setups with their ROM bytes per capture; optimize_capacity() also
+applies the best one. Pods and labels are never changed, only the mode; after
+switching to DEEP the labels are read again to make sure no bits were lost (the Format
+menu decides which pod of a pair is kept), otherwise the next best setup is used.
+
+	cfg = optimize_capacity(la)
+	-> capture_config(machines=(1,), mode='DEEP', rows=8192, nbytes=16384)
+'''
+
+import collections
+import contextlib
+
+from lasession import la_session, batched, cache_kept
+
+# model : (pods, rows in full-channel mode, rows in half-channel mode)
+MODELS = {
+    '1660C': (8, 4096, 8192), '1660CS': (8, 4096, 8192), '1660CP': (8, 4096, 8192),
+    '1661C': (6, 4096, 8192), '1661CS': (6, 4096, 8192), '1661CP': (6, 4096, 8192),
+    '1662C': (4, 4096, 8192), '1662CS': (4, 4096, 8192), '1662CP': (4, 4096, 8192),
+    '1663C': (2, 4096, 8192), '1663CS': (2, 4096, 8192), '1663CP': (2, 4096, 8192),
+}
+DEFAULT_MODEL = (8, 4096, 8192)
+
+# how a state machine is set up. amask, dmask : ADDR and DATA label masks, one per pod
+# in 'pods' order (as :mach<n>:ass? lists them)
+machine_info = collections.namedtuple('machine_info', 'mach pods amask dmask')
+
+# one way to set up the LA. machines : state machines to arm, each with its own term B.
+# rows : per machine; nbytes : ROM bytes per capture, i.e. per target reset
+capture_config = collections.namedtuple('capture_config', 'machines mode rows nbytes')
+
+
+# label masks of machine 'mach' : (podlist, ADDR masks, DATA masks), one mask per pod.
+# full : read them in full-channel mode and restore the mode after; in half-channel mode
+# the masks only show the pods that are acquired (see batchcapture.get_mask).
+# Nothing to switch if the machine is in full-channel mode already
+def read_labels(instr, mach=1, full=True):
+    m = f':mach{mach}'
+    origmode = instr.query(f'{m}:sfor:mode?')
+    full = full and origmode.strip().upper() != 'FULL'
+    # the mode is restored : what was cached before still holds, the FULL labels don't
+    with cache_kept(instr) if full else contextlib.nullcontext():
+        with batched(instr):
+            if full:
+                instr.write(f'{m}:sfor:mode FULL')
+            am_str = instr.query(f'{m}:sfor:label? "ADDR"').split(',')[3:]
+        dm_str = instr.query(f'{m}:sfor:label? "DATA"').split(',')[3:]
+        if full:
+            instr.write(f'{m}:sfor:mode ' + origmode)
+# returns something like '"ADDR  ",POSITIVE,0,0,3840,65535'
+# where the numeric fields are <clock_bits>,<bitmask>,<bitmask>...
+# and each bitmask applies to a pod ; matches left-to-right ordering of Format display
+# label string 'ADDR' is case-sensitive !
+    podlist = instr.query_ascii_values(f'{m}:ass?', 'd')
+    return (podlist, list(map(int, am_str)), list(map(int, dm_str)))
+
+# machine_info of state machine 'mach', None if it's off or can't be used
+def read_machine(instr, mach):
+    mtype = instr.query(f':mach{mach}:type?').strip().upper()
+    if not mtype.startswith('STAT'):
+        print(f"machine {mach}: {mtype or 'OFF'}, not used")
+        return None
+    try:
+        pods, am, dm = read_labels(instr, mach)
+    except Exception as e:
+        print(f"machine {mach}: can't read labels ({e})")
+        return None
+    if not any(am) or not any(dm):
+        print(f"machine {mach}: no ADDR / DATA labels, not used")
+        return None
+    return machine_info(mach, pods, am, dm)
+
+# pods with ADDR or DATA bits
+def used_pods(info):
+    return {p for p, a, d in zip(info.pods, info.amask, info.dmask) if a or d}
+
+# True if the labels fit in half-channel mode : at most one pod of each pair
+def fits_half(info):
+    used = used_pods(info)
+    return len({(p - 1) // 2 for p in used}) == len(used)
+
+def count_bits(masks):
+    return sum(bin(m).count('1') for m in masks)
+
+
+# list the setups that can be used, best first (most bytes per capture, then fewer machines)
+# max_machines : 1 to stick to machine 1
+# depths : (full, half) rows, to override the model table
+def plan_capacity(instr, datawidth=2, max_machines=2, depths=None):
+    model = instr.query('*idn?').split(',')[1].strip()
+    if model not in MODELS:
+        print(f"unknown model {model}, assuming {DEFAULT_MODEL[0]} pods, {DEFAULT_MODEL[1]}/{DEFAULT_MODEL[2]} rows")
+    npods, full_rows, half_rows = MODELS.get(model, DEFAULT_MODEL)
+    if depths is not None:
+        full_rows, half_rows = depths
+    machines = []
+    for n in range(1, max_machines + 1):
+        info = read_machine(instr, n)
+        if info is None:
+            break
+        machines.append(info)
+    if not machines:
+        raise ValueError("machine 1 must be a state analyzer with ADDR and DATA labels")
+
+    configs = []
+    for k in range(1, len(machines) + 1):
+        used = machines[:k]
+        for mode, rows in (('FULL', full_rows), ('DEEP', half_rows)):
+            if mode == 'DEEP' and not all(fits_half(m) for m in used):
+                continue
+            configs.append(capture_config(tuple(m.mach for m in used), mode, rows, k * rows * datawidth))
+    configs.sort(key=lambda c: (-c.nbytes, len(c.machines)))
+
+    assigned = {p for m in machines for p in m.pods}
+    print(f"capacity: {model}, {npods} pods; "
+          + '; '.join(f"machine {m.mach} : pods {','.join(map(str, sorted(m.pods)))}"
+                      + ('' if fits_half(m) else ' (labels on both pods of a pair, no half-channel)')
+                      for m in machines))
+    print(f"  {'machines':<9} {'mode':<5} {'rows':>6} {'bytes/capture':>14}")
+    for c in configs:
+        print(f"  {','.join(map(str, c.machines)):<9} {c.mode:<5} {c.rows:>6} {c.nbytes:>#14x}")
+    free = set(range(1, npods + 1)) - assigned
+    if len(machines) < 2 and max_machines > 1 and len(free) >= len(used_pods(machines[0])):
+        print(f"pods {','.join(map(str, sorted(free)))} are free : probing the bus on them too, as a "
+              "state machine 2 with ADDR and DATA labels, would capture 2 windows per reset")
+    return configs
+
+# set the acquisition mode of cfg's machines. Returns False if labels lost bits in
+# half-channel mode (the mode is then set back to FULL)
+def apply_config(instr, cfg):
+    for n in cfg.machines:
+        instr.write(f':mach{n}:sfor:mode {cfg.mode}')
+    if cfg.mode != 'DEEP':
+        return True
+    for n in cfg.machines:
+        _, am, dm = read_labels(instr, n)
+        _, ham, hdm = read_labels(instr, n, full=False)
+        if count_bits(am) != count_bits(ham) or count_bits(dm) != count_bits(hdm):
+            print(f"machine {n}: half-channel mode drops label bits, check which pod of each "
+                  "pair is selected in the Format menu")
+            for m in cfg.machines:
+                instr.write(f':mach{m}:sfor:mode FULL')
+            return False
+    return True
+
+# plan_capacity(), then apply the best setup that works. Returns its capture_config.
+# On an la_session the choice is kept, and later calls return it without a round trip,
+# until the LA config changes (see la_session.invalidate) or replan=True
+def optimize_capacity(instr, datawidth=2, max_machines=2, depths=None, replan=False):
+    if not isinstance(instr, la_session):
+        return choose_capacity(instr, datawidth, max_machines, depths)
+    key = ('capacity', datawidth, max_machines, depths)
+    if replan:
+        instr.cache.pop(key, None)
+    return instr.memo(key, lambda: choose_capacity(instr, datawidth, max_machines, depths))
+
+def choose_capacity(instr, datawidth, max_machines, depths):
+    for cfg in plan_capacity(instr, datawidth, max_machines, depths):
+        if apply_config(instr, cfg):
+            print(f"using machine(s) {','.join(map(str, cfg.machines))} in {cfg.mode} mode : "
+                  f"{cfg.nbytes:#x} bytes per capture")
+            return cfg
+    raise ValueError("no usable LA setup")
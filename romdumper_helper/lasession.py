@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+#
+# (c) fenugrec 2025
+#
+# instrument session wrapper for batchcapture : command batching and cached state
+#
+'''
+la_session wraps a pyvisa resource and can be used wherever one is expected
+(anything it doesn't define is passed through to the resource). It adds :
+
+	- batching : inside 'with la.batch():', writes are queued and sent as a single
+	  ';'-separated program message when the block ends, or together with the next
+	  query. e.g. arm() sends term B, *cls and :start in one message instead of three.
+	  Only for commands without block data; write_binary_values() etc. flush first.
+
+	- cached state : replies to queries that only change when the LA config does
+	  (*idn?, :mach<n>:sfor:mode?, :mach<n>:sfor:label?, :mach<n>:ass?, :mach<n>:type?)
+	  are kept, as well as anything computed through memo(), e.g. get_mask(). Writes that change the
+	  config (format, pod assignment, *rst, loading a config file, ...) clear the
+	  cache, unless they set a value the cache says is already in effect (e.g.
+	  ':mach1:sfor:mode FULL' after ':mach1:sfor:mode?' said FULL); call invalidate()
+	  after changing things on the front panel.
+
+	- block transfers : query_block() reads an IEEE-488.2 definite-length block
+	  (#<n><length><data>) straight into a buffer that is allocated once and reused,
+	  in large reads with the termination character disabled. pyvisa's
+	  query_binary_values() stops every read at the first 0x0A byte in the data and
+	  concatenates the pieces, which is slow on captures of a few 100 kB.
+	  stream_block() hands the block to a callback piece by piece instead, for
+	  decoding while the transfer is still going (see batchcapture.stream_decoder).
+
+On GPIB and RS-232, every round trip counts : arming a capture is now 1 message
+instead of 3, and get_mask()'s round trips happen once per session instead of once
+per dumploop() call.
+'''
+
+import contextlib
+import time
+
+from pyvisa import constants
+
+# queries whose replies are cached, short and long forms
+CACHED_QUERIES = (
+    '*idn?',
+    ':mach1:sfor:mode?', ':machine1:sformat:mode?',
+    ':mach1:sfor:lab?', ':mach1:sfor:label?', ':machine1:sformat:label?',
+    ':mach1:ass?', ':machine1:assign?',
+    ':mach1:type?', ':machine1:type?',
+    ':mach2:sfor:mode?', ':machine2:sformat:mode?',
+    ':mach2:sfor:lab?', ':mach2:sfor:label?', ':machine2:sformat:label?',
+    ':mach2:ass?', ':machine2:assign?',
+    ':mach2:type?', ':machine2:type?',
+)
+
+# commands after which cached state may be stale
+CONFIG_COMMANDS = (
+    '*rst', '*rcl',
+    ':mach1:sfor', ':machine1:sformat',
+    ':mach1:ass', ':machine1:assign',
+    ':mach1:type', ':machine1:type',
+    ':mach2:sfor', ':machine2:sformat',
+    ':mach2:ass', ':machine2:assign',
+    ':mach2:type', ':machine2:type',
+    ':mmem:load', ':mmemory:load',
+)
+
+
+# reads definite-length blocks into a reusable buffer. Keeps transfer stats
+class block_reader:
+    __slots__ = ('buf', 'chunk_size', 'verbose', 'nbytes', 'seconds', 'rate')
+
+    def __init__(self, chunk_size=0x40000, verbose=True):
+        self.buf = bytearray()
+        self.chunk_size = chunk_size
+        self.verbose = verbose
+        self.nbytes = 0         # totals over all blocks
+        self.seconds = 0.0
+        self.rate = None        # bytes/s of the last block
+
+    # send 'q' on pyvisa resource 'instr', return the block as a memoryview into the
+    # buffer : only valid until the next read(), copy it if it must live longer.
+    def read(self, instr, q):
+        t0 = time.monotonic()
+        n = self._header(instr, q)
+        if len(self.buf) < n:
+            self.buf = bytearray(n)
+        mv = memoryview(self.buf)
+        got = 0
+
+        def store(d):
+            nonlocal got
+            mv[got:got + len(d)] = d
+            got += len(d)
+        self._body(instr, n, self.chunk_size, store)
+        self._stats(n, t0)
+        return mv[:n]
+
+    # same, but the block is never held whole : feed(piece) is called with every piece
+    # as it arrives, at most 'window' bytes each. Returns the block length
+    def stream(self, instr, q, feed, window=0x4000):
+        t0 = time.monotonic()
+        n = self._header(instr, q)
+        self._body(instr, n, window, feed)
+        self._stats(n, t0)
+        return n
+
+    # send the query, read '#<n><length>'; returns length
+    def _header(self, instr, q):
+        instr.write(q)
+        hdr = instr.read_bytes(2)
+        if hdr[0:1] != b'#' or not hdr[1:2].isdigit():
+            raise ValueError(f"expected a block, got {hdr!r}")
+        nd = int(hdr[1:2])
+        if not nd:
+            raise ValueError("indefinite-length blocks not supported")
+        return int(instr.read_bytes(nd))
+
+    # read n bytes of block data, in reads of up to 'size', passing each to put()
+    def _body(self, instr, n, size, put):
+        # the data is binary : don't stop at every 0x0A
+        term = instr.read_termination
+        instr.read_termination = None
+        got = 0
+        try:
+            with instr.ignore_warning(constants.StatusCode.success_max_count_read,
+                                      constants.StatusCode.success_device_not_present):
+                while got < n:
+                    d, status = instr.visalib.read(instr.session, min(size, n - got))
+                    put(d)
+                    got += len(d)
+        finally:
+            instr.read_termination = term
+        # message terminator after the block
+        if term:
+            instr.read_bytes(len(term))
+
+    def _stats(self, n, t0):
+        dt = time.monotonic() - t0
+        self.nbytes += n
+        self.seconds += dt
+        self.rate = n / dt if dt else None
+        if self.verbose:
+            print(f"block: {n} bytes in {dt:.3f}s"
+                  + (f", {self.rate / 1000:.0f} kB/s" if self.rate else ''))
+
+    # average over all blocks, bytes/s
+    def avg_rate(self):
+        return self.nbytes / self.seconds if self.seconds else None
+
+
+class la_session:
+    __slots__ = ('instr', 'cache', 'pending', 'depth', 'nmessages', 'blocks')
+
+    def __init__(self, instr, chunk_size=0x40000):
+        self.instr = instr
+        self.cache = {}
+        self.pending = []
+        self.depth = 0          # nesting level of batch()
+        self.nmessages = 0      # program messages actually sent
+        self.blocks = block_reader(chunk_size)
+
+    def __getattr__(self, name):
+        return getattr(self.instr, name)
+
+    # e.g. la.timeout = 10000 : goes to the resource
+    def __setattr__(self, name, value):
+        if name in la_session.__slots__:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.instr, name, value)
+
+    # stale cache after e.g. changing the setup on the LA itself
+    def invalidate(self):
+        self.cache.clear()
+
+    # value of fn(), computed once until the next invalidate()
+    def memo(self, key, fn):
+        if key not in self.cache:
+            self.cache[key] = fn()
+        return self.cache[key]
+
+    # for config changes that are undone inside the block, e.g. lacapacity.read_labels()
+    # switching to full-channel mode and back : the cache is left as it was before.
+    # If the block raises, the config may not be back, so the cache is cleared
+    @contextlib.contextmanager
+    def cache_kept(self):
+        saved = dict(self.cache)
+        try:
+            yield self
+        except BaseException:
+            self.cache.clear()
+            raise
+        self.cache = saved
+
+    def _check_config(self, cmd):
+        c = cmd.strip().lower()
+        if not c.startswith(CONFIG_COMMANDS):
+            return
+        # setting what the matching query last said : nothing changes
+        hdr, _, value = c.partition(' ')
+        cur = self.cache.get(hdr + '?')
+        if value and cur is not None and cur.strip().lower() == value.strip():
+            return
+        self.cache.clear()
+
+    # queue writes until the end of the block. Nests
+    @contextlib.contextmanager
+    def batch(self):
+        self.depth += 1
+        try:
+            yield self
+        finally:
+            self.depth -= 1
+            if not self.depth:
+                self.flush()
+
+    def flush(self):
+        if self.pending:
+            msg = ';'.join(self.pending)
+            self.pending = []
+            self.nmessages += 1
+            self.instr.write(msg)
+
+    def write(self, cmd):
+        self._check_config(cmd)
+        if self.depth:
+            self.pending.append(cmd)
+            return
+        self.nmessages += 1
+        return self.instr.write(cmd)
+
+    # pending writes go out in the same message as the query
+    def query(self, q):
+        key = q.strip().lower()
+        cacheable = key.startswith(CACHED_QUERIES)
+        if cacheable and key in self.cache and not self.pending:
+            return self.cache[key]
+        msg = ';'.join(self.pending + [q])
+        self.pending = []
+        self.nmessages += 1
+        resp = self.instr.query(msg)
+        if cacheable:
+            self.cache[key] = resp
+        return resp
+
+    def query_ascii_values(self, q, *args, **kw):
+        key = ('ascii', q.strip().lower())
+        if q.strip().lower().startswith(CACHED_QUERIES) and key in self.cache:
+            return list(self.cache[key])
+        self.flush()
+        self.nmessages += 1
+        vals = self.instr.query_ascii_values(q, *args, **kw)
+        if q.strip().lower().startswith(CACHED_QUERIES):
+            self.cache[key] = list(vals)
+        return vals
+
+    # block transfers : never batched
+    def query_binary_values(self, *args, **kw):
+        self.flush()
+        self.nmessages += 1
+        return self.instr.query_binary_values(*args, **kw)
+
+    # block reply to 'q', as a memoryview valid until the next query_block(); see block_reader
+    def query_block(self, q):
+        self.flush()
+        self.nmessages += 1
+        return self.blocks.read(self.instr, q)
+
+    # block reply to 'q', fed piece by piece to feed(); see block_reader.stream()
+    def stream_block(self, q, feed, window=0x4000):
+        self.flush()
+        self.nmessages += 1
+        return self.blocks.stream(self.instr, q, feed, window)
+
+    def write_binary_values(self, cmd, *args, **kw):
+        self.flush()
+        self._check_config(cmd)
+        self.nmessages += 1
+        return self.instr.write_binary_values(cmd, *args, **kw)
+
+    def read_raw(self, *args, **kw):
+        self.flush()
+        return self.instr.read_raw(*args, **kw)
+
+    def close(self):
+        self.flush()
+        self.instr.close()
+
+
+# la.batch() on a session, no-op on a plain pyvisa resource
+def batched(instr):
+    if isinstance(instr, la_session):
+        return instr.batch()
+    return contextlib.nullcontext(instr)
+
+# la.cache_kept() on a session, no-op on a plain pyvisa resource
+def cache_kept(instr):
+    if isinstance(instr, la_session):
+        return instr.cache_kept()
+    return contextlib.nullcontext(instr)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+#
+# (c) fenugrec 2025
+#
+# dump one ROM with several LAs at once, on top of batchcapture.dumploop()
+#
+'''
+dump_parallel() splits [start_addr, start_addr + cnt) into work units of 'unit' bytes
+and runs dumploop() on several LAs at once, one thread each. An LA takes the next unit
+as soon as it's done with the previous one, so a faster setup simply does more units.
+
+The LAs can watch identical targets, or the same bus through splitters; target_reset()
+is told which LA it's resetting for.
+
+All chunks are merged into one Acquisition, and optionally into one DumpSession image,
+which makes the whole dump resumable. A unit starts from what has been dumped so far,
+by any LA, so ranges that were already dumped aren't captured again.
+
+Chunks are merged as they come in, so a unit that fails half way keeps what it got.
+When a unit is over, whatever is still missing in it is queued again (a capture timed
+out, the trigger never came, ...); a range is given up after 'retries' attempts in a
+row that brought nothing new. An LA that raises (connection lost, VISA error, ...)
+puts the rest of its unit back, and after 'max_errors' errors in a row it isn't used
+any more.
+
+Ctrl-C cancels the captures in progress; the LAs stop and what's missing is reported.
+
+	las = [batchcapture.connect(h) for h in ('192.168.0.10', '192.168.0.11')]
+	dump_parallel(las, 0, 0x80000, image='rom.bin')
+'''
+
+import collections
+import threading
+import time
+
+from acqstore import Chunk, Acquisition, Coverage, DumpSession
+from batchcapture import dumploop, merge_chunks
+from lacapacity import optimize_capacity
+
+# a range to dump. attempt : how many times it was tried already
+work_unit = collections.namedtuple('work_unit', 'lo hi attempt')
+
+
+# hands out work units and merges the results; shared by the LA threads
+class dump_coordinator:
+    __slots__ = ('lo', 'hi', 'retries', 'queue', 'busy', 'cond', 'coverage', 'chunks',
+                 'session', 'failed', 'stop', 'cancel')
+
+    # session : DumpSession to merge into; its coverage is where we start from
+    def __init__(self, lo, hi, unit, datawidth=2, session=None, retries=3):
+        self.lo = lo
+        self.hi = hi
+        self.retries = retries
+        self.session = session
+        self.coverage = session.coverage if session is not None else Coverage()
+        self.chunks = Acquisition(datawidth=datawidth)
+        self.queue = collections.deque()
+        for a, b in self.coverage.gaps(lo, hi):
+            for u in range(a, b, unit):
+                self.queue.append(work_unit(u, min(u + unit, b), 0))
+        self.busy = 0           # units being dumped
+        self.cond = threading.Condition()
+        self.failed = []        # ranges given up
+        self.stop = False
+        self.cancel = threading.Event()     # ends the captures in progress, see dumploop
+
+    # next unit and a copy of the coverage so far ; None when there's nothing left.
+    # Waits while units are in progress, in case their leftovers get queued again
+    def take(self):
+        with self.cond:
+            while not self.stop:
+                while self.queue:
+                    u = self.queue.popleft()
+                    a = self.coverage.first_gap(u.lo, u.hi)
+                    if a is None:
+                        continue
+                    self.busy += 1
+                    return (u._replace(lo=a), self.coverage.copy())
+                if not self.busy:
+                    break
+                self.cond.wait()
+            return None
+
+    # store the parts of 'chunks' that weren't dumped yet, by any LA. Returns their size
+    def merge(self, chunks):
+        with self.cond:
+            new = 0
+            for c in chunks:
+                for a, b in list(self.coverage.gaps(max(c.start, self.lo), min(c.end, self.hi))):
+                    piece = Chunk(a, c.datawidth, data=c.data[a - c.start:b - c.start])
+                    self.chunks.add(piece)
+                    if self.session is not None:
+                        self.session.add(piece)
+                    else:
+                        self.coverage.add(a, b)
+                    new += b - a
+            return new
+
+    # unit 'u' is over : queue what's still missing in it again.
+    # new : bytes it brought; attempts that made progress don't count.
+    # error : the LA failed, not the unit; doesn't count either
+    def done(self, u, new=0, error=False):
+        with self.cond:
+            self.busy -= 1
+            if new:
+                attempt = 0
+            else:
+                attempt = u.attempt if error else u.attempt + 1
+            for a, b in self.coverage.gaps(u.lo, u.hi):
+                if attempt >= self.retries:
+                    print(f"giving up on {a:#x}-{b - 1:#x} after {attempt} attempts")
+                    self.failed.append((a, b))
+                else:
+                    self.queue.append(work_unit(a, b, attempt))
+            self.cond.notify_all()
+
+    # an LA quits : others may have been waiting for its unit
+    def leave(self):
+        with self.cond:
+            self.cond.notify_all()
+
+    def missing(self):
+        return (self.hi - self.lo) - self.coverage.covered(self.lo, self.hi)
+
+    # no more units, and the captures in progress end
+    def cancel_all(self):
+        with self.cond:
+            self.stop = True
+            self.cancel.set()
+            self.cond.notify_all()
+
+
+# what dumploop() of one unit gets as its session : chunks go to the coordinator as
+# they come in, so they're kept even if the loop raises later.
+# coverage : the unit's copy, what dumploop() plans from
+class unit_sink:
+    __slots__ = ('co', 'coverage', 'new')
+
+    def __init__(self, co, coverage):
+        self.co = co
+        self.coverage = coverage
+        self.new = 0            # bytes no LA had dumped yet
+
+    def add(self, chunk):
+        self.new += self.co.merge([chunk])
+
+
+# per-LA totals
+la_stats = collections.namedtuple('la_stats', 'units new errors seconds')
+
+# one LA : take units until there are none left, or the LA keeps failing
+def dump_worker(co, instr, datawidth, optimize, max_errors, stats, n, kw):
+    t0 = time.monotonic()
+    units = new = errors = total_errors = 0
+    try:
+        cfg = optimize_capacity(instr, datawidth) if optimize else False
+    except Exception as e:
+        print(f"LA {n}: setup failed ({e!r}), not used")
+        co.leave()
+        stats[n] = la_stats(0, 0, 1, 0.0)
+        return
+    while errors < max_errors:
+        job = co.take()
+        if job is None:
+            break
+        u, cov = job
+        print(f"LA {n}: unit {u.lo:#x}-{u.hi - 1:#x}" + (f", attempt {u.attempt + 1}" if u.attempt else ''))
+        sink = unit_sink(co, cov)
+        try:
+            dumploop(instr, u.lo, u.hi - u.lo, datawidth, optimize=cfg, session=sink,
+                     cancel=co.cancel, **kw)
+        except Exception as e:
+            errors += 1
+            total_errors += 1
+            new += sink.new
+            print(f"LA {n}: {e!r}, {sink.new:#x} bytes kept, rest of unit {u.lo:#x}-{u.hi - 1:#x} put back")
+            co.done(u, sink.new, error=True)
+            continue
+        errors = 0
+        units += 1
+        new += sink.new
+        co.done(u, sink.new)
+    if errors >= max_errors:
+        print(f"LA {n}: {errors} errors in a row, not used any more")
+    co.leave()
+    stats[n] = la_stats(units, new, total_errors, time.monotonic() - t0)
+
+
+# dump [start_addr, start_addr + cnt) with all LAs in 'instrs' at once; returns an Acquisition,
+# sorted and without overlaps (see batchcapture.merge_chunks)
+# unit : work unit size, in bytes. A few captures' worth, so the work spreads evenly
+# image : also merge into this image file, resuming from its journal (see resume_dump)
+# optimize : lacapacity.optimize_capacity() on every LA first (see dumploop); off by
+#   default, the LAs are used as they are set up
+# stop_wait : seconds to wait for the LAs after Ctrl-C
+# other keyword args go to dumploop() (timeout, wait_strategy, stream); not 'metrics',
+# which times a single loop. With automated resets, give a timeout : without one, a
+# capture that never triggers holds its LA forever instead of being queued again
+def dump_parallel(instrs, start_addr, cnt, datawidth=2, unit=0x10000, image=None, retries=3,
+                  max_errors=3, optimize=False, stop_wait=30, **kw):
+    session = DumpSession(image, start_addr, cnt, datawidth) if image else None
+    co = dump_coordinator(start_addr, start_addr + cnt, unit, datawidth, session, retries)
+    print(f"{len(instrs)} LAs, {len(co.queue)} units of {unit:#x} bytes, {co.missing():#x} bytes to go")
+    stats = {}
+    threads = [threading.Thread(target=dump_worker, daemon=True,
+                                args=(co, instr, datawidth, optimize, max_errors, stats, n, kw))
+               for n, instr in enumerate(instrs)]
+    t0 = time.monotonic()
+    for t in threads:
+        t.start()
+    try:
+        for t in threads:
+            # short joins, so that Ctrl-C gets a chance
+            while t.is_alive():
+                t.join(0.5)
+    except KeyboardInterrupt:
+        print("cancelling : waiting for the LAs to stop, Ctrl-C again to quit now")
+        co.cancel_all()
+        deadline = time.monotonic() + stop_wait
+        try:
+            for t in threads:
+                while t.is_alive() and time.monotonic() < deadline:
+                    t.join(0.5)
+        except KeyboardInterrupt:
+            pass
+    finally:
+        busy = [n for n, t in enumerate(threads) if t.is_alive()]
+        if busy:
+            # closing it under them would lose their last chunks; the journal is up to date
+            print(f"LA {', '.join(map(str, busy))} still busy, {image or 'dump'} left open")
+        elif session is not None:
+            session.close()
+    dt = time.monotonic() - t0
+    for n in sorted(stats):
+        s = stats[n]
+        print(f"LA {n}: {s.units} units, {s.new:#x} new bytes, {s.errors} errors, {s.seconds:.1f}s")
+    left = co.missing()
+    print(f"dumped {cnt - left:#x}/{cnt:#x} bytes in {dt:.2f}s with {len(instrs)} LAs"
+          + (f", {left:#x} bytes missing" if left else ''))
+    for a, b in co.coverage.gaps(co.lo, co.hi):
+        print(f"  missing : {a:#x}-{b - 1:#x}")
+    return merge_chunks(co.chunks, datawidth)
@@ -1,86 +1,120 @@
 #!/bin/python3
 # (c) fenugrec 2023
 
-# assumes file already has the HPFSLIF header (0x200 bytes) stripped.
+# assumes file already has the HPFSLIF header (0x200 bytes) stripped, unless --hfs is given.
 # file should look like repeated blocks of "00 FE <254 bytes of fw data>"
 # Format : "XX YY <byte_0> <byte...> <byte_n>", where n = XXYY - 1 (block length is big-endian and refers to actual payload data)
+#
+# Regular files are mmap'd. stdin ('-'), pipes, or any file with -s are read as a stream
+# with large reads, and payload is written in large writes.
+# Several input files can be given; use -d to extract each one into a directory.
 
 
 
 from argparse import ArgumentParser
+import contextlib
 import mmap
+import os
+import sys
 
-def extract_blocks(fname, out_file):
-	with open(fname, "rb") as f:
-		mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+import chunking
+
+HFS_HDR_LEN = 0x200
+HFS_MAGIC = b'\x80\x00HFSLIF'
+BUFSIZE = 0x100000
 
+def extract_blocks(fname, out_file, strip_hfs=False, stream=False):
 	with open(out_file, "wb") as outf:
-		pl_len = 0
-		f_pos = 0
-		last_len = 0
-		while f_pos < mm.size():
-			mm.seek(f_pos)
-			block_len = (mm[f_pos] << 8) + mm[f_pos + 1]
-
-			#possible last-block marker ? it may be part 
-			if (block_len == 0xffff):
-				remaining_payload = mm.size() - f_pos - 2
-				print("lastblock ? {:#x} more bytes; previous block {:#x}".format(remaining_payload, last_len))
-				block_len = remaining_payload
-
-			if (block_len != 0xfe):
-				print("irregular block @ fileoffs {:#x}: size={:#x}".format(f_pos, block_len))
-
-			outf.write(mm[f_pos+2 : f_pos+2+block_len])
-			pl_len += block_len
-			f_pos += 2 + block_len
-			last_len = block_len
-
-		print("Done. Payload size: {:#x}, filesize {:#x}, last pos {:#x}".format(pl_len, mm.size(), f_pos))
-	return
-
-def list_blocks(fname):
+		bmap = process(fname, outf, strip_hfs, stream)
+	print("Done.")
+	return bmap
+
+def list_blocks(fname, strip_hfs=False, stream=False):
+	return process(fname, None, strip_hfs, stream)
+
+# parse one input file ('-' for stdin), write payload to outf (binary file object, or None to only list blocks).
+# Uses mmap if possible, otherwise the streaming parser.
+# Block offsets are relative to the start of chunked data, i.e. after the HFSLIF header if stripped
+def process(fname, outf, strip_hfs=False, stream=False, bufsize=BUFSIZE):
+	if fname == '-':
+		return process_stream(sys.stdin.buffer, outf, strip_hfs, bufsize)
 	with open(fname, "rb") as f:
-		mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
-
-	pl_len = 0
-	f_pos = 0
-	last_len = 0
-	while f_pos < mm.size():
-		mm.seek(f_pos)
-		block_len = (mm[f_pos] << 8) + mm[f_pos + 1]
-
-		#possible last-block marker ? it may be part 
-		if (block_len == 0xffff):
-			remaining_payload = mm.size() - f_pos - 2
-			print("lastblock ? {:#x} more bytes; previous block {:#x}".format(remaining_payload, last_len))
-			block_len = remaining_payload
-
-		if (block_len != 0xfe):
-			print("irregular block @ fileoffs {:#x}: +{:#x}".format(f_pos, block_len))
-		pl_len += block_len
-		f_pos += 2 + block_len
-		last_len = block_len
-
-	print("Payload size: {:#x}, filesize {:#x}, last pos {:#x}".format(pl_len, mm.size(), f_pos))
-
-	return
+		mm = None
+		if not stream:
+			try:
+				mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+			except (ValueError, OSError):
+				pass	# empty file, pipe, fifo...
+		if mm is None:
+			return process_stream(f, outf, strip_hfs, bufsize)
+
+	start = 0
+	if strip_hfs:
+		if mm[0:8] != HFS_MAGIC:
+			print(f"{fname}: no HFSLIF header, skipping")
+			return
+		start = HFS_HDR_LEN
+	data = memoryview(mm)[start:]
+	if outf is None:
+		bmap = chunking.scan(data)
+	else:
+		bmap = chunking.unchunk_to(data, outf, bufsize=bufsize)
+	bmap.print_info(mm.size() - start)
+	return bmap
+
+def process_stream(inf, outf, strip_hfs=False, bufsize=BUFSIZE):
+	if strip_hfs:
+		hdr = inf.read(HFS_HDR_LEN)
+		if hdr[0:8] != HFS_MAGIC or len(hdr) != HFS_HDR_LEN:
+			print("no HFSLIF header, skipping")
+			return
+	bmap = chunking.unchunk_stream(inf, outf, bufsize=bufsize)
+	bmap.print_info()
+	return bmap
 
 def main():
 	parser = ArgumentParser()
-	parser.add_argument('fname', help="filename")
-	parser.add_argument('-x', help="extract payload to specified output file")
+	parser.add_argument('fname', nargs='+', help="filename(s), '-' for stdin")
+	parser.add_argument('-x', help="extract payload to specified output file, '-' for stdout (single input only)")
+	parser.add_argument('-d', help="extract payload of each input to <dir>/<input name>.bin")
 	parser.add_argument('-i', action="store_true", help="only print block info")
+	parser.add_argument('-s', '--stream', action="store_true", help="don't mmap, read input as a stream")
+	parser.add_argument('--hfs', action="store_true", help="input has a 0x200-byte HFSLIF header, strip it")
+	parser.add_argument('-b', '--bufsize', type=lambda x: int(x, 0), default=BUFSIZE, help="read/write size for streaming")
 	args = parser.parse_args()
 
 	#print(args)
 
 	if args.i:
-		list_blocks(args.fname)
+		for fname in args.fname:
+			print(f"{fname}:")
+			process(fname, None, args.hfs, args.stream, args.bufsize)
 		return
 
 	if args.x:
-		extract_blocks(args.fname, args.x)
+		if len(args.fname) > 1:
+			parser.error("-x takes a single input file, use -d for several")
+		fname = args.fname[0]
+		if args.x == '-':
+			# keep stdout clean for the payload
+			outf = sys.stdout.buffer
+			with contextlib.redirect_stdout(sys.stderr):
+				process(fname, outf, args.hfs, args.stream, args.bufsize)
+				outf.flush()
+			return
+		with open(args.x, "wb") as outf:
+			process(fname, outf, args.hfs, args.stream, args.bufsize)
+		print("Done.")
+		return
+
+	if args.d:
+		os.makedirs(args.d, exist_ok=True)
+		for fname in args.fname:
+			base = 'stdin' if fname == '-' else os.path.basename(fname)
+			out_file = os.path.join(args.d, base + '.bin')
+			print(f"{fname} -> {out_file}")
+			with open(out_file, "wb") as outf:
+				process(fname, outf, args.hfs, args.stream, args.bufsize)
 
 if __name__ == '__main__':
     main()